@@ -72,6 +72,10 @@ class _ExtensionMetaclass(ABCMeta):
 # instances of all already requested extensions, keyed by (type,name)
 _extension_instances = {}
 
+# helper for unpickling extensions
+def _get_extension(cls, name):
+    return cls.get(name)
+
 
 class Extension(object):
     """
@@ -148,6 +152,13 @@ class Extension(object):
         """
         return cls._implementations.keys()
 
+    def __reduce__(self):
+        # Extensions are singletons, so pickle them by reference.
+        cls = type(self)
+        while not cls.__base__ is Extension:
+            cls = cls.__base__
+        return (_get_extension, (cls, self.name))
+
     @classmethod
     def all_properties_kinds(cls):
         """
@@ -549,6 +560,12 @@ class FileCompiler(Extension):
     #: (:const:`FileCompiler.MANY_TO_ONE`, e.g. the linker or Java compiler).
     cardinality = ONE_TO_ONE
 
+    #: Extension of the precompiled headers created by the compiler or None
+    #: if it can't precompile headers. Compilers that set it must implement
+    #: :meth:`precompiled_header_commands()` and accept optional
+    #: *precompiled_header* argument in :meth:`commands()`.
+    precompiled_header_extension = None
+
     def is_supported(self, toolset):
         """
         Returns whether given toolset is supported by this compiler.
@@ -572,6 +589,18 @@ class FileCompiler(Extension):
         """
         raise NotImplementedError
 
+    def precompiled_header_commands(self, toolset, target, header, output):
+        """
+        Returns list of commands (as :class:`bkl.expr.Expr`) to precompile
+        *header* into *output* or None if the header can't be precompiled
+        for this target.
+
+        Files compiled with the precompiled header get its name, without
+        :attr:`precompiled_header_extension`, in the *precompiled_header*
+        argument of :meth:`commands()`.
+        """
+        raise NotImplementedError
+
 
 class TargetType(Extension):
     """
@@ -631,6 +660,11 @@ class Toolset(Extension):
     # TODO: shouldn't be needed, get_compilation_subgraph() should figure it out.
     object_type = None
 
+    #: Whether the output is generated from the build graphs returned by
+    #: :meth:`bkl.api.TargetType.get_build_subgraph()`, as with makefiles,
+    #: rather than describing the targets directly, as IDE projects do.
+    uses_build_graphs = False
+
     #: List of all properties supported on this target type,
     #: as :class:`Property` instances. Note that properties list is
     #: automagically inherited from base classes, if any.
@@ -29,12 +29,15 @@ Helpers for working with :class:`bkl.api.FileType` and
 
 from api import FileType, FileCompiler, BuildNode, BuildSubgraph
 import model
-from error import Error, error_context
+from error import Error, CannotDetermineError, error_context
 import expr
 from expr import format_string
 
+from bkl.io import OutputFile, EOL_UNIX
+
 from itertools import izip_longest
 from collections import defaultdict
+import posixpath
 
 
 #: Native executable file type
@@ -142,7 +145,7 @@ def get_file_types_compilable_into(toolset, ft):
             yield ft_from
 
 
-def _make_build_nodes_for_file(toolset, target, srcfile, ft_to, files_map):
+def _make_build_nodes_for_file(toolset, target, srcfile, ft_to, files_map, pch=None):
     src = srcfile.filename
     assert isinstance(src, expr.PathExpr)
 
@@ -164,7 +167,7 @@ def _make_build_nodes_for_file(toolset, target, srcfile, ft_to, files_map):
         # this is flex/bison parser generator.
         for ft_source in get_file_types_compilable_into(toolset, ft_to):
             if get_compiler(toolset, ft_from, ft_source) is not None:
-                compilables, allnodes = _make_build_nodes_for_file(toolset, target, srcfile, ft_source, files_map)
+                compilables, allnodes = _make_build_nodes_for_file(toolset, target, srcfile, ft_source, files_map, pch)
                 objects = []
                 for o in compilables:
                     for outf in o.outputs:
@@ -173,19 +176,73 @@ def _make_build_nodes_for_file(toolset, target, srcfile, ft_to, files_map):
                                             target,
                                             model.SourceFile(target, outf, None),
                                             ft_to,
-                                            files_map)
+                                            files_map,
+                                            pch)
                         objects += objn
                         allnodes += alln
                 return (objects, allnodes)
         raise Error("don't know how to compile \"%s\" files into \"%s\"" % (ft_from.name, ft_to.name))
 
-    node = BuildNode(commands=compiler.commands(toolset, target, src, objname),
-                     inputs=[src],
+    if pch is not None and pch.compiler is compiler:
+        commands = compiler.commands(toolset, target, src, objname,
+                                     precompiled_header=pch.name)
+        inputs = [src] + pch.node.outputs
+    else:
+        commands = compiler.commands(toolset, target, src, objname)
+        inputs = [src]
+    node = BuildNode(commands=commands,
+                     inputs=inputs,
                      outputs=[objname],
                      source_pos=srcfile.source_pos)
     return ([node], [node])
 
 
+class _PrecompiledHeader(object):
+    """
+    Precompiled header used by the sources compiled by *compiler*, as
+    :class:`bkl.api.BuildNode` *node* creating it and *name* passed to the
+    compiler.
+    """
+    def __init__(self, compiler, name, node):
+        self.compiler = compiler
+        self.name = name
+        self.node = node
+
+
+def _make_precompiled_header(toolset, target):
+    # The header is precompiled for the main language of the target: C++ if
+    # it has any C++ sources and C otherwise, as the other language's
+    # compiler can't use it.
+    ft_from = CFileType.get()
+    for srcfile in target.sources:
+        try:
+            if srcfile.filename.get_extension() in CxxFileType.get().extensions:
+                ft_from = CxxFileType.get()
+                break
+        except CannotDetermineError:
+            pass
+    compiler = get_compiler(toolset, ft_from, toolset.object_type)
+    if compiler is None or compiler.precompiled_header_extension is None:
+        return None
+
+    header = target["precompiled-header"]
+    basename = "%s_%s" % (target.name, header.components[-1].as_py())
+    name = expr.PathExpr([expr.LiteralExpr(basename)],
+                         expr.ANCHOR_BUILDDIR,
+                         pos=header.pos)
+    output = expr.PathExpr([expr.LiteralExpr("%s.%s" % (basename, compiler.precompiled_header_extension))],
+                           expr.ANCHOR_BUILDDIR,
+                           pos=header.pos)
+    commands = compiler.precompiled_header_commands(toolset, target, header, output)
+    if commands is None:
+        return None
+    node = BuildNode(commands=commands,
+                     inputs=[header],
+                     outputs=[output],
+                     source_pos=header.pos)
+    return _PrecompiledHeader(compiler, name, node)
+
+
 def _make_build_nodes_for_generated_file(srcfile):
     commands_var = srcfile["compile-commands"]
     inputs=[srcfile.filename] + list(srcfile["dependencies"])
@@ -229,17 +286,34 @@ def get_compilation_subgraph(toolset, target, ft_to, outfile):
     allnodes = []
     files_map = disambiguate_intermediate_file_names(target.sources)
 
+    pch = None
+    if not target.is_variable_null("precompiled-header"):
+        pch = _make_precompiled_header(toolset, target)
+        if pch is not None:
+            allnodes.append(pch.node)
+
+    unity_sources = get_unity_sources(target)
+    in_unity_source = set()
+    for unity in unity_sources:
+        in_unity_source.update(unity.sources)
+
     for srcfile in target.sources:
         with error_context(srcfile):
+            if srcfile in in_unity_source:
+                continue
             if not srcfile.should_build(): # TODO: allow runtime decision
                 continue
             if srcfile["compile-commands"]:
                 allnodes += _make_build_nodes_for_generated_file(srcfile)
             else:
                 # FIXME: toolset.object_type shouldn't be needed
-                obj, all = _make_build_nodes_for_file(toolset, target, srcfile, toolset.object_type, files_map)
+                obj, all = _make_build_nodes_for_file(toolset, target, srcfile, toolset.object_type, files_map, pch)
                 objects += obj
                 allnodes += all
+    for unity in unity_sources:
+        obj, all = _make_build_nodes_for_file(toolset, target, unity.source, toolset.object_type, {}, pch)
+        objects += obj
+        allnodes += all
     for srcfile in target.headers:
         with error_context(srcfile):
             if not srcfile.should_build(): # TODO: allow runtime decision
@@ -261,6 +335,131 @@ def get_compilation_subgraph(toolset, target, ft_to, outfile):
 
 
 
+class UnitySource(object):
+    """
+    Generated source file of a unity build, including several sources of
+    the target.
+
+    .. attribute:: filename
+
+       Name of the generated file (:class:`bkl.expr.PathExpr`).
+
+    .. attribute:: source
+
+       :class:`bkl.model.SourceFile` object for the generated file.
+
+    .. attribute:: sources
+
+       List of :class:`bkl.model.SourceFile` objects included by it.
+    """
+    def __init__(self, target, filename, sources):
+        self.filename = filename
+        self.source = model.SourceFile(target, filename, target.source_pos)
+        self.sources = sources
+
+    def text(self):
+        """
+        Returns the content of the generated file.
+        """
+        basedir = "/".join(x.as_py() for x in self.filename.components[:-1]) or "."
+        text = ("// This file was automatically generated by bakefile.\n"
+                "//\n"
+                "// It compiles several sources of target \"%s\" together in unity\n"
+                "// build mode. Any manual changes will be lost if it is regenerated.\n\n"
+                % self.source.parent.name)
+        for srcfile in self.sources:
+            path = "/".join(x.as_py() for x in srcfile.filename.components)
+            text += "#include \"%s\"\n" % posixpath.relpath(path, basedir)
+        return text
+
+
+def _can_include_in_unity_source(target, srcfile):
+    # Conditional sources and those with per-file settings (including
+    # compile-commands) can't be compiled as part of another source, and
+    # neither can the source creating the precompiled header.
+    try:
+        if not srcfile.should_build():
+            return False
+    except CannotDetermineError:
+        return False
+    if srcfile["compile-commands"]:
+        return False
+    for name in srcfile.variables:
+        if not name.startswith("_") and srcfile.get_prop(name) is None:
+            return False
+    if srcfile.filename == target["precompiled-header-source"]:
+        return False
+    return True
+
+
+def get_unity_sources(target):
+    """
+    Returns list of :class:`UnitySource` objects for *target* built in
+    unity build mode, or empty list if it isn't or can't be.
+
+    C and C++ sources are grouped separately, each group in the order of
+    the target's sources and split into batches of at most
+    ``unity-build-batch-size`` files, so that the generated files only
+    change if the sources included in them do.
+    """
+    if target.get_prop("unity-build") is None or not target["unity-build"]:
+        return []
+    batch_size = int(target["unity-build-batch-size"].as_py())
+
+    groups = []
+    for ft in (CxxFileType.get(), CFileType.get()):
+        group = []
+        for srcfile in target.sources:
+            try:
+                ext = srcfile.filename.get_extension()
+            except CannotDetermineError:
+                continue
+            if ext in ft.extensions and _can_include_in_unity_source(target, srcfile):
+                group.append(srcfile)
+        while group:
+            size = batch_size or len(group)
+            groups.append((ft, group[:size]))
+            group = group[size:]
+
+    srcdir = [x for x in target.parent.srcdir_as_path().components if x.as_py() != "."]
+    unity_sources = []
+    for ft, sources in groups:
+        # there's nothing to gain from a file including just one source
+        if len(sources) < 2:
+            continue
+        name = "%s_unity%d.%s" % (target.name, len(unity_sources) + 1, ft.extensions[0])
+        filename = expr.PathExpr(srcdir + [expr.LiteralExpr(name)], expr.ANCHOR_TOP_SRCDIR)
+        unity_sources.append(UnitySource(target, filename, sources))
+    return unity_sources
+
+
+def get_unity_output_files(toolset, target):
+    """
+    Returns list of (not yet committed) :class:`bkl.io.OutputFile` objects
+    for the unity sources of *target* not yet written by another toolset.
+
+    The unity sources are the same for all toolsets, so they are recorded in
+    :attr:`bkl.model.Project.shared_outputs` and only written once.
+    """
+    written = target.project.shared_outputs
+    files = []
+    for unity in get_unity_sources(target):
+        filename = unity.filename.as_native_path_for_output(target)
+        text = unity.text()
+        if filename in written:
+            other = written[filename]
+            if other[1] != text:
+                raise Error("unity build source %s differs between toolsets %s and %s" %
+                            (filename, other[0], toolset.name),
+                            pos=target.source_pos)
+            continue
+        written[filename] = (toolset.name, text)
+        f = OutputFile(filename, EOL_UNIX, creator=toolset, create_for=target)
+        f.write(text)
+        files.append(f)
+    return files
+
+
 def disambiguate_intermediate_file_names(files):
     """
     Given a list of SourceFile objects, finds files that would have
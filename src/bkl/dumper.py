@@ -26,6 +26,8 @@
 Helpers for dumping Bakefile model into human-readable form.
 """
 
+import bkl.api
+import bkl.expr
 from bkl.interpreter import Interpreter
 
 
@@ -34,6 +36,18 @@ def dump_project(project):
     Returns string with dumped, human-readable description of 'project', which
     is an instance of bakefile.model.Project.
     """
+    out = dump_project_wide(project)
+    for mod in project.modules:
+        out += dump_module(mod)
+    return out.strip()
+
+
+def dump_project_wide(project):
+    """
+    Returns string with dumped, human-readable description of the parts of
+    'project' that are not specific to any module, i.e. settings and
+    project's variables.
+    """
     out = ""
     for s in project.settings.itervalues():
         out += _dump_setting(s)
@@ -41,9 +55,7 @@ def dump_project(project):
         out += "variables {\n"
         out += _indent(_dump_vars(project))
         out += "}\n"
-    for mod in project.modules:
-        out += dump_module(mod)
-    return out.strip()
+    return out
 
 
 def dump_module(module):
@@ -146,3 +158,121 @@ def _dump_setting(setting):
     out += _dump_vars(setting)
     out += "}\n"
     return out
+
+
+def export_model(project, toolset, out):
+    """
+    Writes machine-readable description of toolset-specific model *project*
+    into file object *out*, as a sequence of JSON objects, one per line
+    ("JSON lines" format).
+
+    Every object has ``toolset`` and ``kind`` keys, the latter being one of
+    ``project``, ``setting``, ``module`` and ``target``. The records are
+    written as soon as they are created, so the whole export is never kept in
+    memory.
+
+    If *toolset* generates its output from build graphs (see
+    :attr:`bkl.api.Toolset.uses_build_graphs`), e.g. makefiles or ninja,
+    targets' records include build nodes created by
+    :meth:`bkl.api.TargetType.get_build_subgraph()`.
+    """
+    import json
+    from bkl.interpreter.passes import PathsNormalizer
+    from bkl.error import error_context
+
+    def _write(kind, **kwargs):
+        kwargs["toolset"] = toolset.name
+        kwargs["kind"] = kind
+        out.write(json.dumps(kwargs, sort_keys=True))
+        out.write("\n")
+
+    _write("project",
+           configurations=[c.name for c in project.configurations.itervalues()],
+           variables=_export_vars(project))
+
+    for s in project.settings.itervalues():
+        _write("setting", name=s.name, variables=_export_vars(s))
+
+    if toolset.uses_build_graphs:
+        norm = PathsNormalizer(project)
+    else:
+        norm = None
+
+    for module in project.modules:
+        parent = module.parent
+        _write("module",
+               file=module.source_file,
+               name=module.fully_qualified_name,
+               parent=parent.source_file if parent is not project else None,
+               submodules=[s.source_file for s in module.submodules],
+               variables=_export_vars(module))
+
+        for t in module.targets.itervalues():
+            with error_context(t):
+                record = dict(
+                        module=module.source_file,
+                        name=t.name,
+                        type=t.type.name,
+                        variables=_export_vars(t),
+                        sources=[_export_source(s) for s in t.sources],
+                        headers=[_export_source(s) for s in t.headers])
+                if norm is not None and t.should_build():
+                    norm.set_context(t)
+                    graph = t.type.get_build_subgraph(toolset, t)
+                    record["build_nodes"] = [_export_build_node(n, norm)
+                                             for n in graph.all_nodes()]
+                _write("target", **record)
+
+
+def _export_expr(e):
+    # lists are exported as JSON arrays, everything else in the same textual
+    # form as used by dump_project()
+    if isinstance(e, bkl.expr.ListExpr):
+        return [_export_expr(x) for x in e.items]
+    else:
+        return str(e)
+
+
+def _flatten(e):
+    if isinstance(e, bkl.expr.ListExpr):
+        for x in e.items:
+            for y in _flatten(x):
+                yield y
+    else:
+        yield str(e)
+
+
+def _export_vars(part):
+    return dict((v.name, _export_expr(v.value)) for v in part.variables.itervalues())
+
+
+def _export_source(source):
+    return { "file": str(source.filename),
+             "variables": dict((name, _export_expr(v.value))
+                               for name, v in source.variables.iteritems()
+                               if name != "_filename") }
+
+
+def _export_build_node(node, norm):
+    # names of phony nodes of actions are expressions
+    return { "name": str(node.name) if node.name is not None else None,
+             "inputs": [str(norm.visit(e)) for e in node.inputs],
+             "outputs": [str(norm.visit(e)) for e in node.outputs],
+             "commands": [" ".join(_flatten(norm.visit(e))) for e in node.commands],
+             "pos": str(node.source_pos) if node.source_pos else None }
+
+
+class ExportingInterpreter(Interpreter):
+    """
+    Interpreter writing the toolset-specific models in the format used by
+    :func:`export_model()` into file object *out* instead of generating
+    the output files.
+    """
+    def __init__(self, out):
+        super(ExportingInterpreter, self).__init__()
+        self.out = out
+
+    def generate_for_toolset(self, toolset, skip_making_copy=False):
+        model = self.make_toolset_specific_model(toolset, skip_making_copy)
+        self.finalize_for_toolset(model, toolset)
+        export_model(model, bkl.api.Toolset.get(toolset), self.out)
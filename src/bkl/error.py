@@ -160,6 +160,14 @@ class NotFoundError(Error):
     pass
 
 
+class OutdatedOutputError(Error):
+    """
+    Exception thrown when an output file isn't up to date in the check-only
+    mode (see :data:`bkl.io.check_only`).
+    """
+    pass
+
+
 class _LocalContextStack(threading.local):
     """
     Helper class for keeping track of :class:`error_context` instances.
@@ -53,6 +53,8 @@ class Expr(object):
 
        Location of the expression in source tree.
     """
+    __slots__ = ("pos",)
+
     def __init__(self, pos=None):
         self.pos = pos
     
@@ -126,6 +128,8 @@ class LiteralExpr(Expr):
 
        Location of the expression in source tree.
     """
+    __slots__ = ("value",)
+
     def __init__(self, value, pos=None):
         super(LiteralExpr, self).__init__(pos)
         self.value = value
@@ -143,10 +147,54 @@ class LiteralExpr(Expr):
 class ListExpr(Expr):
     """
     List expression -- list of several values of the same type.
+
+    .. attribute:: items
+
+       List of the items, as :class:`Expr` objects.
     """
+    __slots__ = ("_items", "_prefix", "_suffix")
+
     def __init__(self, items, pos=None):
         super(ListExpr, self).__init__(pos)
-        self.items = items
+        self._items = items
+        # For lists created with appended(): the list this one extends and
+        # the items appended to it. They are only merged into _items when
+        # the items are actually needed.
+        self._prefix = None
+        self._suffix = None
+
+    def appended(self, items, pos=None):
+        """
+        Returns new list consisting of this list's items followed by *items*.
+
+        This is cheap: the items are not copied until the new list's
+        content is used, so that building a list by repeated appending
+        takes time proportional to the number of appended items only.
+        """
+        e = ListExpr(None, pos)
+        e._prefix = self
+        e._suffix = items
+        return e
+
+    def _get_items(self):
+        if self._items is None:
+            chunks = []
+            base = self
+            while base._items is None:
+                chunks.append(base._suffix)
+                base = base._prefix
+            items = list(base._items)
+            for c in reversed(chunks):
+                items.extend(c)
+            self._items = items
+            self._prefix = self._suffix = None
+        return self._items
+
+    def _set_items(self, items):
+        self._items = items
+        self._prefix = self._suffix = None
+
+    items = property(_get_items, _set_items)
 
     def as_py(self):
         return [ i.as_py() for i in self.items ]
@@ -169,6 +217,8 @@ class ConcatExpr(Expr):
     Concatenation of several expression. Typically, used with LiteralExpr
     and ReferenceExpr to express values such as "$(foo).cpp".
     """
+    __slots__ = ("items",)
+
     def __init__(self, items, pos=None):
         super(ConcatExpr, self).__init__(pos)
         assert len(items) > 0
@@ -192,6 +242,8 @@ class NullExpr(Expr):
     """
     Empty/unset value.
     """
+    __slots__ = ()
+
     def as_py(self):
         return None
 
@@ -218,6 +270,8 @@ class PlaceholderExpr(Expr):
 
        Name of referenced setting (e.g. "config" or "toolset").
     """
+    __slots__ = ("var",)
+
     def __init__(self, var, pos=None):
         super(PlaceholderExpr, self).__init__(pos)
         self.var = var
@@ -243,6 +297,8 @@ class ReferenceExpr(Expr):
        the appropriate :class:`bkl.model.ModelPart` instance (e.g. a target
        or a module).
     """
+    __slots__ = ("var", "context")
+
     def __init__(self, var, context, pos=None):
         super(ReferenceExpr, self).__init__(pos)
         self.var = var
@@ -288,6 +344,8 @@ class BoolValueExpr(Expr):
 
        Value of the literal, as (Python) boolean.
     """
+    __slots__ = ("value",)
+
     def __init__(self, value, pos=None):
         super(BoolValueExpr, self).__init__(pos)
         self.value = value
@@ -319,6 +377,7 @@ class BoolExpr(Expr):
 
        Right operand. Not set for the NOT operator.
     """
+    __slots__ = ("operator", "left", "right")
 
     #: And operator
     AND       = "&&"
@@ -403,6 +462,8 @@ class IfExpr(Expr):
 
        Value of the expression if the condition evaluates to False.
     """
+    __slots__ = ("cond", "value_yes", "value_no")
+
     def __init__(self, cond, yes, no, pos=None):
         super(IfExpr, self).__init__(pos)
         self.cond = cond
@@ -484,6 +545,8 @@ class PathExpr(Expr):
 
        Location of the expression in source tree.
     """
+    __slots__ = ("components", "anchor", "anchor_file")
+
     def __init__(self, components, anchor=ANCHOR_SRCDIR, anchor_file=None, pos=None):
         super(PathExpr, self).__init__(pos)
         if anchor_file is None and pos is not None:
@@ -1486,6 +1549,25 @@ def are_equal(a, b, _inside_cond=False):
         raise CannotDetermineError("cannot determine whether the following two expressions are equal: \"%s\" and \"%s\"; please report this as a bug." % (a,b))
 
 
+def comparison_key(e):
+    """
+    Returns hashable key for expression *e* that is the same for expressions
+    that are equal according to :func:`are_equal()`. This allows removing
+    duplicates from lists of expressions in linear time.
+
+    Expressions that cannot be evaluated are keyed by their symbolic
+    representation, i.e. they are only considered equal if they are
+    written the same.
+    """
+    try:
+        key = _PrepForAsPyComparisonVisitor().visit(e).as_py()
+        if isinstance(key, list):
+            key = tuple(key)
+        return (True, key)
+    except NonConstError:
+        return (False, e.as_symbolic())
+
+
 class _AddPrefixVisitor(RewritingVisitor):
     def __init__(self, prefix):
         super(_AddPrefixVisitor, self).__init__()
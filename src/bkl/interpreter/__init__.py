@@ -28,11 +28,17 @@ This module contains the very core of Bakefile -- the interpreter,
 """
 
 import logging
+import os.path
+import cPickle as pickle
 
 import bkl.parser
+import bkl.parser.ast
 import bkl.model
 import bkl.api
 import bkl.expr
+import bkl.error
+import bkl.io
+import bkl.utils
 import passes
 from builder import Builder
 from bkl.error import Error, warning
@@ -41,6 +47,53 @@ from bkl.parser import parse_file
 logger = logging.getLogger("bkl.interpreter")
 
 
+def _find_referenced_files(ast):
+    """
+    Returns list of files referenced from *ast* by ``submodule`` or ``import``
+    statements, with paths computed in the same way the Builder does.
+    """
+    found = []
+    todo = [ast]
+    while todo:
+        node = todo.pop()
+        if isinstance(node, (bkl.parser.ast.SubmoduleNode, bkl.parser.ast.ImportNode)):
+            found.append(os.path.relpath(os.path.join(os.path.dirname(node.pos.filename), node.file)))
+        elif node.children:
+            todo.extend(reversed(node.children))
+    return found
+
+
+class _WarningsCatcher(logging.Filter):
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.caught = False
+
+    def filter(self, record):
+        self.caught = True
+        return False
+
+#: How long to wait for a worker process parsing a file ahead, in seconds,
+#: before giving up and parsing the remaining files in the usual way.
+PARSE_AHEAD_TIMEOUT = 60
+
+def _parse_file_ahead(filename):
+    # Runs in a worker process. Any problems, including warnings, are ignored
+    # here, the file is then parsed again when it's needed and they are
+    # reported in the usual order. The AST is pickled explicitly so that
+    # nothing can fail once the function returns.
+    catcher = _WarningsCatcher()
+    bkl.error.logger.addFilter(catcher)
+    try:
+        ast = bkl.parser.parse_file(filename)
+        if catcher.caught:
+            return (filename, None)
+        return (filename, pickle.dumps(ast, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return (filename, None)
+    finally:
+        bkl.error.logger.removeFilter(catcher)
+
+
 class Interpreter(object):
     """
     The interpreter is responsible for doing everything necessary to
@@ -65,11 +118,21 @@ class Interpreter(object):
 
        If :const:`None` (the default), then the toolsets listed in the bakefile
        are used.
+
+    .. attribute:: cache_dir
+
+       Directory in which :meth:`process_file` caches the finalized model, so
+       that it doesn't need to be built again if none of the inputs changed,
+       and the manifest of generated files, so that only the outputs of
+       modules affected by the changes are generated again. If :const:`None`
+       (the default), no caching is done.
     """
 
     def __init__(self):
         self.model = bkl.model.Project()
         self.toolsets_to_use = None
+        self.cache_dir = None
+        self._outputs_manifest = None
 
 
     def limit_toolsets(self, toolsets):
@@ -108,8 +171,40 @@ class Interpreter(object):
 
 
     def process_file(self, filename):
-        """Like :meth:`process()`, but takes filename as its argument."""
-        self.process(parse_file(filename))
+        """
+        Like :meth:`process()`, but takes filename as its argument.
+
+        If :attr:`cache_dir` is set, the finalized model is loaded from the
+        cache if it's still valid and stored in it otherwise and only the
+        modules whose outputs may have changed since the previous run are
+        generated (unless :data:`bkl.io.dry_run` is set, nothing is saved
+        into the cache then).
+        """
+        if self.cache_dir is None:
+            self.process(parse_file(filename))
+            return
+
+        from modelcache import ModelCache
+        from incremental import OutputsManifest
+
+        cache = ModelCache(self.cache_dir, filename)
+        model = cache.load()
+        if model is not None:
+            self.model = model
+        else:
+            self.add_module(parse_file(filename), self.model)
+            self.finalize()
+            if not (bkl.io.dry_run or bkl.io.check_only):
+                cache.save(self.model)
+
+        self._outputs_manifest = OutputsManifest(self.cache_dir, filename)
+        self._outputs_manifest.load()
+        try:
+            self.generate()
+            if not (bkl.io.dry_run or bkl.io.check_only or bkl.io.diff_only):
+                self._outputs_manifest.save()
+        finally:
+            self._outputs_manifest = None
 
 
     def add_module(self, ast, parent):
@@ -119,7 +214,17 @@ class Interpreter(object):
 
         :param ast: AST of the input file, as returned by
                :func:`bkl.parser.parse_file`.
+
+        If more than one job is allowed (see :data:`bkl.utils.jobs`), files
+        included from *ast* as submodules or imports are parsed in advance,
+        in parallel.
         """
+        if bkl.utils.jobs > 1:
+            self._parse_referenced_files(ast)
+        self._add_module(ast, parent)
+
+
+    def _add_module(self, ast, parent):
         logger.info("processing %s", ast.filename)
 
         submodules = []
@@ -138,7 +243,48 @@ class Interpreter(object):
                 else:
                     msg = e.strerror
                 raise Error(msg, pos=sub_pos)
-            self.add_module(sub_ast, module)
+            self._add_module(sub_ast, module)
+
+
+    def _parse_referenced_files(self, ast):
+        """
+        Parses all files (transitively) referenced from *ast* using a pool of
+        worker processes and puts the results into :func:`parse_file`'s cache,
+        so that model building can use them later in the usual order.
+        """
+        import multiprocessing
+
+        # results of the files being parsed, in the order of submission
+        pending = []
+        seen = set()
+
+        pool = multiprocessing.Pool(bkl.utils.jobs)
+        try:
+            def _submit_referenced_from(a):
+                for fn in _find_referenced_files(a):
+                    if fn in seen or (fn,) in parse_file.cache:
+                        continue
+                    seen.add(fn)
+                    pending.append(pool.apply_async(_parse_file_ahead, (fn,)))
+
+            _submit_referenced_from(ast)
+            while pending:
+                # Notice that waiting with a timeout also keeps the wait
+                # interruptible and that any exceptions raised in the worker
+                # are re-raised here.
+                try:
+                    fn, data = pending.pop(0).get(PARSE_AHEAD_TIMEOUT)
+                except multiprocessing.TimeoutError:
+                    logger.debug("parsing ahead timed out, remaining files will be parsed serially")
+                    return
+                if data is None:
+                    continue # will be parsed (again) and reported later
+                sub_ast = pickle.loads(data)
+                parse_file.cache[(fn,)] = sub_ast
+                _submit_referenced_from(sub_ast)
+        finally:
+            pool.terminate()
+            pool.join()
 
 
     def _call_custom_steps(self, model, func):
@@ -195,7 +341,10 @@ class Interpreter(object):
         if skip_making_copy:
             model = self.model
         else:
-            model = self.model.clone()
+            # parts disabled for this toolset would be removed from the copy
+            # by finalize_for_toolset() anyway, so don't bother copying them
+            disabled = passes.find_disabled_model_parts(self.model, toolset)
+            model = self.model.clone(skip=disabled)
         # don't use Variable.from_property(), because it's read-only
         model.add_variable(bkl.model.Variable.from_property(
                                               model.get_prop("toolset"),
@@ -254,5 +403,20 @@ class Interpreter(object):
         model = self.make_toolset_specific_model(toolset, skip_making_copy)
         self.finalize_for_toolset(model, toolset)
 
+        manifest = self._outputs_manifest
+        if manifest is None:
+            logger.debug("****** generating for toolset %s ********", toolset)
+            bkl.api.Toolset.get(toolset).generate(model)
+            return
+
+        up_to_date = manifest.find_up_to_date_modules(toolset, model)
+        if not bkl.io.force_output:
+            model.up_to_date_modules = up_to_date
+
         logger.debug("****** generating for toolset %s ********", toolset)
-        bkl.api.Toolset.get(toolset).generate(model)
+        bkl.io.committed_files = []
+        try:
+            bkl.api.Toolset.get(toolset).generate(model)
+            manifest.record_outputs(toolset, model, bkl.io.committed_files)
+        finally:
+            bkl.io.committed_files = None
@@ -30,6 +30,7 @@ from ..parser import parse_file
 from ..error import ParserError, error_context, warning
 from ..vartypes import ListType, AnyType
 from . import analyze
+from . import globbing
 from .. import props
 
 import os.path
@@ -72,8 +73,7 @@ class Builder(object, CondTrackingMixin):
 
     def create_model(self, ast, parent):
         """Returns constructed model, as :class:`bkl.model.Module` instance."""
-        mod = Module(parent, source_pos=ast.pos)
-        mod.source_pos.line = mod.source_pos.column = None
+        mod = Module(parent, source_pos=Position(ast.pos.filename))
         self.context = mod
 
         self.handle_children(ast.children, self.context)
@@ -222,7 +222,7 @@ class Builder(object, CondTrackingMixin):
                 # appending to inheritable list property with empty default
                 value = ListExpr(new_values)
             elif isinstance(previous_value.value, ListExpr):
-                value = ListExpr(previous_value.value.items + new_values)
+                value = previous_value.value.appended(new_values)
             else:
                 value = ListExpr([previous_value.value] + new_values)
             value.pos = node.pos
@@ -247,10 +247,49 @@ class Builder(object, CondTrackingMixin):
         files = self._build_expression(node.files)
         analyze.mark_variables_in_expr_as_used(files)
         for cond, f in enum_possible_values(files, global_cond=self.active_if_cond):
-            obj = SourceFile(self.context, f, source_pos=f.pos)
-            if cond is not None:
-                obj.set_property_value("_condition", cond)
-            filelist.append(obj)
+            for fn in self._expand_wildcards(f):
+                obj = SourceFile(self.context, fn, source_pos=f.pos)
+                if cond is not None:
+                    obj.set_property_value("_condition", cond)
+                filelist.append(obj)
+
+
+    def _expand_wildcards(self, e):
+        """
+        Returns list of files matching the files list item *e*. This is just
+        [e] unless *e* contains wildcards.
+        """
+        if isinstance(e, LiteralExpr):
+            if not globbing.has_wildcards(e.value):
+                return [e]
+        elif not isinstance(e, ConcatExpr):
+            return [e]
+        path = split_into_path(e)
+        parts = []
+        for c in path.components:
+            parts += c.items if isinstance(c, ConcatExpr) else [c]
+        if not any(isinstance(x, LiteralExpr) and globbing.has_wildcards(x.value) for x in parts):
+            return [e]
+        if not all(isinstance(c, LiteralExpr) for c in path.components):
+            raise ParserError("wildcards can't be combined with variable references in file names", pos=e.pos)
+
+        project = self.context.project
+        if path.anchor == ANCHOR_SRCDIR:
+            source_file = path.anchor_file or e.pos.filename
+            basedir = project.get_srcdir(source_file)
+        elif path.anchor == ANCHOR_TOP_SRCDIR:
+            basedir = project.top_module.srcdir
+        else:
+            raise ParserError("wildcards can only be used in paths relative to @srcdir or @top_srcdir", pos=e.pos)
+
+        pattern = [c.value for c in path.components]
+        matches = globbing.cache.glob(basedir, pattern)
+        if not matches:
+            warning('no files match "%s"', "/".join(pattern), pos=e.pos)
+        logger.debug('"%s" in %s matches %d files', "/".join(pattern), basedir, len(matches))
+        return [PathExpr([LiteralExpr(x, pos=e.pos) for x in m],
+                         anchor=path.anchor, anchor_file=path.anchor_file, pos=e.pos)
+                for m in matches]
 
 
     def on_if(self, node):
@@ -424,13 +463,23 @@ class Builder(object, CondTrackingMixin):
                 return
             module = module.parent
 
+        module = self.context.module
+        project = module.project
+        if fn in project._global_imports:
+            # Everything the file defines is already in the project, there's
+            # nothing module-specific to evaluate again:
+            logger.debug("linking already imported file %s into %s", fn, module)
+            module.imports.add(fn)
+            return
+
         try:
-            module = self.context.module
             logger.debug("importing file %s into %s", fn, module)
             imported_ast = parse_file(fn)
             module.imports.add(fn)
             # TODO: tag error_context with "imported from ..."
             self.handle_children(imported_ast.children, self.context)
+            if self._defines_only_global_parts(imported_ast, fn):
+                project._global_imports.add(fn)
         except IOError as e:
             if e.filename:
                 msg = "%s: %s" % (e.strerror, e.filename)
@@ -439,6 +488,28 @@ class Builder(object, CondTrackingMixin):
             raise Error(msg)
 
 
+    def _defines_only_global_parts(self, ast, filename):
+        """
+        Returns True if the imported file *ast* only defines project-wide
+        parts (templates, settings, configurations) whose evaluation doesn't
+        depend on the module it is imported into.
+        """
+        project = self.context.project
+        for n in ast.children:
+            if isinstance(n, (NilNode, TemplateNode, SettingNode, SrcdirNode, PluginNode)):
+                continue
+            # Debug and Release are predefined and their content is evaluated
+            # into the importing module every time.
+            if isinstance(n, ConfigurationNode) and n.name not in ("Debug", "Release"):
+                continue
+            if isinstance(n, ImportNode):
+                fn = os.path.relpath(os.path.join(os.path.dirname(filename), n.file))
+                if fn in project._global_imports:
+                    continue
+            return False
+        return True
+
+
     def on_plugin(self, node):
         if self.active_if_cond is not None:
             raise ParserError("plugins cannot be loaded conditionally"
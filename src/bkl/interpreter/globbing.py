@@ -0,0 +1,229 @@
+#
+#  This file is part of Bakefile (http://bakefile.org)
+#
+#  Copyright (C) 2008-2013 Vaclav Slavik
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+
+"""
+Expansion of wildcards in files lists.
+
+Directories are scanned through a cache keyed by their modification time,
+which can be saved to disk so that subsequent runs don't need to list the
+directories again unless their content changed.
+"""
+
+import os
+import os.path
+import re
+import time
+import fnmatch
+import cPickle as pickle
+
+import logging
+logger = logging.getLogger("bkl.glob")
+
+
+_WILDCARDS_RE = re.compile(r"[*?[]")
+
+def has_wildcards(pattern):
+    """
+    Returns True if the string *pattern* contains wildcard characters.
+    """
+    return _WILDCARDS_RE.search(pattern) is not None
+
+
+class DirectoryScanCache(object):
+    """
+    Cache of directories' content.
+
+    A directory is listed again only if its modification time changed since
+    it was scanned the last time.
+
+    .. attribute:: matches
+
+       Dictionary with results of all glob() calls done so far, mapping
+       (absolute directory, pattern) pairs to lists of matching files. It is
+       saved together with the cache, so that it's possible to check if the
+       files matched by a pattern changed since the last run.
+    """
+
+    # increase when the format of the saved data changes
+    FORMAT_VERSION = 2
+
+    # directories modified less than this many seconds before they were
+    # scanned can be modified again without changing their mtime on some
+    # filesystems, so their content isn't saved
+    RACY_INTERVAL = 2.0
+
+    def __init__(self):
+        self._dirs = {}
+        self.matches = {}
+
+    def load(self, filename):
+        """
+        Loads the cache previously saved with save() from *filename*. Does
+        nothing if the file doesn't exist or can't be used.
+        """
+        try:
+            with open(filename, "rb") as f:
+                data = pickle.load(f)
+        except IOError:
+            return
+        except Exception as e:
+            logger.debug("ignoring invalid directory cache %s: %s", filename, e)
+            return
+        if data.get("version") != self.FORMAT_VERSION:
+            logger.debug("ignoring directory cache %s in old format", filename)
+            return
+        self._dirs.update(data["dirs"])
+        logger.debug("loaded %d cached directories from %s", len(data["dirs"]), filename)
+
+    def save(self, filename):
+        """
+        Saves the cache into *filename*, together with all glob() results.
+        """
+        dirs = dict((path, entry) for path, entry in self._dirs.iteritems()
+                    if entry[1] - entry[0] >= self.RACY_INTERVAL)
+        data = { "version": self.FORMAT_VERSION,
+                 "dirs": dirs,
+                 "matches": self.matches }
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpname = filename + ".tmp"
+        with open(tmpname, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        if os.name == "nt" and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
+
+    def listdir(self, path):
+        """
+        Returns (files, subdirectories) tuple with sorted names of files and
+        subdirectories in directory *path*. Both lists are empty if the
+        directory doesn't exist.
+        """
+        entry = self._scan(path)
+        return entry[2], entry[3]
+
+    def _scan(self, path):
+        # Returns (mtime, scan time, files, subdirs, symlinked subdirs) tuple
+        # for the directory, scanning it only if it isn't cached yet.
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return (None, None, [], [], [])
+        entry = self._dirs.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry
+
+        logger.debug("scanning directory %s", path)
+        scanned = time.time()
+        files = []
+        subdirs = []
+        links = []
+        try:
+            names = sorted(os.listdir(path))
+        except OSError:
+            names = []
+        for n in names:
+            full = os.path.join(path, n)
+            if os.path.isdir(full):
+                subdirs.append(n)
+                if os.path.islink(full):
+                    links.append(n)
+            else:
+                files.append(n)
+        entry = (mtime, scanned, files, subdirs, links)
+        self._dirs[path] = entry
+        return entry
+
+    def glob(self, basedir, pattern):
+        """
+        Finds files matching *pattern*, which is a list of path components
+        relative to directory *basedir*. The components may contain
+        wildcards understood by the :mod:`fnmatch` module and "**" matches
+        any number of nested directories, including none. If "**" is the
+        last component, it matches all files in these directories.
+
+        Only files are matched, never directories, and names starting with
+        a dot are only matched by patterns that start with a dot too.
+        Symbolic links to directories are not followed by "**", to avoid
+        infinite recursion if they form a cycle, but they can still be used
+        in other components.
+
+        Returns sorted list of matches, each one being a list of path
+        components relative to *basedir*.
+        """
+        basedir = os.path.abspath(basedir)
+        candidates = [[]]
+        last = len(pattern) - 1
+        for index, part in enumerate(pattern):
+            found = []
+            for c in candidates:
+                path = os.path.join(basedir, *c)
+                if index == last and part == "**":
+                    for d in self._walk(path, c):
+                        files = self.listdir(os.path.join(basedir, *d))[0]
+                        found += [d + [n] for n in self._match(files, "*")]
+                elif index == last:
+                    files = self.listdir(path)[0]
+                    if has_wildcards(part):
+                        found += [c + [n] for n in self._match(files, part)]
+                    elif part in files:
+                        found.append(c + [part])
+                elif part == "**":
+                    found += self._walk(path, c)
+                elif has_wildcards(part):
+                    subdirs = self.listdir(path)[1]
+                    found += [c + [n] for n in self._match(subdirs, part)]
+                else:
+                    found.append(c + [part])
+            candidates = found
+
+        # "**" can produce the same match more than once, e.g. for "**/**/x":
+        result = []
+        seen = set()
+        for c in sorted(candidates):
+            s = "/".join(c)
+            if s not in seen:
+                seen.add(s)
+                result.append(c)
+        self.matches[(basedir, "/".join(pattern))] = ["/".join(c) for c in result]
+        return result
+
+    def _match(self, names, part):
+        if not part.startswith("."):
+            names = [n for n in names if not n.startswith(".")]
+        return [n for n in names if fnmatch.fnmatchcase(n, part)]
+
+    def _walk(self, path, prefix):
+        yield prefix
+        entry = self._scan(path)
+        for d in entry[3]:
+            if d.startswith(".") or d in entry[4]:
+                continue
+            for x in self._walk(os.path.join(path, d), prefix + [d]):
+                yield x
+
+
+#: Cache used for expanding wildcards in the files lists.
+cache = DirectoryScanCache()
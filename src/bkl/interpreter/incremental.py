@@ -0,0 +1,254 @@
+#
+#  This file is part of Bakefile (http://bakefile.org)
+#
+#  Copyright (C) 2008-2013 Vaclav Slavik
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+
+"""
+Incremental generation of the output files.
+
+For every toolset and module, the manifest records a fingerprint of
+everything the module's output files depend on, together with the digests of
+the files generated for it. If neither the fingerprint nor the files changed
+since the previous run, the toolset doesn't need to generate the module's
+files again.
+
+The fingerprint of a module is computed from the toolset-specific model and
+covers the module itself, its ancestors (from which it inherits variables),
+its submodules (which its makefiles and solutions aggregate) and modules
+containing the targets or variables referenced from any of these, plus the
+project-wide settings and configurations.
+"""
+
+import os
+import os.path
+import hashlib
+import cPickle as pickle
+
+import logging
+logger = logging.getLogger("bkl.interpreter")
+
+import bkl.expr
+import bkl.model
+import bkl.version
+from bkl.dumper import dump_module, dump_project_wide
+from modelcache import cache_key, _file_digest, _bakefile_modules
+
+
+# increase when the format of the saved data changes
+FORMAT_VERSION = 1
+
+
+class _ReferencesCollector(bkl.expr.Visitor):
+    """
+    Collects model parts referenced from the visited expressions.
+    """
+    def __init__(self):
+        super(_ReferencesCollector, self).__init__()
+        self.found = set()
+
+    null = bkl.expr.Visitor.noop
+    literal = bkl.expr.Visitor.noop
+    placeholder = bkl.expr.Visitor.noop
+    bool_value = bkl.expr.Visitor.noop
+    list = bkl.expr.Visitor.visit_children
+    concat = bkl.expr.Visitor.visit_children
+    path = bkl.expr.Visitor.visit_children
+    bool = bkl.expr.Visitor.visit_children
+    if_ = bkl.expr.Visitor.visit_children
+
+    def reference(self, e):
+        self.found.add(e.context)
+
+
+def _module_of(part):
+    while part is not None and not isinstance(part, bkl.model.Module):
+        part = part.parent
+    return part
+
+
+def _ancestors(module):
+    m = module.parent
+    while isinstance(m, bkl.model.Module):
+        yield m
+        m = m.parent
+
+
+class OutputsManifest(object):
+    """
+    Manifest of the files generated for the project in *filename*, stored in
+    directory *cache_dir*.
+    """
+    def __init__(self, cache_dir, filename):
+        self.filename = os.path.join(cache_dir,
+                                     "outputs-%s.cache" % cache_key(filename))
+        self._toolsets = {}
+        self._fingerprints = {}
+        self._modules_digest = None
+
+    def load(self):
+        """
+        Loads the manifest saved by the previous run, if there's any.
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                data = pickle.load(f)
+        except IOError:
+            return
+        except Exception as e:
+            logger.debug("ignoring invalid outputs manifest %s: %s", self.filename, e)
+            return
+        if data.get("format") != FORMAT_VERSION or data.get("version") != bkl.version.VERSION:
+            logger.debug("ignoring outputs manifest %s from a different version", self.filename)
+            return
+        self._toolsets = data["toolsets"]
+
+    def save(self):
+        """
+        Saves the manifest, including the outputs recorded by
+        :meth:`record_outputs()`.
+        """
+        data = { "format": FORMAT_VERSION,
+                 "version": bkl.version.VERSION,
+                 "toolsets": self._toolsets }
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpname = self.filename + ".tmp"
+        with open(tmpname, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        if os.name == "nt" and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+        logger.debug("saved outputs manifest to %s", self.filename)
+
+    def find_up_to_date_modules(self, toolset, model):
+        """
+        Computes fingerprints of all modules in the toolset-specific *model*
+        and returns the set of modules whose outputs recorded in the manifest
+        are still valid and were not modified since.
+        """
+        fingerprints = self._compute_fingerprints(toolset, model)
+        self._fingerprints[toolset] = fingerprints
+
+        recorded = self._toolsets.get(toolset, {})
+        up_to_date = set()
+        for m in model.modules:
+            entry = recorded.get(m.source_file)
+            if entry is None or entry[0] != fingerprints[m]:
+                continue
+            if all(_file_digest(fn) == digest for fn, digest in entry[1]):
+                up_to_date.add(m)
+        logger.debug("%d of %d modules are up to date for toolset %s",
+                     len(up_to_date), len(model.modules), toolset)
+        return up_to_date
+
+    def record_outputs(self, toolset, model, committed_files):
+        """
+        Records the files generated for *toolset*, as collected in
+        :data:`bkl.io.committed_files`. Modules that weren't generated, i.e.
+        those in *model*'s ``up_to_date_modules``, keep their previously
+        recorded outputs.
+        """
+        fingerprints = self._fingerprints[toolset]
+        up_to_date = model.up_to_date_modules
+        outputs = dict((m, []) for m in model.modules)
+        for filename, create_for, digest in committed_files:
+            m = _module_of(create_for) if isinstance(create_for, bkl.model.ModelPart) else None
+            if m in outputs:
+                outputs[m].append((filename, digest))
+
+        old = self._toolsets.get(toolset, {})
+        recorded = {}
+        for m in model.modules:
+            name = m.source_file
+            if m in up_to_date:
+                recorded[name] = old[name]
+            else:
+                recorded[name] = (fingerprints[m], outputs[m])
+        self._toolsets[toolset] = recorded
+
+    def _compute_fingerprints(self, toolset, model):
+        base = hashlib.sha1()
+        base.update("%s\0%s\0" % (toolset, self._bakefile_modules_digest()))
+        base.update(dump_project_wide(model))
+        for c in model.configurations.itervalues():
+            base.update("configuration %s %s %s\n" % (c.name, c.base.name if c.base else "", c.is_debug))
+        base = base.hexdigest()
+
+        targets_by_name = dict((t.name, t) for t in model.all_targets())
+        own = {}
+        refs = {}
+        for m in model.modules:
+            own[m] = self._own_digest(m)
+            refs[m] = self._referenced_modules(m, targets_by_name)
+
+        # Collect the modules each module depends on: itself, its submodules
+        # and everything they reference, together with their ancestors.
+        subtrees = dict((m, [m]) for m in model.modules)
+        for m in model.modules:
+            for a in _ancestors(m):
+                subtrees[a].append(m)
+
+        fingerprints = {}
+        for m in model.modules:
+            related = set(subtrees[m])
+            for x in subtrees[m]:
+                related.update(refs[x])
+            for x in list(related):
+                related.update(_ancestors(x))
+            digest = hashlib.sha1(base)
+            for x in model.modules:
+                if x in related:
+                    digest.update("%s\0%s\0" % (x.source_file, own[x]))
+            fingerprints[m] = digest.hexdigest()
+        return fingerprints
+
+    def _own_digest(self, module):
+        digest = hashlib.sha1(dump_module(module))
+        # external projects are read by the toolsets, so they're inputs too
+        for t in module.targets.itervalues():
+            if t.type.name == "external":
+                fn = t["file"].as_native_path_for_output(t)
+                digest.update("%s\0%s\0" % (fn, _file_digest(fn)))
+        return digest.hexdigest()
+
+    def _referenced_modules(self, module, targets_by_name):
+        collector = _ReferencesCollector()
+        for var in module.all_variables():
+            collector.visit(var.value)
+        found = set(_module_of(part) for part in collector.found)
+        for t in module.targets.itervalues():
+            for dep in t["deps"]:
+                dep_target = targets_by_name.get(dep.as_py())
+                if dep_target is not None:
+                    found.add(dep_target.parent)
+        found.discard(None)
+        return found
+
+    def _bakefile_modules_digest(self):
+        if self._modules_digest is None:
+            modules = _bakefile_modules()
+            digest = hashlib.sha1()
+            for name in sorted(modules):
+                digest.update("%s\0%s\0" % (name, _file_digest(modules[name])))
+            self._modules_digest = digest.hexdigest()
+        return self._modules_digest
@@ -0,0 +1,180 @@
+#
+#  This file is part of Bakefile (http://bakefile.org)
+#
+#  Copyright (C) 2008-2013 Vaclav Slavik
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+
+"""
+Cache of finalized models.
+
+The model is saved after :meth:`bkl.interpreter.Interpreter.finalize()`
+together with the information needed to check if it is still valid: digests
+of all the input files and of Bakefile's own modules (including plugins)
+and the files matched by wildcards. If nothing changed, the next run can
+load the model and go directly to generating the output.
+"""
+
+import os
+import os.path
+import sys
+import hashlib
+import cPickle as pickle
+
+import logging
+logger = logging.getLogger("bkl.interpreter")
+
+import bkl.version
+import bkl.plugins
+from . import globbing
+
+
+# increase when the format of the saved data changes
+FORMAT_VERSION = 2
+
+
+def _file_digest(filename):
+    try:
+        with open(filename, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def _bakefile_modules():
+    """
+    Returns dictionary of names and source files of all loaded Bakefile
+    modules, including plugins.
+    """
+    modules = {}
+    for name, mod in sys.modules.items():
+        if mod is None or not (name == "bkl" or name.startswith("bkl.")):
+            continue
+        fn = getattr(mod, "__file__", None)
+        if fn is None:
+            continue
+        if fn.endswith(".pyc") or fn.endswith(".pyo"):
+            fn = fn[:-1]
+        modules[name] = fn
+    return modules
+
+
+def _input_files(model):
+    files = set()
+    for m in model.modules:
+        files.add(m.source_file)
+        files.update(m.imports)
+    return files
+
+
+def cache_key(filename):
+    """
+    Returns string identifying the cached data for project in *filename*.
+    """
+    # the paths in the model are relative to the current directory, so it
+    # is part of the key too
+    key = "%s\0%s" % (os.path.abspath(filename), os.getcwd())
+    return hashlib.sha1(key).hexdigest()[:16]
+
+
+class ModelCache(object):
+    """
+    Cache of the finalized model of the project in *filename*, stored in
+    directory *cache_dir*.
+    """
+    def __init__(self, cache_dir, filename):
+        self.filename = os.path.join(cache_dir,
+                                     "model-%s.cache" % cache_key(filename))
+
+    def load(self):
+        """
+        Returns the cached model or None if there's no valid cached model.
+        """
+        try:
+            f = open(self.filename, "rb")
+        except IOError:
+            return None
+        try:
+            with f:
+                header = pickle.load(f)
+                if not self._is_valid(header):
+                    return None
+                # External plugins can't be imported by name, so they must be
+                # loaded before unpickling the model which refers to them.
+                for name, fn in header["modules"].iteritems():
+                    if name.startswith("bkl.plugins.") and name not in sys.modules:
+                        bkl.plugins.load_from_file(fn)
+                model = pickle.load(f)
+        except Exception as e:
+            logger.debug("ignoring invalid cached model %s: %s", self.filename, e)
+            return None
+        logger.info("using cached model from %s", self.filename)
+        return model
+
+    def _is_valid(self, header):
+        if header.get("format") != FORMAT_VERSION or header.get("version") != bkl.version.VERSION:
+            logger.debug("cached model %s is from a different version", self.filename)
+            return False
+        for fn, digest in header["inputs"].iteritems():
+            if _file_digest(fn) != digest:
+                logger.debug("cached model %s is outdated: %s changed", self.filename, fn)
+                return False
+        for name, fn in header["modules"].iteritems():
+            if _file_digest(fn) != header["modules_digests"][name]:
+                logger.debug("cached model %s is outdated: %s changed", self.filename, fn)
+                return False
+        for (basedir, pattern), matches in header["wildcards"].iteritems():
+            found = globbing.cache.glob(basedir, pattern.split("/"))
+            if ["/".join(x) for x in found] != matches:
+                logger.debug("cached model %s is outdated: files matching %s changed", self.filename, pattern)
+                return False
+        return True
+
+    def save(self, model):
+        """
+        Saves finalized *model* into the cache.
+        """
+        modules = _bakefile_modules()
+        header = {
+            "format": FORMAT_VERSION,
+            "version": bkl.version.VERSION,
+            "inputs": dict((fn, _file_digest(fn)) for fn in _input_files(model)),
+            "modules": modules,
+            "modules_digests": dict((name, _file_digest(fn)) for name, fn in modules.iteritems()),
+            "wildcards": globbing.cache.matches,
+        }
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpname = self.filename + ".tmp"
+        # The model is deeply nested because of parent links and references
+        # between modules.
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(old_limit, 10000))
+        try:
+            with open(tmpname, "wb") as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            sys.setrecursionlimit(old_limit)
+        if os.name == "nt" and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+        logger.debug("saved finalized model to %s", self.filename)
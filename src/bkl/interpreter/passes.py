@@ -91,6 +91,49 @@ def validate_vars(model):
             raise
 
 
+class _ToolsetSubstitutor(RewritingVisitor):
+    """
+    Replaces references to the ``toolset`` variable with its value.
+    """
+    def __init__(self, toolset):
+        super(_ToolsetSubstitutor, self).__init__()
+        self.toolset = toolset
+
+    def reference(self, e):
+        if e.var == "toolset":
+            return bkl.expr.LiteralExpr(self.toolset, pos=e.pos)
+        return e
+
+
+def find_disabled_model_parts(model, toolset):
+    """
+    Returns set of targets and source files that are disabled for *toolset*,
+    i.e. whose ``condition`` is false once the value of ``$(toolset)`` is
+    known. Unlike remove_disabled_model_parts(), this can be done before
+    making the toolset-specific copy of the model, so that these parts don't
+    need to be copied at all.
+    """
+    substitutor = _ToolsetSubstitutor(toolset)
+    simplifier = simplify.ConditionalsSimplifier()
+
+    def _is_disabled(part):
+        cond = part.condition
+        if cond is None:
+            return False
+        cond = simplifier.visit(substitutor.visit(cond))
+        return isinstance(cond, bkl.expr.BoolValueExpr) and not cond.value
+
+    disabled = set()
+    for target in model.all_targets():
+        if _is_disabled(target):
+            disabled.add(target)
+            continue
+        for src in target.child_parts():
+            if _is_disabled(src):
+                disabled.add(src)
+    return disabled
+
+
 def remove_disabled_model_parts(model, toolset):
     """
     Removes disabled targets, source files etc. from the model. Disabled parts
@@ -29,6 +29,7 @@ changes, line endings conversions etc.
 
 import os
 import os.path
+import hashlib
 
 import logging
 logger = logging.getLogger("bkl.io")
@@ -40,11 +41,25 @@ dry_run = False
 # Set to true to show diff with the existing file instead of updating it
 diff_only = False
 
+# Set to true to only check if the output files are up to date, without writing
+# them. OutdatedOutputError is raised for the first file that isn't, unless
+# check_all is set too, in which case all such files are just collected in
+# outdated_files.
+check_only = False
+check_all = False
+
+# Output files that are not up to date, in check-only mode
+outdated_files = []
+
 # Set to true to force writing of output files, even if they exist and would be
 # unchanged. In other words, always touch output files. This is useful for
 # makefiles that support automatic regeneration.
 force_output = False
 
+# If not None, (filename, create_for, digest) tuple with SHA-1 digest of the
+# content is appended to this list for every committed output file.
+committed_files = None
+
 # Number of created files
 num_created = 0
 # Number of modified files
@@ -88,9 +103,24 @@ class OutputFile(object):
         _all_written_files[filename] = (creator, create_for)
 
         self.filename = filename
+        self.create_for = create_for
         self.eol = eol
         self.charset = charset
-        self.text = ""
+        # The output is collected as a list of chunks that is only joined
+        # when the whole text is needed, so that writing the output piece by
+        # piece isn't quadratic.
+        self._chunks = []
+
+    def _get_text(self):
+        if len(self._chunks) != 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0]
+
+    def _set_text(self, text):
+        self._chunks = [text]
+
+    #: The text written to the file so far.
+    text = property(_get_text, _set_text)
 
     def write(self, text):
         """
@@ -100,7 +130,7 @@ class OutputFile(object):
         """
         if isinstance(text, unicode):
             text = text.encode(self.charset)
-        self.text += text
+        self._chunks.append(text)
 
     def replace(self, placeholder, value):
         """
@@ -112,11 +142,26 @@ class OutputFile(object):
         """
         self.text = self.text.replace(placeholder, value, 1)
 
+    def discard(self):
+        """
+        Discards the file without writing it, so that a file with the same
+        name may be created again.
+        """
+        del _all_written_files[self.filename]
+
     def commit(self):
         if self.eol == EOL_WINDOWS:
             self.text = self.text.replace("\n", "\r\n")
         rel_fn = os.path.relpath(self.filename)
 
+        if committed_files is not None:
+            committed_files.append((self.filename, self.create_for,
+                                    hashlib.sha1(self.text).hexdigest()))
+
+        if check_only:
+            self._check(rel_fn)
+            return
+
         if not force_output:
             try:
                 with open(self.filename, "rb") as f:
@@ -157,3 +202,22 @@ class OutputFile(object):
             os.makedirs(dirname)
         with open(self.filename, "wb") as f:
             f.write(self.text)
+
+    def _check(self, rel_fn):
+        try:
+            # don't bother reading the file if it has different size
+            up_to_date = os.path.getsize(self.filename) == len(self.text)
+            if up_to_date:
+                with open(self.filename, "rb") as f:
+                    up_to_date = (f.read() == self.text)
+        except (IOError, OSError):
+            up_to_date = False
+        if up_to_date:
+            logger.info(".\t%s", rel_fn)
+            return
+
+        logger.info("!\t%s", rel_fn)
+        if not check_all:
+            from bkl.error import OutdatedOutputError
+            raise OutdatedOutputError("file %s is not up to date" % rel_fn)
+        outdated_files.append(self.filename)
@@ -30,13 +30,15 @@ in this module.
 """
 
 import os.path
+from itertools import izip
 
 import io
 import expr
 from bkl.error import Error, CannotDetermineError, error_context
 from bkl.api import Extension, Toolset, Property
-from bkl.vartypes import PathType
-from bkl.utils import OrderedDict
+from bkl.vartypes import PathType, BoolType, StringType
+from bkl.utils import OrderedDict, OrderedSet, map_in_workers
+from bkl.compilers import get_unity_output_files
 
 
 class MakefileFormatter(Extension):
@@ -73,7 +75,7 @@ class MakefileFormatter(Extension):
         """
         return "%s = %s\n" % (var, " \\\n\t".join(value.split("\n")))
 
-    def target(self, name, deps, commands):
+    def target(self, name, deps, commands, order_only_deps=None):
         """
         Returns string with target definition.
 
@@ -88,18 +90,25 @@ class MakefileFormatter(Extension):
                          are already formatted to be in make's syntax and each
                          command in the list is single-line shell command.
                          May be :const:`None`.
+        :param order_only_deps: List of dependencies that must exist before
+                         the target is built, but whose modification doesn't
+                         cause it to be rebuilt, such as its output
+                         directory. May be :const:`None`.
         """
         out = "%s:" % name
         if deps:
             out += " "
             out += " ".join(deps)
+        if order_only_deps:
+            out += " | "
+            out += " ".join(order_only_deps)
         if commands:
             for c in commands:
                 out += "\n\t%s" % c
         out += "\n\n"
         return out
 
-    def multifile_target(self, outputs, outfiles, deps, commands):
+    def multifile_target(self, outputs, outfiles, deps, commands, order_only_deps=None):
         """
         Returns string with target definition for targets that produce multiple
         files. A typical example is Bison parser generator, which produces both
@@ -109,6 +118,7 @@ class MakefileFormatter(Extension):
         :param outfiles: List of output files of the rule, as strings.
         :param deps:     See target()
         :param commands: See target()
+        :param order_only_deps: See target()
         """
         # TODO: Implement these. Could you pattern rules with GNU make,
         #       or stamp files.
@@ -123,10 +133,173 @@ class MakefileFormatter(Extension):
         raise NotImplementedError
 
 
+class ModulesDependencyGraph(object):
+    """
+    Dependencies between targets and modules of the whole project, computed
+    once per :meth:`MakefileToolset.generate()` call and shared by all
+    generated makefiles.
+
+    .. attribute:: target_deps
+
+       Dictionary mapping each target to the list of targets it depends on,
+       in the order they are listed in its ``deps`` property.
+    """
+    def __init__(self, project):
+        targets_by_name = {}
+        for t in project.all_targets():
+            targets_by_name[t.name] = t
+
+        self.target_deps = {}
+        for t in project.all_targets():
+            with error_context(t):
+                deps = []
+                for dep in t["deps"]:
+                    name = dep.as_py()
+                    try:
+                        deps.append(targets_by_name[name])
+                    except KeyError:
+                        raise Error("target \"%s\" doesn't exist" % name, pos=dep.pos)
+                self.target_deps[t] = deps
+
+        # For every module, map each of its ancestors to the ancestor's
+        # child module that is, or contains, the module:
+        self._ancestors = {}
+        self._submodules = OrderedDict((m, []) for m in project.modules)
+        for m in project.modules:
+            path = {}
+            child = m
+            while child.parent in self._submodules:
+                path[child.parent] = child
+                child = child.parent
+            self._ancestors[m] = path
+            if m.parent in self._submodules:
+                self._submodules[m.parent].append(m)
+
+        # Targets that the targets of each module, including its submodules,
+        # depend on:
+        self._subtree_deps = dict((m, OrderedSet()) for m in project.modules)
+        for t in project.all_targets():
+            deps = self.target_deps[t]
+            self._subtree_deps[t.parent].update(deps)
+            for m in self._ancestors[t.parent]:
+                self._subtree_deps[m].update(deps)
+
+    def submodules(self, module):
+        """
+        Returns list of direct submodules of *module*.
+        """
+        return self._submodules[module]
+
+    def subtree(self, module):
+        """
+        Returns list with *module* and all its (grand-)*children*.
+        """
+        result = [module]
+        for sub in self._submodules[module]:
+            result += self.subtree(sub)
+        return result
+
+    def child_containing(self, main, module):
+        """
+        Returns the direct submodule of *main* that either is *module* or
+        has it as its (grand-)*child, or None if *module* isn't a submodule
+        of *main* at all.
+        """
+        return self._ancestors[module].get(main, None)
+
+    def submodule_deps(self, main, submodule):
+        """
+        Returns dependencies that *submodule* of *main* has on *main* and its
+        other submodules: a submodule depends on another one if a target from
+        one (or its submodules) depends on a target from the other.
+
+        Returns a tuple of list of targets from *main* and list of other
+        direct submodules of *main*.
+        """
+        targets = []
+        modules = []
+        for tdep in self._subtree_deps[submodule]:
+            tmod = tdep.parent
+            if tmod is main:
+                targets.append(tdep)
+            else:
+                sub = self.child_containing(main, tmod)
+                if sub is not None and sub is not submodule and sub not in modules:
+                    modules.append(sub)
+        return (targets, modules)
+
+
+class MakefileContext(object):
+    """
+    State of a single makefile being generated.
+
+    Everything that is specific to one output file is kept here rather than
+    in the (singleton) toolset object, so that makefiles for different modules
+    can be generated independently of each other.
+
+    .. attribute:: toolset
+
+       The :class:`MakefileToolset` generating the makefile.
+
+    .. attribute:: module
+
+       The :class:`bkl.model.Module` the makefile is generated for.
+
+    .. attribute:: file
+
+       The :class:`bkl.io.OutputFile` being written.
+
+    .. attribute:: modules
+
+       Modules whose targets are built by the makefile: just :attr:`module`
+       itself, unless the makefile is non-recursive, in which case it
+       includes all of its submodules too.
+
+    .. attribute:: subdirs
+
+       Directories of the submodules included in a non-recursive makefile,
+       relative to the makefile's directory, as strings.
+
+    .. attribute:: uses_builddir
+
+       Set to True by the expression formatter if the makefile references
+       any build directory paths (i.e. if it actually builds anything).
+
+    .. attribute:: uses_non_std_bool_macros
+
+       Set to True by the expression formatter if the makefile needs helper
+       macros for boolean expressions not supported by make directly.
+
+    .. attribute:: depfiles
+
+       Dependency files written by the compiler for objects built by the
+       makefile, already formatted as make paths.
+    """
+    def __init__(self, toolset, module, file, modules=None, subdirs=None):
+        self.toolset = toolset
+        self.module = module
+        self.file = file
+        self.modules = modules if modules is not None else [module]
+        self.subdirs = subdirs if subdirs is not None else []
+        self.uses_builddir = False
+        self.uses_non_std_bool_macros = False
+        self.depfiles = []
+
+    @property
+    def targets(self):
+        """
+        Iterates over all targets built by the makefile.
+        """
+        for m in self.modules:
+            for t in m.targets.itervalues():
+                yield t
+
+
 class MakefileExprFormatter(expr.Formatter):
-    def __init__(self, toolset, paths_info):
+    def __init__(self, context, paths_info):
         expr.Formatter.__init__(self, paths_info)
-        self.toolset = toolset
+        self.context = context
+        self.toolset = context.toolset
 
     def literal(self, e):
         if '"' in e.value:
@@ -136,7 +309,7 @@ class MakefileExprFormatter(expr.Formatter):
 
     def path(self, e):
         if e.anchor in [expr.ANCHOR_BUILDDIR, expr.ANCHOR_TOP_BUILDDIR]:
-            self.toolset.uses_builddir = True
+            self.context.uses_builddir = True
         return super(MakefileExprFormatter, self).path(e)
 
     def placeholder(self, e):
@@ -166,6 +339,8 @@ class MakefileToolset(Toolset):
     #: Command used to delete files
     del_command = None
 
+    uses_build_graphs = True
+
     @classmethod
     def properties_module(cls):
         yield Property("%s.makefile" % cls.name,
@@ -173,6 +348,32 @@ class MakefileToolset(Toolset):
                        default=cls.default_makefile,
                        inheritable=False,
                        doc="Name of output file for module's makefile.")
+        yield Property("%s.nonrecursive" % cls.name,
+                       type=BoolType(),
+                       default=False,
+                       inheritable=False,
+                       doc="""
+                           Whether to include the targets of all submodules
+                           in the module's makefile instead of invoking make
+                           recursively for the submodules' makefiles, which
+                           are not generated then. This allows make to build
+                           the whole tree in parallel.
+
+                           Notice that the commands of action targets from
+                           the submodules are run from the directory of this
+                           makefile, not their own one.
+                           """)
+        yield Property("%s.compiler-launcher" % cls.name,
+                       type=StringType(),
+                       default=expr.NullExpr(),
+                       inheritable=True,
+                       doc="""
+                           Command to run the compiler with, e.g. ``ccache``
+                           or ``distcc``. It is prefixed to the commands
+                           compiling the sources, but not to the link
+                           commands, and can be overridden by setting
+                           ``COMPILER_LAUNCHER`` on make command line.
+                           """)
 
     def get_builddir_for(self, target):
         makefile = target["%s.makefile" % self.name]
@@ -184,14 +385,48 @@ class MakefileToolset(Toolset):
         # dependencies on produced files. Worse yet, we need to have them for
         # all modules before generating the output, because of cross-module
         # dependencies.
-        # TODO-MT: read only, can be ran in parallel
         from bkl.interpreter.passes import PathsNormalizer
-        norm = PathsNormalizer(project)
+        deps_graph = ModulesDependencyGraph(project)
+
+        # Non-recursive makefiles include all of their submodules, which
+        # don't have makefiles of their own then:
+        included = {}
+        for m in project.modules:
+            if m in included:
+                continue
+            if m["%s.nonrecursive" % self.name]:
+                for sub in deps_graph.subtree(m):
+                    included[sub] = m
+            else:
+                included[m] = m
+
+        # Only makefiles of the modules that are not up to date are generated
+        # and they only need build graphs of their own targets and of the
+        # targets these depend on:
+        modules = [m for m in project.modules
+                   if included[m] is m and m not in project.up_to_date_modules]
+        needed_targets = set()
+        for m in modules:
+            for sub in self._modules_in_makefile(deps_graph, m):
+                for t in sub.targets.itervalues():
+                    needed_targets.add(t)
+                    needed_targets.update(deps_graph.target_deps[t])
+
+        plain_norm = PathsNormalizer(project)
+        # @builddir of the submodules' targets included in a non-recursive
+        # makefile is not the makefile's one, so it must be translated:
+        included_norm = PathsNormalizer(project, self)
         build_graphs = {}
         for t in project.all_targets():
+            if t not in needed_targets:
+                continue
             with error_context(t):
                 if not t.should_build():
                     continue
+                if included[t.parent] is t.parent:
+                    norm = plain_norm
+                else:
+                    norm = included_norm
                 norm.set_context(t)
                 graph = t.type.get_build_subgraph(self, t)
                 for node in graph.all_nodes():
@@ -200,28 +435,70 @@ class MakefileToolset(Toolset):
                     node.commands = [norm.visit(e) for e in node.commands]
                 build_graphs[t] = graph
 
-        for m in project.modules:
+        # The makefiles are independent of each other once the build graphs
+        # are known, so they can be generated in worker processes. Only their
+        # content is passed back and the files are created again and
+        # committed here, in modules order, to keep the output deterministic.
+        def _gen(m):
             with error_context(m):
-                self._gen_makefile(build_graphs, m)
-
-    def _gen_makefile(self, build_graphs, module):
-        # Flag indicating whether this makefile actually builds anything.
-        self.uses_builddir = False
+                f = self._gen_makefile(build_graphs, deps_graph, m)
+            f.discard()
+            return (f.filename, f.text)
+
+        for m, (filename, text) in izip(modules, map_in_workers(_gen, modules)):
+            f = io.OutputFile(filename, io.EOL_UNIX, creator=self, create_for=m)
+            f.text = text
+            f.commit()
+
+        for m in modules:
+            for sub in self._modules_in_makefile(deps_graph, m):
+                for t in sub.targets.itervalues():
+                    if t in build_graphs:
+                        for f in get_unity_output_files(self, t):
+                            f.commit()
+
+    def _modules_in_makefile(self, deps_graph, module):
+        """
+        Returns list of modules whose targets are built by *module*'s
+        makefile.
+        """
+        if module["%s.nonrecursive" % self.name]:
+            return deps_graph.subtree(module)
+        else:
+            return [module]
 
+    def _gen_makefile(self, build_graphs, deps_graph, module):
+        """
+        Generates makefile for *module* and returns it as (not yet committed)
+        :class:`bkl.io.OutputFile`. May be called in a worker process, so any
+        changes it does to the model are lost.
+        """
         output_value = module.get_variable_value("%s.makefile" % self.name)
         output = output_value.as_native_path_for_output(module)
 
+        modules = self._modules_in_makefile(deps_graph, module)
+        subdirs = []
+        outdir = os.path.dirname(os.path.abspath(output))
+        for sub in modules[1:]:
+            subfile = sub.get_variable_value("%s.makefile" % self.name).as_native_path_for_output(sub)
+            subdir = os.path.relpath(os.path.dirname(os.path.abspath(subfile)), start=outdir)
+            subdir = "/".join(subdir.split(os.path.sep))
+            if subdir != "." and subdir not in subdirs:
+                subdirs.append(subdir)
+
         paths_info = expr.PathAnchorsInfo(
                 dirsep="/", # FIXME - format-configurable
                 outfile=output,
                 builddir=None,
                 model=module)
 
+        f = io.OutputFile(output, io.EOL_UNIX, creator=self, create_for=module)
+        ctx = MakefileContext(self, module, f, modules, subdirs)
+
         mk_fmt = self.Formatter()
-        expr_fmt = self.ExprFormatter(self, paths_info)
+        expr_fmt = self.ExprFormatter(ctx, paths_info)
 
-        f = io.OutputFile(output, io.EOL_UNIX, creator=self, create_for=module)
-        self.on_header(f, module)
+        self.on_header(ctx)
 
         self._gen_settings(module, mk_fmt, expr_fmt, f)
 
@@ -230,7 +507,7 @@ class MakefileToolset(Toolset):
             g = build_graphs[t].main
             if len(g.outputs) == 0:
                 assert g.name
-                if t.parent is not module:
+                if t.parent not in modules:
                     raise Error("cross-module dependencies on phony targets (\"%s\") not supported yet" % t.name) # TODO
                 out = g.name
             else:
@@ -239,33 +516,15 @@ class MakefileToolset(Toolset):
                 out = g.outputs[0]
             return expr_fmt.format(out)
 
-        def _get_submodule_deps(main, submodule):
-            """
-            Return list of dependencies that 'submodule' has on other submodules of
-            'main'.  Submodules have dependency if a target from one depends on a
-            target from another.
-            """
-            mod_deps = set()
-            project = main.project
-            inspect = [submodule] + [p for p in project.modules if p.is_submodule_of(submodule)]
-            for mod in inspect:
-                for target in mod.targets.itervalues():
-                    for dep in target["deps"]:
-                        tdep = project.get_target(dep.as_py())
-                        tmod = tdep.parent
-                        if tmod is main:
-                            mod_deps.add(_format_dep(tdep))
-                        elif tmod.is_submodule_of(main):
-                            while tmod.parent is not main:
-                                tmod = tmod.parent
-                            if tmod is not submodule:
-                                mod_deps.add(tmod.name)
-            return sorted(mod_deps)
+        if module["%s.nonrecursive" % self.name]:
+            submodules = []
+        else:
+            submodules = deps_graph.submodules(module)
 
         # Write the "all" target:
         all_targets = (
-                      [_format_dep(t) for t in module.targets.itervalues()] +
-                      [sub.name for sub in module.submodules]
+                      [_format_dep(t) for t in ctx.targets] +
+                      [sub.name for sub in submodules]
                       )
         f.write(mk_fmt.target(name="all", deps=all_targets, commands=None))
 
@@ -273,7 +532,10 @@ class MakefileToolset(Toolset):
 
         targets_from_submodules = OrderedDict()
         submakefiles = OrderedDict()
-        for sub in module.submodules:
+        for sub in submodules:
+            sub_target_deps, sub_module_deps = deps_graph.submodule_deps(module, sub)
+            subdeps = set(_format_dep(t) for t in sub_target_deps)
+            subdeps.update(m.name for m in sub_module_deps)
             subpath = sub.get_variable_value("%s.makefile" % self.name)
             # FIXME: use $dirname(), $basename() functions, this is hacky
             subdir = subpath.get_directory_path()
@@ -281,26 +543,23 @@ class MakefileToolset(Toolset):
             submakefiles[sub] = (sub.name,
                                  expr_fmt.format(subdir),
                                  expr_fmt.format(subfile),
-                                 _get_submodule_deps(module, sub))
+                                 sorted(subdeps))
         for subname, subdir, subfile, subdeps in submakefiles.itervalues():
             subcmd = mk_fmt.submake_command(subdir, subfile, "all")
             f.write(mk_fmt.target(name=subname, deps=subdeps, commands=[subcmd]))
             phony_targets.append(subname)
 
-        for t in module.targets.itervalues():
+        for t in ctx.targets:
             with error_context(t):
                 # collect target's dependencies
                 target_deps = []
-                for dep in t["deps"]:
-                    tdep = module.project.get_target(dep.as_py())
+                for tdep in deps_graph.target_deps[t]:
                     tdepstr = _format_dep(tdep)
                     target_deps.append(tdepstr)
-                    if tdep.parent is not module:
+                    if tdep.parent not in modules:
                         # link external dependencies with submodules to build them
-                        tmod = tdep.parent
-                        while tmod.parent is not None and tmod.parent is not module:
-                            tmod = tmod.parent
-                        if tmod in module.submodules:
+                        tmod = deps_graph.child_containing(module, tdep.parent)
+                        if tmod is not None:
                             targets_from_submodules[tdepstr] = tmod
 
                 # generate code for the target's build graph:
@@ -317,18 +576,22 @@ class MakefileToolset(Toolset):
                         if node is graph.main:
                             deps += target_deps
 
+                        order_only_deps = self._get_order_only_deps(ctx, expr_fmt, node)
+
                         out_fmt = [expr_fmt.format(x) for x in out]
                         commands_fmt = [expr_fmt.format(c) for c in node.commands]
                         if len(out_fmt) == 1:
                             text = mk_fmt.target(name=out_fmt[0],
                                                  deps=deps,
-                                                 commands=commands_fmt)
+                                                 commands=commands_fmt,
+                                                 order_only_deps=order_only_deps)
                         else:
                             text = mk_fmt.multifile_target(
                                                  outputs=out,
                                                  outfiles=out_fmt,
                                                  deps=deps,
-                                                 commands=commands_fmt)
+                                                 commands=commands_fmt,
+                                                 order_only_deps=order_only_deps)
                         f.write(text)
                         all_targets += out_fmt
 
@@ -340,15 +603,19 @@ class MakefileToolset(Toolset):
 
         # Write the "clean" target:
         clean_cmds = self._get_clean_commands(
-                        mk_fmt, expr_fmt,
-                        (build_graphs[t] for t in module.targets.itervalues()),
+                        ctx, mk_fmt, expr_fmt,
+                        (build_graphs[t] for t in ctx.targets),
                         submakefiles.itervalues())
         f.write(mk_fmt.target(name="clean", deps=[], commands=clean_cmds))
 
-        self.on_phony_targets(f, phony_targets)
-        self.on_footer(f, module)
+        ctx.depfiles = list(self._get_dependency_files(
+                                ctx, expr_fmt,
+                                (build_graphs[t] for t in ctx.targets)))
+
+        self.on_phony_targets(ctx, phony_targets)
+        self.on_footer(ctx)
 
-        f.commit()
+        return f
 
 
     def _gen_settings(self, module, mk_fmt, expr_fmt, f):
@@ -363,11 +630,12 @@ class MakefileToolset(Toolset):
             f.write(mk_fmt.var_definition(setting.name, expr_fmt.format(setting["default"])))
         f.write("\n%s\n" % mk_fmt.comment("------------"))
 
-    def _get_clean_commands(self, mk_fmt, expr_fmt, graphs, submakefiles):
-        if self.uses_builddir:
-            for e in self.autoclean_extensions:
-                p = expr.PathExpr([expr.LiteralExpr("*." + e)], expr.ANCHOR_BUILDDIR)
-                yield "%s %s" % (self.del_command, expr_fmt.format(p))
+    def _get_clean_commands(self, ctx, mk_fmt, expr_fmt, graphs, submakefiles):
+        if ctx.uses_builddir:
+            for d in [[]] + [x.split("/") for x in ctx.subdirs]:
+                for e in self.autoclean_extensions:
+                    p = expr.PathExpr([expr.LiteralExpr(x) for x in d + ["*." + e]], expr.ANCHOR_BUILDDIR)
+                    yield "%s %s" % (self.del_command, expr_fmt.format(p))
         for g in graphs:
             for node in g.all_nodes():
                 for f in node.outputs:
@@ -380,30 +648,47 @@ class MakefileToolset(Toolset):
         for subname, subdir, subfile, subdeps in submakefiles:
             yield mk_fmt.submake_command(subdir, subfile, "clean")
 
+    def _get_order_only_deps(self, ctx, expr_fmt, node):
+        """
+        Returns (formatted) order-only dependencies of the build *node*, see
+        :meth:`MakefileFormatter.target()`. There are none by default.
+        """
+        return []
+
+    def _get_dependency_files(self, ctx, expr_fmt, graphs):
+        """
+        Returns (formatted) names of dependency files generated by the
+        compiler when building *graphs*. Does nothing by default, toolsets
+        with dependency tracking must override it.
+        """
+        return []
 
-    def on_header(self, file, module):
+
+    def on_header(self, ctx):
         """
         Called before starting generating the output to add any header text,
         typically used to pre-define any make variables.
 
         Call the base class version first to insert a warning about the file
         being auto-generated.
+
+        :param ctx: :class:`MakefileContext` of the makefile being generated.
         """
-        file.write("""\
+        ctx.file.write("""\
 # This file was automatically generated by bakefile.
 #
 # Any manual changes will be lost if it is regenerated,
 # modify the source .bkl file instead if possible.
 """)
 
-    def on_phony_targets(self, file, targets):
+    def on_phony_targets(self, ctx, targets):
         """
         Called with a list of all phony (i.e. not producing actual files)
         targets (as their names as strings) when generating given file.
         """
         pass
 
-    def on_footer(self, file, module):
+    def on_footer(self, ctx):
         """
         Called at the end of generating the output to add any ending text, for
         example unconditional inclusion of dependencies tracking code.
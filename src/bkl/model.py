@@ -69,6 +69,9 @@ class Variable(object):
        Indicates if the value was set explicitly by the user.
        Normally true, only false for properties' default values.
     """
+    __slots__ = ("name", "type", "value", "readonly", "is_property",
+                 "is_explicitly_set", "pos")
+
     def __init__(self, name, value, type=None, readonly=False, source_pos=None):
         self.name = name
         if type is None:
@@ -212,6 +215,11 @@ class ModelPart(object):
 
        Source code position of object's definition, or :const:`None`.
     """
+    # Derived classes that are instantiated very often (targets and source
+    # files) use slots too, the rest has __dict__.
+    __slots__ = ("parent", "variables", "source_pos",
+                 "_memoized_fully_qualified_name")
+
     def __init__(self, parent, source_pos=None):
         self.parent = parent
         self.variables = utils.OrderedDict()
@@ -535,6 +543,20 @@ class Project(ModelPart):
     .. attribute:: templates
 
        Dictionary of all templates defined in the project.
+
+    .. attribute:: up_to_date_modules
+
+       Set of modules whose output files, generated by a previous run, are
+       known to be still up to date (see :mod:`bkl.interpreter.incremental`).
+       Toolsets don't need to generate them again.
+
+    .. attribute:: shared_outputs
+
+       Output files that are the same for all toolsets, e.g. the generated
+       sources of unity builds, and so are written only once, by the first
+       toolset needing them. Maps their filenames to (toolset name, content)
+       tuples. It is shared by all copies of the project made with
+       :meth:`clone()`, i.e. by all toolset-specific models.
     """
 
     name = "project"
@@ -547,10 +569,18 @@ class Project(ModelPart):
         self.settings = utils.OrderedDict()
         self.templates = {}
         self._srcdir_map = {}
+        # imported files that define only project-wide parts and so don't
+        # need to be evaluated again when imported into another module:
+        self._global_imports = set()
+        self.up_to_date_modules = set()
+        self.shared_outputs = {}
+        # link properties of targets that don't depend on the configuration,
+        # keyed by (target, property name), see NativeLinkedType:
+        self._config_independent_link_props = {}
         self.add_configuration(Configuration("Debug",   base=None, is_debug=True))
         self.add_configuration(Configuration("Release", base=None, is_debug=False))
 
-    def clone(self):
+    def clone(self, skip=None):
         """
         Makes an independent copy of the model.
 
@@ -559,7 +589,13 @@ class Project(ModelPart):
         which are read-only, are copied shallowly, but variables or model
         parts, both of which can be modified in further toolset-specific
         optimizations, are copied deeply.
+
+        Targets and source files in the *skip* set, if given, are left out of
+        the copy, unless some other part refers to them, in which case the
+        entire model is copied.
         """
+        if skip is None:
+            skip = frozenset()
         c = Project()
         objmap = {self:c}
         ModelPart._clone_into(self, c)
@@ -567,12 +603,15 @@ class Project(ModelPart):
         for x in self.settings.itervalues():
             x._clone(c, objmap)
         # We'll clone submodules recursively to preserve their parent links:
-        self.top_module._clone(c, objmap)
+        self.top_module._clone(c, objmap, skip)
         # These are read-only, but allow manipulating the dict for removals:
         c.configurations = self.configurations.copy()
         # These are completely read-only:
         c.templates = self.templates
         c._srcdir_map = self._srcdir_map
+        c._global_imports = self._global_imports
+        # This one is shared by the copies on purpose:
+        c.shared_outputs = self.shared_outputs
 
         # We need to process all expressions and remap ReferenceExpr.context to
         # point to the new objects. This is relatively expensive (about as much
@@ -586,8 +625,14 @@ class Project(ModelPart):
                 return expr.ReferenceExpr(e.var, self.objmap[e.context], e.pos)
 
         rewr = _RewriteContext(objmap)
-        for var in c.all_variables():
-            var.value = rewr.visit(var.value)
+        try:
+            for var in c.all_variables():
+                var.value = rewr.visit(var.value)
+        except KeyError:
+            if not skip:
+                raise
+            logger.debug("skipped model parts are referenced, copying all of them")
+            return self.clone()
 
         return c
 
@@ -682,15 +727,16 @@ class Module(ModelPart):
         self.project.modules.append(self)
         self.imports = set()
 
-    def _clone(self, parent, objmap):
+    def _clone(self, parent, objmap, skip):
         c = Module(parent, self.source_pos)
         objmap[self] = c
         ModelPart._clone_into(self, c)
         # These must be fully cloned and they self-register:
         for x in self.targets.itervalues():
-            x._clone(c, objmap)
+            if x not in skip:
+                x._clone(c, objmap, skip)
         for x in self.submodules:
-            x._clone(c, objmap)
+            x._clone(c, objmap, skip)
         # These are completely read-only:
         c.imports = self.imports
         return c
@@ -738,10 +784,12 @@ class Module(ModelPart):
         return props.enum_module_props()
 
 
-class ConfigurationsPropertyMixin:
+class ConfigurationsPropertyMixin(object):
     """
     Mixin class for implementation configurations property.
     """
+    __slots__ = ()
+
     @property
     def configurations(self):
         """
@@ -884,6 +932,8 @@ class Target(ModelPart, ConfigurationsPropertyMixin):
        :attr:`sources` is that headers are installable and usable for
        compilation of other targets, while sources are not.
     """
+    __slots__ = ("name", "type", "sources", "headers")
+
     def __init__(self, parent, name, target_type, source_pos):
         super(Target, self).__init__(parent, source_pos)
         self.name = name
@@ -895,13 +945,13 @@ class Target(ModelPart, ConfigurationsPropertyMixin):
         assert not parent.project.has_target(name)
         parent.targets[name] = self
 
-    def _clone(self, parent, objmap):
+    def _clone(self, parent, objmap, skip):
         c = Target(parent, self.name, self.type, self.source_pos)
         objmap[self] = c
         ModelPart._clone_into(self, c)
         # These must be fully cloned:
-        c.sources = [x._clone(c, objmap) for x in self.sources]
-        c.headers = [x._clone(c, objmap) for x in self.headers]
+        c.sources = [x._clone(c, objmap) for x in self.sources if x not in skip]
+        c.headers = [x._clone(c, objmap) for x in self.headers if x not in skip]
         return c
 
     def __str__(self):
@@ -927,6 +977,8 @@ class SourceFile(ModelPart, ConfigurationsPropertyMixin):
     """
     Source file object.
     """
+    __slots__ = ("_memoized_name",)
+
     def __init__(self, parent, filename, source_pos):
         super(SourceFile, self).__init__(parent, source_pos)
         self.set_property_value("_filename", filename)
@@ -40,10 +40,16 @@ from BakefileLexer import BakefileLexer
 from BakefileParser import BakefileParser, LITERAL
 from BakefileQuotedStringLexer import BakefileQuotedStringLexer
 from BakefileQuotedStringParser import BakefileQuotedStringParser
+import fastparser
 
 from bkl.error import ParserError, VersionError, warning
 from bkl.utils import memoized
 
+#: Use the hand-written parser from :mod:`bkl.parser.fastparser` instead of
+#: the ANTLR-generated one. Both produce the same ASTs and errors, but the
+#: hand-written parser is considerably faster.
+use_fast_parser = False
+
 
 # Helper to implement errors handling in a way we prefer
 class _BakefileErrorsMixin(object):
@@ -62,36 +68,37 @@ class _BakefileErrorsMixin(object):
             return repr(str(s))
 
     def _get_position(self, e):
-        pos = ast.Position()
-        pos.filename = self.filename
-        pos.line = e.line
         if e.charPositionInLine != -1:
-            pos.column = e.charPositionInLine
-        return pos
+            return ast.Position(self.filename, e.line, e.charPositionInLine)
+        else:
+            return ast.Position(self.filename, e.line)
 
 
 # Helper for misc things common to the main parser and island grammars:
 class _BakefileParserMixin(object):
     def unescape(self, token, text):
         """Removes \\ escapes from the text."""
-        out = ""
+        if '\\' not in text:
+            return text
+        out = []
         start = 0
         while True:
             pos = text.find('\\', start)
             if pos == -1:
-                out += text[start:]
+                out.append(text[start:])
                 break
             else:
-                out += text[start:pos]
+                out.append(text[start:pos])
                 c = text[pos+1]
-                out += c
+                out.append(c)
                 start = pos+2
                 if c != '"' and c != '\\' and c != '$':
-                    source_pos = self._get_position(token)
-                    source_pos.column += pos+1
+                    token_pos = self._get_position(token)
+                    source_pos = ast.Position(token_pos.filename, token_pos.line,
+                                              token_pos.column + pos+1)
                     warning("unnecessary escape sequence '\\%s' (did you mean '\\\\%s'?)" % (c, c),
                             pos=source_pos)
-        return out
+        return "".join(out)
 
 
 # The lexer and parser used to parse .bkl files.
@@ -123,6 +130,17 @@ class _Parser(_BakefileErrorsMixin, _BakefileParserMixin, BakefileParser):
         if not text:
             return self._adaptor.create(LITERAL, token, "")
 
+        if '$' not in text:
+            # Fast path for strings without variable references: they are
+            # just a single literal and there's no need to run the island
+            # parser. The node is positioned at the string's content, as
+            # the island parser would do.
+            literal = antlr3.CommonToken(oldToken=token)
+            literal.type = LITERAL
+            literal.charPositionInLine += 1
+            literal.text = self.unescape(literal, text)
+            return self._adaptor.createWithPayload(literal)
+
         stream = antlr3.StringStream(text)
         stream.setLine(token.line)
         stream.setCharPositionInLine(token.charPositionInLine + 1)
@@ -160,9 +178,11 @@ def parse(code, filename=None, detect_compatibility_errors=True):
     The optional filename argument allows specifying input file name for the purpose
     of errors reporting.
     """
-    parser = get_parser(code, filename)
     try:
-        return parser.program().tree
+        if use_fast_parser:
+            return fastparser.parse(code, filename)
+        else:
+            return get_parser(code, filename).program().tree
     except ParserError as err:
         if not detect_compatibility_errors:
             raise
@@ -181,8 +201,7 @@ def parse(code, filename=None, detect_compatibility_errors=True):
                     try:
                         parse(ln, detect_compatibility_errors=False)
                     except VersionError as e:
-                        e.pos.filename = filename
-                        e.pos.line = idx+1
+                        e.pos = ast.Position(filename, idx+1, e.pos.column)
                         raise
                     except ParserError as e:
                         pass
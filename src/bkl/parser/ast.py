@@ -28,6 +28,20 @@ import BakefileParser
 
 from bkl.utils import memoized_property
 
+# Table of filenames used in positions, Position only stores the index into it:
+_filenames = [None]
+_filenames_index = {None: 0}
+
+def _intern_filename(filename):
+    try:
+        return _filenames_index[filename]
+    except KeyError:
+        idx = len(_filenames)
+        _filenames.append(filename)
+        _filenames_index[filename] = idx
+        return idx
+
+
 class Position(object):
     """
     Location of an error in input file.
@@ -35,6 +49,8 @@ class Position(object):
     All of its attributes are optional and may be None. Convert the object
     to string to get human-readable output.
 
+    Positions are immutable and can be compared and used as dictionary keys.
+
     .. attribute:: filename
 
        Name of the source file.
@@ -47,24 +63,43 @@ class Position(object):
 
        Column on the line.
     """
+    __slots__ = ("_file", "_line", "_column")
+
     def __init__(self, filename=None, line=None, column=None):
-        self.filename = filename
-        self.line = line
-        self.column = column
+        self._file = _intern_filename(filename)
+        self._line = line
+        self._column = column
+
+    filename = property(lambda self: _filenames[self._file])
+    line = property(lambda self: self._line)
+    column = property(lambda self: self._column)
 
     def __eq__(self, other):
-        return (self.filename == other.filename and
-                self.line == other.line and
-                self.column == other.column)
+        if not isinstance(other, Position):
+            return False
+        return (self._file == other._file and
+                self._line == other._line and
+                self._column == other._column)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self._file, self._line, self._column))
+
+    def __reduce__(self):
+        # the index into filenames table is only valid in this process
+        return (Position, (self.filename, self._line, self._column))
 
     def __str__(self):
         hdr = []
-        if self.filename:
-            hdr.append(self.filename)
-        if self.line is not None:
-            hdr.append(str(self.line))
-        if self.column is not None:
-            hdr.append(str(self.column))
+        filename = _filenames[self._file]
+        if filename:
+            hdr.append(filename)
+        if self._line is not None:
+            hdr.append(str(self._line))
+        if self._column is not None:
+            hdr.append(str(self._column))
         return ":".join(hdr)
 
 
@@ -79,12 +114,10 @@ class Node(CommonTree):
     @memoized_property
     def pos(self):
         """Position of the node in source code"""
-        pos = Position()
-        pos.filename = self.filename
         if self.token:
-            pos.line = self.line
-            pos.column = self.charPositionInLine
-        return pos
+            return Position(self.filename, self.line, self.charPositionInLine)
+        else:
+            return Position(self.filename)
 
     def __str__(self):
         return self.__class__.__name__
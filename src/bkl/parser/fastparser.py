@@ -0,0 +1,1010 @@
+#
+#  This file is part of Bakefile (http://bakefile.org)
+#
+#  Copyright (C) 2008-2013 Vaclav Slavik
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+
+"""
+Hand-written lexer and recursive-descent parser for .bkl files.
+
+This is a faster alternative to the ANTLR-generated parser from Bakefile.g
+and BakefileQuotedString.g. It builds the same :mod:`bkl.parser.ast` trees,
+with the same source positions, and reports errors with the same messages
+as the generated code does, including ANTLR's way of choosing between
+"missing", "extraneous" and "mismatched" token errors. Both grammars must be
+kept in sync with this module.
+
+Don't use directly, set :data:`bkl.parser.use_fast_parser` instead.
+"""
+
+import re
+
+from antlr3 import CommonToken, EOF, EOR_TOKEN_TYPE as EOR
+from antlr3.tree import RewriteEarlyExitException, RewriteEmptyStreamException
+
+import ast
+from BakefileParser import tokenNames, \
+        ANCHOR_KEYWORD, AND, APPEND, ASSIGN, BASE_LIST, BOOLVAL, CONCAT, \
+        CONFIGURATION, DOUBLE_QUOTED_TEXT, EQUAL, FALSE, FILES_LIST, ID, IF, \
+        IMPORT, LIST, LITERAL, LPAREN, LVALUE, NIL, NOT, NOT_EQUAL, OR, \
+        PATH_ANCHOR, PLUGIN, PROGRAM, RPAREN, SCOPE_SEP, SETTING, \
+        SINGLE_QUOTED_TEXT, SRCDIR, SUBMODULE, TARGET, TEMPLATE, TEXT, TRUE, \
+        VAR_REFERENCE
+from BakefileQuotedStringParser import tokenNames as quotedTokenNames, \
+        ANY_TEXT, REF_CLOSE, REF_OPEN
+
+from bkl.error import ParserError, VersionError, warning
+
+
+# Tokens that are only defined as literals in the grammar:
+def _literal_token(text):
+    return tokenNames.index("'%s'" % text)
+
+DOLLAR            = _literal_token("$")
+APPEND_OP         = _literal_token("+=")
+COMMA             = _literal_token(",")
+COLON             = _literal_token(":")
+SEMICOLON         = _literal_token(";")
+ASSIGN_OP         = _literal_token("=")
+LBRACE            = _literal_token("{")
+RBRACE            = _literal_token("}")
+KW_CONFIGURATION  = _literal_token("configuration")
+KW_HEADERS        = _literal_token("headers")
+KW_IF             = _literal_token("if")
+KW_IMPORT         = _literal_token("import")
+KW_PLUGIN         = _literal_token("plugin")
+KW_REQUIRES       = _literal_token("requires")
+KW_SETTING        = _literal_token("setting")
+KW_SOURCES        = _literal_token("sources")
+KW_SRCDIR         = _literal_token("srcdir")
+KW_SUBMODULE      = _literal_token("submodule")
+KW_TEMPLATE       = _literal_token("template")
+
+_KEYWORDS = {
+    "true"          : TRUE,
+    "false"         : FALSE,
+    "configuration" : KW_CONFIGURATION,
+    "headers"       : KW_HEADERS,
+    "if"            : KW_IF,
+    "import"        : KW_IMPORT,
+    "plugin"        : KW_PLUGIN,
+    "requires"      : KW_REQUIRES,
+    "setting"       : KW_SETTING,
+    "sources"       : KW_SOURCES,
+    "srcdir"        : KW_SRCDIR,
+    "submodule"     : KW_SUBMODULE,
+    "template"      : KW_TEMPLATE,
+}
+
+_OPERATORS = {
+    "&&" : AND,
+    "||" : OR,
+    "==" : EQUAL,
+    "!=" : NOT_EQUAL,
+    "::" : SCOPE_SEP,
+    "+=" : APPEND_OP,
+    "!"  : NOT,
+    "="  : ASSIGN_OP,
+    ":"  : COLON,
+    "("  : LPAREN,
+    ")"  : RPAREN,
+    ","  : COMMA,
+    ";"  : SEMICOLON,
+    "{"  : LBRACE,
+    "}"  : RBRACE,
+    "$"  : DOLLAR,
+}
+
+# All of the main grammar's tokens in one regex. Hidden tokens (whitespace
+# and comments) aren't distinguished from each other, because only their
+# presence matters to the parser.
+_TOKEN_RE = re.compile(r"""
+      (?P<hidden>  [ \t\r\n]+ | //[^\r\n]*\r?\n | /\*.*?\*/ )
+    | (?P<text>    (?!/[/*])[-a-zA-Z0-9_./]+ )
+    | (?P<dq>      "(?:\\.|[^"\\])*" )
+    | (?P<sq>      '(?:\\.|[^'\\])*' )
+    | (?P<anchor>  @[a-z_]+ )
+    | (?P<op>      &&|\|\||==|!=|::|\+=|[!=:(),;{}$] )
+    """, re.VERBOSE | re.DOTALL)
+
+# Text of double-quoted strings outside of and inside $(...), respectively:
+_QUOTED_TEXT_RE = re.compile(r"(?:\\.|[^\\$])+", re.DOTALL)
+_QUOTED_REF_TEXT_RE = re.compile(r"[-a-zA-Z0-9_./@]+")
+
+
+# Sets of tokens used by the parser's decisions. The names of the FOLLOW_*
+# sets refer to the FOLLOW_* sets in the generated parser, which are used
+# for the same purpose: to distinguish between kinds of errors in the same
+# way as ANTLR does.
+_STMT_START_ALWAYS = frozenset([SCOPE_SEP, TEXT, KW_IF, SEMICOLON])
+_STMT_START_TARGET = frozenset([KW_HEADERS, KW_SOURCES])
+_STMT_START_GLOBAL = frozenset([KW_CONFIGURATION, KW_IMPORT, KW_PLUGIN,
+                                KW_REQUIRES, KW_SETTING, KW_SUBMODULE,
+                                KW_TEMPLATE])
+_STMT_START = _STMT_START_ALWAYS | _STMT_START_TARGET | _STMT_START_GLOBAL
+_ELEMENT_START = frozenset([ANCHOR_KEYWORD, DOUBLE_QUOTED_TEXT, FALSE,
+                            SINGLE_QUOTED_TEXT, TEXT, TRUE, DOLLAR])
+_ELEMENT_END = frozenset([AND, EQUAL, NOT_EQUAL, OR, RPAREN, SEMICOLON,
+                          RBRACE])
+_EXPR_START = _ELEMENT_START | frozenset([LPAREN, NOT])
+_LITERAL_START = frozenset([DOUBLE_QUOTED_TEXT, SINGLE_QUOTED_TEXT, TEXT])
+
+_FOLLOW_END = frozenset([EOR])
+_FOLLOW_INTRODUCTORY_STMT = _STMT_START | frozenset([KW_SRCDIR])
+_FOLLOW_STMT = _STMT_START
+_FOLLOW_STMT_IN_BLOCK = _STMT_START | frozenset([RBRACE])
+_FOLLOW_IF_CONDITION = _STMT_START | frozenset([LBRACE])
+_FOLLOW_LPAREN = _EXPR_START
+_FOLLOW_RPAREN = frozenset([RPAREN])
+_FOLLOW_RBRACE = frozenset([RBRACE])
+_FOLLOW_LBRACE = frozenset([LBRACE])
+_FOLLOW_SEMICOLON = frozenset([SEMICOLON])
+_FOLLOW_EXPR_OR = frozenset([EOR, AND])
+_FOLLOW_EXPR_EQ = frozenset([EOR, OR])
+_FOLLOW_EXPR_ATOM = frozenset([EOR, EQUAL, NOT_EQUAL])
+_FOLLOW_FIRST_ELEMENT_PART = _ELEMENT_START
+_FOLLOW_ELEMENT_PART = _ELEMENT_START | frozenset([EOR])
+_FOLLOW_TEMPLATE_NAME = frozenset([COLON, LBRACE])
+_FOLLOW_BASE_TEMPLATE = frozenset([EOR, COMMA])
+_FOLLOW_CONFIGURATION_NAME = frozenset([COLON, SEMICOLON, LBRACE])
+_FOLLOW_SETTING_NAME = frozenset([SEMICOLON, LBRACE])
+_FOLLOW_SOURCES_LBRACE = _ELEMENT_START
+
+_FOLLOW_QUOTED_CONTENT = frozenset()
+_FOLLOW_FIRST_QUOTED_COMPONENT = frozenset([ANY_TEXT, REF_OPEN])
+_FOLLOW_QUOTED_COMPONENT = frozenset([EOR, ANY_TEXT, REF_OPEN])
+_FOLLOW_REF_IDENTIFIER = frozenset([REF_CLOSE])
+
+
+class _Token(object):
+    """
+    Lexer token. Uses the same attribute names as ANTLR's tokens.
+
+    *start* and *stop* are offsets of the token in the input, with *stop*
+    pointing one character past the token's end.
+    """
+    __slots__ = ["type", "text", "line", "charPositionInLine", "start", "stop"]
+
+    def __init__(self, type, text, line, charPositionInLine, start, stop):
+        self.type = type
+        self.text = text
+        self.line = line
+        self.charPositionInLine = charPositionInLine
+        self.start = start
+        self.stop = stop
+
+
+def _char_display(text, pos):
+    if pos < len(text):
+        return repr(text[pos])
+    else:
+        return "'<EOF>'"
+
+
+def _line_and_column(text, pos, line, column):
+    """
+    Returns line and column of *pos* in *text*, given that *text* starts at
+    *line* and *column*.
+    """
+    newlines = text.count("\n", 0, pos)
+    if newlines:
+        return (line + newlines, pos - text.rindex("\n", 0, pos) - 1)
+    else:
+        return (line, column + pos)
+
+
+def _lexer_error(filename, code, pos):
+    """
+    Raises ParserError for input that didn't match any token at *pos*, with
+    the same message ANTLR's lexer would use.
+    """
+    c = code[pos]
+    c2 = code[pos+1:pos+2]
+    err_pos = pos+1
+    if c == "/" and c2 == "*":
+        err_pos = len(code)
+        msg = "mismatched character '<EOF>' expecting '*'"
+    elif c == "/" and c2 == "/":
+        # comment ended with a lone \r
+        err_pos = code.index("\r", pos) + 1
+        msg = "mismatched character %s expecting u'\\n'" % _char_display(code, err_pos)
+    elif c == '"' or c == "'":
+        err_pos = len(code)
+        msg = "mismatched character '<EOF>' expecting %s" % repr(unicode(c))
+    elif c == "&" or c == "|":
+        msg = "mismatched character %s expecting '%s'" % (_char_display(code, err_pos), c)
+    elif c == "+":
+        msg = "mismatched character %s expecting '='" % _char_display(code, err_pos)
+    elif c == "@":
+        msg = "required (...)+ loop did not match anything at character %s" % _char_display(code, err_pos)
+    else:
+        err_pos = pos
+        msg = "no viable alternative at character %s" % _char_display(code, pos)
+    line, column = _line_and_column(code, err_pos, 1, 0)
+    raise ParserError(msg, pos=ast.Position(filename, line, column))
+
+
+def _tokenize(code, filename):
+    """
+    Splits *code* into tokens, returning a list of significant (i.e. not
+    hidden) tokens terminated with the EOF token.
+    """
+    tokens = []
+    append = tokens.append
+    match = _TOKEN_RE.match
+    keywords = _KEYWORDS
+    operators = _OPERATORS
+    line = 1
+    line_start = 0
+    pos = 0
+    end = len(code)
+    while pos < end:
+        m = match(code, pos)
+        if m is None:
+            _lexer_error(filename, code, pos)
+        kind = m.lastgroup
+        text = m.group()
+        stop = m.end()
+        if kind == "text":
+            append(_Token(keywords.get(text, TEXT), text, line, pos - line_start, pos, stop))
+        elif kind == "op":
+            append(_Token(operators[text], text, line, pos - line_start, pos, stop))
+        elif kind == "anchor":
+            append(_Token(ANCHOR_KEYWORD, text, line, pos - line_start, pos, stop))
+        else:
+            if kind == "dq":
+                append(_Token(DOUBLE_QUOTED_TEXT, text, line, pos - line_start, pos, stop))
+            elif kind == "sq":
+                append(_Token(SINGLE_QUOTED_TEXT, text, line, pos - line_start, pos, stop))
+            newlines = text.count("\n")
+            if newlines:
+                line += newlines
+                line_start = pos + text.rindex("\n") + 1
+        pos = stop
+    append(_Token(EOF, "<EOF>", line, pos - line_start, pos, pos))
+    return tokens
+
+
+def _tokenize_quoted(text, filename, line, column):
+    """
+    Splits content of double-quoted string into tokens of the
+    BakefileQuotedString grammar. *line* and *column* are the position of
+    the first character of *text*.
+    """
+    tokens = []
+    append = tokens.append
+    start_line = line
+    line_start = -column
+    depth = 0
+    pos = 0
+    end = len(text)
+    while pos < end:
+        c = text[pos]
+        if c == "$":
+            if text[pos+1:pos+2] != "(":
+                err_line, err_column = _line_and_column(text, pos+1, start_line, column)
+                raise ParserError("mismatched character %s expecting '('" % _char_display(text, pos+1),
+                                  pos=ast.Position(filename, err_line, err_column))
+            append(_Token(REF_OPEN, text[pos:pos+2], line, pos - line_start, pos, pos+2))
+            depth += 1
+            pos += 2
+        elif depth:
+            if c == ")":
+                append(_Token(REF_CLOSE, c, line, pos - line_start, pos, pos+1))
+                depth -= 1
+                pos += 1
+            else:
+                m = _QUOTED_REF_TEXT_RE.match(text, pos)
+                if m is None:
+                    err_line, err_column = _line_and_column(text, pos, start_line, column)
+                    raise ParserError("rule ANY_TEXT failed predicate: {self.inside_ref == 0}?",
+                                      pos=ast.Position(filename, err_line, err_column))
+                stop = m.end()
+                append(_Token(ANY_TEXT, m.group(), line, pos - line_start, pos, stop))
+                pos = stop
+        else:
+            m = _QUOTED_TEXT_RE.match(text, pos)
+            s = m.group()
+            stop = m.end()
+            append(_Token(ANY_TEXT, s, line, pos - line_start, pos, stop))
+            newlines = s.count("\n")
+            if newlines:
+                line += newlines
+                line_start = pos + s.rindex("\n") + 1
+            pos = stop
+    append(_Token(EOF, "<EOF>", line, pos - line_start, pos, pos))
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive-descent parser for the Bakefile grammar.
+
+    Methods correspond to the grammar's rules and their decisions are made
+    in the same way the generated parser makes them. The parser keeps track
+    of FOLLOW sets of the rules being parsed in the same way ANTLR does,
+    because they are needed to produce the same error messages. Sets that
+    consist of just EOR don't affect the result and so aren't tracked.
+    """
+
+    # number of EOF tokens appended to the input to allow lookahead past it
+    LOOKAHEAD = 5
+
+    def __init__(self, tokens, filename, token_names):
+        self.tokens = tokens + [tokens[-1]] * self.LOOKAHEAD
+        self.types = [t.type for t in self.tokens]
+        self.p = 0
+        self.filename = filename
+        self.token_names = token_names
+        self.following = []
+        self.inside_target = False
+        self.inside_config_or_setting = False
+        self.create = ast._TreeAdaptor(filename).createWithPayload
+
+    # --- AST construction ---
+
+    def node(self, type, token, text=None):
+        """Creates AST node of given type from lexer token."""
+        t = CommonToken(type=type, text=token.text if text is None else text)
+        t.line = token.line
+        t.charPositionInLine = token.charPositionInLine
+        return self.create(t)
+
+    def imaginary_node(self, type, text=None):
+        """Creates AST node of given type that doesn't correspond to any token."""
+        return self.create(CommonToken(type=type, text=text))
+
+    # --- errors handling ---
+
+    def error(self, msg, token):
+        raise ParserError(msg, pos=ast.Position(self.filename,
+                                                token.line,
+                                                token.charPositionInLine))
+
+    def token_display(self, token):
+        return repr(str(token.text))
+
+    def token_name(self, type):
+        if type == EOF:
+            return "EOF"
+        return self.token_names[type]
+
+    def no_viable_alt(self, p=None):
+        token = self.tokens[self.p if p is None else p]
+        self.error("no viable alternative at input %s" % self.token_display(token), token)
+
+    def early_exit(self):
+        token = self.tokens[self.p]
+        self.error("required (...)+ loop did not match anything at input %s" % self.token_display(token), token)
+
+    def match(self, type, follow):
+        """
+        Consumes token of given type and returns it. *follow* is the set of
+        tokens that may follow it in the current rule.
+        """
+        p = self.p
+        if self.types[p] == type:
+            self.p = p + 1
+            return self.tokens[p]
+        token = self.tokens[p]
+        expected = self.token_name(type)
+        if self.types[p+1] == type:
+            self.error("extraneous input %s expecting %s" % (self.token_display(token), expected), token)
+        if EOR in follow:
+            follow = follow | self.combine_follows()
+            if self.following:
+                follow = follow - _FOLLOW_END
+        if token.type in follow or EOR in follow:
+            self.error("missing %s at %s" % (expected, self.token_display(token)), token)
+        else:
+            self.error("mismatched input %s expecting %s" % (self.token_display(token), expected), token)
+
+    def combine_follows(self):
+        result = set()
+        for idx in xrange(len(self.following)-1, -1, -1):
+            local = self.following[idx]
+            result |= local
+            if EOR in local:
+                if idx > 0:
+                    result.discard(EOR)
+            else:
+                break
+        return result
+
+    def unescape(self, token, text):
+        """Removes \\ escapes from the text."""
+        if "\\" not in text:
+            return text
+        out = []
+        start = 0
+        while True:
+            pos = text.find("\\", start)
+            if pos == -1:
+                out.append(text[start:])
+                break
+            out.append(text[start:pos])
+            c = text[pos+1]
+            out.append(c)
+            start = pos+2
+            if c != '"' and c != '\\' and c != '$':
+                warning("unnecessary escape sequence '\\%s' (did you mean '\\\\%s'?)" % (c, c),
+                        pos=ast.Position(self.filename,
+                                         token.line,
+                                         token.charPositionInLine + pos+1))
+        return "".join(out)
+
+
+class _QuotedStringParser(_Parser):
+    """Parser for the BakefileQuotedString island grammar."""
+
+    def __init__(self, tokens, filename):
+        _Parser.__init__(self, tokens, filename, quotedTokenNames)
+
+    def identifier(self):
+        return self.node(ID, self.match(ANY_TEXT, _FOLLOW_END))
+
+    def quoted_string(self):
+        types = self.types
+        t = types[0]
+        if t == ANY_TEXT:
+            t2 = types[1]
+            if t2 == EOF:
+                multi = False
+            elif t2 == ANY_TEXT or t2 == REF_OPEN:
+                multi = True
+            else:
+                self.no_viable_alt()
+        elif t == REF_OPEN:
+            if types[1] != ANY_TEXT or types[2] != REF_CLOSE:
+                self.no_viable_alt()
+            t4 = types[3]
+            if t4 == EOF:
+                multi = False
+            elif t4 == ANY_TEXT or t4 == REF_OPEN:
+                multi = True
+            else:
+                self.no_viable_alt()
+        else:
+            self.no_viable_alt()
+
+        if multi:
+            fp = self.following
+            fp.append(_FOLLOW_QUOTED_CONTENT)
+            result = self.imaginary_node(CONCAT, "CONCAT")
+            fp.append(_FOLLOW_FIRST_QUOTED_COMPONENT)
+            result.addChild(self.quoted_string_component())
+            fp[-1] = _FOLLOW_QUOTED_COMPONENT
+            while types[self.p] == ANY_TEXT or types[self.p] == REF_OPEN:
+                result.addChild(self.quoted_string_component())
+            fp.pop()
+            fp.pop()
+        else:
+            result = self.quoted_string_component()
+        self.match(EOF, _FOLLOW_END)
+        return result
+
+    def quoted_string_component(self):
+        t = self.types[self.p]
+        if t == ANY_TEXT:
+            token = self.tokens[self.p]
+            self.p += 1
+            return self.node(LITERAL, token, self.unescape(token, token.text))
+        elif t == REF_OPEN:
+            self.p += 1
+            self.following.append(_FOLLOW_REF_IDENTIFIER)
+            ident = self.identifier()
+            self.following.pop()
+            self.match(REF_CLOSE, _FOLLOW_END)
+            n = self.imaginary_node(VAR_REFERENCE, "VAR_REFERENCE")
+            n.addChild(ident)
+            return n
+        else:
+            self.no_viable_alt()
+
+
+class _BakefileParser(_Parser):
+    """Parser for the main Bakefile grammar."""
+
+    def __init__(self, tokens, filename):
+        _Parser.__init__(self, tokens, filename, tokenNames)
+
+    def identifier(self):
+        return self.node(ID, self.match(TEXT, _FOLLOW_END))
+
+    def at_stmt(self):
+        """Returns True if the next token starts a statement."""
+        t = self.types[self.p]
+        if t in _STMT_START_ALWAYS:
+            return True
+        if self.inside_target:
+            return t in _STMT_START_TARGET
+        if not self.inside_config_or_setting:
+            return t in _STMT_START_GLOBAL
+        return False
+
+    def stmts(self, parent, follow):
+        """Parses stmt* loop, adding the statements to *parent*."""
+        self.following.append(follow)
+        while self.at_stmt():
+            self.stmt(parent)
+        self.following.pop()
+
+    def program(self):
+        root = self.imaginary_node(PROGRAM, "PROGRAM")
+        fp = self.following
+        if self.types[self.p] == KW_SRCDIR:
+            fp.append(_FOLLOW_INTRODUCTORY_STMT)
+            while self.types[self.p] == KW_SRCDIR:
+                root.addChild(self.keyword_stmt(SRCDIR))
+            fp.pop()
+        self.stmts(root, _FOLLOW_STMT)
+        self.match(EOF, _FOLLOW_END)
+        return root
+
+    def stmt(self, parent):
+        types = self.types
+        p = self.p
+        t = types[p]
+        if t == TEXT:
+            t2 = types[p+1]
+            if t2 == SCOPE_SEP or t2 == ASSIGN_OP or t2 == APPEND_OP:
+                parent.addChild(self.assignment_stmt())
+            elif (t2 == TEXT and not self.inside_target and
+                  not self.inside_config_or_setting):
+                parent.addChild(self.target_stmt())
+            else:
+                self.no_viable_alt()
+        elif t == SCOPE_SEP:
+            parent.addChild(self.assignment_stmt())
+        elif t == KW_IF:
+            parent.addChild(self.if_stmt())
+        elif t == SEMICOLON:
+            self.p += 1
+        elif self.inside_target and t in _STMT_START_TARGET:
+            parent.addChild(self.sources_stmt())
+        elif (not self.inside_target and not self.inside_config_or_setting and
+              t in _STMT_START_GLOBAL):
+            if t == KW_SUBMODULE:
+                parent.addChild(self.keyword_stmt(SUBMODULE))
+            elif t == KW_IMPORT:
+                parent.addChild(self.keyword_stmt(IMPORT))
+            elif t == KW_PLUGIN:
+                parent.addChild(self.keyword_stmt(PLUGIN))
+            elif t == KW_REQUIRES:
+                self.requires_stmt()
+            elif t == KW_CONFIGURATION:
+                parent.addChild(self.configuration_stmt())
+            elif t == KW_SETTING:
+                parent.addChild(self.setting_stmt())
+            else:
+                parent.addChild(self.template_stmt())
+        else:
+            self.no_viable_alt()
+
+    def assignment_stmt(self):
+        types = self.types
+        start = p = self.p
+        # check the whole lvalue first, as the generated parser's DFA does
+        if types[p] == SCOPE_SEP:
+            p += 1
+            if types[p] != TEXT:
+                self.no_viable_alt(p)
+        p += 1
+        while types[p] == SCOPE_SEP:
+            p += 1
+            if types[p] != TEXT:
+                self.no_viable_alt(p)
+            p += 1
+        op = types[p]
+        if op == ASSIGN_OP:
+            n = self.imaginary_node(ASSIGN, "ASSIGN")
+        elif op == APPEND_OP:
+            n = self.imaginary_node(APPEND, "APPEND")
+        else:
+            self.no_viable_alt(p)
+
+        lvalue = self.imaginary_node(LVALUE, "LVALUE")
+        p = start
+        if types[p] == SCOPE_SEP:
+            lvalue.addChild(self.imaginary_node(NIL, "NIL"))
+            p += 1
+        while types[p+1] == SCOPE_SEP:
+            lvalue.addChild(self.node(ID, self.tokens[p]))
+            p += 2
+        lvalue.addChild(self.node(ID, self.tokens[p]))
+        self.p = p + 2
+        n.addChild(lvalue)
+
+        self.following.append(_FOLLOW_SEMICOLON)
+        n.addChild(self.expression())
+        self.following.pop()
+        self.match(SEMICOLON, _FOLLOW_END)
+        return n
+
+    def if_stmt(self):
+        self.p += 1
+        self.match(LPAREN, _FOLLOW_LPAREN)
+        self.following.append(_FOLLOW_RPAREN)
+        cond = self.expression()
+        self.following.pop()
+        self.match(RPAREN, _FOLLOW_IF_CONDITION)
+        n = self.imaginary_node(IF, "IF")
+        n.addChild(cond)
+
+        # if_body; notice that the generated parser fails with an internal
+        # ANTLR exception if the body doesn't produce any AST nodes, so do
+        # the same for consistency:
+        count = n.getChildCount()
+        if self.at_stmt():
+            self.stmt(n)
+            if n.getChildCount() == count:
+                raise RewriteEmptyStreamException("rule if_body")
+        elif self.types[self.p] == LBRACE:
+            t2 = self.types[self.p+1]
+            if t2 == RBRACE:
+                self.p += 2
+                n.addChild(self.imaginary_node(NIL, "NIL"))
+            elif t2 in _STMT_START:
+                self.p += 1
+                self.following.append(_FOLLOW_STMT_IN_BLOCK)
+                if not self.at_stmt():
+                    self.early_exit()
+                while self.at_stmt():
+                    self.stmt(n)
+                self.following.pop()
+                self.match(RBRACE, _FOLLOW_END)
+                if n.getChildCount() == count:
+                    raise RewriteEarlyExitException()
+            else:
+                self.no_viable_alt()
+        else:
+            self.no_viable_alt()
+        return n
+
+    def keyword_stmt(self, type):
+        """Parses submodule, import, plugin and srcdir statements."""
+        self.p += 1
+        self.following.append(_FOLLOW_SEMICOLON)
+        lit = self.literal()
+        self.following.pop()
+        self.match(SEMICOLON, _FOLLOW_END)
+        n = self.imaginary_node(type, tokenNames[type])
+        n.addChild(lit)
+        return n
+
+    def requires_stmt(self):
+        self.p += 1
+        t = self.match(TEXT, _FOLLOW_SEMICOLON)
+        self.match(SEMICOLON, _FOLLOW_END)
+        try:
+            from bkl.version import check_version
+            check_version(t.text)
+        except VersionError as e:
+            e.pos = ast.Position(self.filename, t.line, t.charPositionInLine)
+            raise
+
+    def configuration_stmt(self):
+        saved_scope = (self.inside_target, self.inside_config_or_setting)
+        self.inside_target = False
+        self.inside_config_or_setting = True
+        self.p += 1
+        n = self.imaginary_node(CONFIGURATION, "CONFIGURATION")
+        fp = self.following
+        fp.append(_FOLLOW_CONFIGURATION_NAME)
+        n.addChild(self.literal())
+        fp[-1] = _FOLLOW_SETTING_NAME
+        # configuration_base:
+        t = self.types[self.p]
+        base = self.imaginary_node(BASE_LIST, "BASE_LIST")
+        if t == COLON:
+            self.p += 1
+            base.addChild(self.literal())
+        elif t != SEMICOLON and t != LBRACE:
+            self.no_viable_alt()
+        fp.pop()
+        n.addChild(base)
+        self.block_or_semicolon(n)
+        self.inside_target, self.inside_config_or_setting = saved_scope
+        return n
+
+    def setting_stmt(self):
+        saved_scope = (self.inside_target, self.inside_config_or_setting)
+        self.inside_target = False
+        self.inside_config_or_setting = True
+        self.p += 1
+        n = self.imaginary_node(SETTING, "SETTING")
+        self.following.append(_FOLLOW_SETTING_NAME)
+        n.addChild(self.identifier())
+        self.following.pop()
+        self.block_or_semicolon(n)
+        self.inside_target, self.inside_config_or_setting = saved_scope
+        return n
+
+    def block_or_semicolon(self, parent):
+        """Parses (configuration_content | ';') and similar for settings."""
+        t = self.types[self.p]
+        if t == LBRACE:
+            self.p += 1
+            self.stmts(parent, _FOLLOW_STMT_IN_BLOCK)
+            self.match(RBRACE, _FOLLOW_END)
+        elif t == SEMICOLON:
+            self.p += 1
+        else:
+            self.no_viable_alt()
+
+    def target_stmt(self):
+        saved_scope = (self.inside_target, self.inside_config_or_setting)
+        self.inside_target = True
+        self.inside_config_or_setting = False
+        n = self.imaginary_node(TARGET, "TARGET")
+        n.addChild(self.node(ID, self.tokens[self.p]))
+        n.addChild(self.node(ID, self.tokens[self.p+1]))
+        self.p += 2
+        self.following.append(_FOLLOW_LBRACE)
+        n.addChild(self.base_templates())
+        self.following.pop()
+        self.block(n)
+        self.inside_target, self.inside_config_or_setting = saved_scope
+        return n
+
+    def template_stmt(self):
+        saved_scope = (self.inside_target, self.inside_config_or_setting)
+        self.inside_target = True
+        self.inside_config_or_setting = False
+        self.p += 1
+        n = self.imaginary_node(TEMPLATE, "TEMPLATE")
+        fp = self.following
+        fp.append(_FOLLOW_TEMPLATE_NAME)
+        n.addChild(self.identifier())
+        fp[-1] = _FOLLOW_LBRACE
+        n.addChild(self.base_templates())
+        fp.pop()
+        self.block(n)
+        self.inside_target, self.inside_config_or_setting = saved_scope
+        return n
+
+    def block(self, parent):
+        """Parses '{' stmt* '}' part of targets and templates."""
+        self.match(LBRACE, _FOLLOW_STMT_IN_BLOCK)
+        self.stmts(parent, _FOLLOW_STMT_IN_BLOCK)
+        self.match(RBRACE, _FOLLOW_END)
+
+    def base_templates(self):
+        t = self.types[self.p]
+        n = self.imaginary_node(BASE_LIST, "BASE_LIST")
+        if t == COLON:
+            self.p += 1
+            self.following.append(_FOLLOW_BASE_TEMPLATE)
+            n.addChild(self.identifier())
+            while self.types[self.p] == COMMA:
+                self.p += 1
+                n.addChild(self.identifier())
+            self.following.pop()
+        elif t != LBRACE:
+            self.no_viable_alt()
+        return n
+
+    def sources_stmt(self):
+        n = self.imaginary_node(FILES_LIST, "FILES_LIST")
+        n.addChild(self.node(ID, self.tokens[self.p]))
+        self.p += 1
+        self.match(LBRACE, _FOLLOW_SOURCES_LBRACE)
+        self.following.append(_FOLLOW_RBRACE)
+        n.addChild(self.element())
+        self.following.pop()
+        self.match(RBRACE, _FOLLOW_END)
+        return n
+
+    # --- expressions ---
+
+    def expression(self):
+        # expr_and
+        fp = self.following
+        fp.append(_FOLLOW_EXPR_OR)
+        n = self.expr_or()
+        while self.types[self.p] == AND:
+            op = self.node(AND, self.tokens[self.p])
+            self.p += 1
+            op.addChild(n)
+            op.addChild(self.expr_or())
+            n = op
+        fp.pop()
+        return n
+
+    def expr_or(self):
+        fp = self.following
+        fp.append(_FOLLOW_EXPR_EQ)
+        n = self.expr_eq()
+        while self.types[self.p] == OR:
+            op = self.node(OR, self.tokens[self.p])
+            self.p += 1
+            op.addChild(n)
+            op.addChild(self.expr_eq())
+            n = op
+        fp.pop()
+        return n
+
+    def expr_eq(self):
+        fp = self.following
+        fp.append(_FOLLOW_EXPR_ATOM)
+        n = self.expr_atom()
+        fp.pop()
+        t = self.types[self.p]
+        if t == EQUAL or t == NOT_EQUAL:
+            op = self.node(t, self.tokens[self.p])
+            self.p += 1
+            op.addChild(n)
+            op.addChild(self.expr_atom())
+            n = op
+        return n
+
+    def expr_atom(self):
+        t = self.types[self.p]
+        if t in _ELEMENT_START:
+            return self.element()
+        elif t == NOT:
+            n = self.node(NOT, self.tokens[self.p])
+            self.p += 1
+            n.addChild(self.expr_atom())
+            return n
+        elif t == LPAREN:
+            self.p += 1
+            self.following.append(_FOLLOW_RPAREN)
+            n = self.expression()
+            self.following.pop()
+            self.match(RPAREN, _FOLLOW_END)
+            return n
+        else:
+            self.no_viable_alt()
+
+    def element(self):
+        types = self.types
+        p = self.p
+        t = types[p]
+        if t == DOLLAR:
+            t2 = types[p+1]
+            if t2 == LPAREN:
+                if types[p+2] != TEXT or types[p+3] != RPAREN:
+                    self.no_viable_alt()
+                next = types[p+4]
+            elif t2 == TEXT:
+                next = types[p+2]
+            else:
+                self.no_viable_alt()
+        elif t in _ELEMENT_START:
+            next = types[p+1]
+        else:
+            self.no_viable_alt()
+
+        if next in _ELEMENT_END:
+            return self.element_part()
+        elif next not in _ELEMENT_START:
+            self.no_viable_alt()
+
+        # A list or concatenation of several parts: the parts are
+        # concatenated if there's no whitespace between them, see
+        # bkl.parser.ast._TreeAdaptor.filter_list_or_concat()
+        tokens = self.tokens
+        fp = self.following
+        fp.append(_FOLLOW_FIRST_ELEMENT_PART)
+        start = tokens[p].start
+        parts = [(start, self.element_part(), tokens[self.p-1].stop)]
+        fp[-1] = _FOLLOW_ELEMENT_PART
+        while types[self.p] in _ELEMENT_START:
+            start = tokens[self.p].start
+            parts.append((start, self.element_part(), tokens[self.p-1].stop))
+        fp.pop()
+
+        items = []
+        prev_stop = None
+        for start, part, stop in parts:
+            if start == prev_stop:
+                items[-1].append(part)
+            else:
+                items.append([part])
+            prev_stop = stop
+        for i, adjacent in enumerate(items):
+            if len(adjacent) == 1:
+                items[i] = adjacent[0]
+            else:
+                concat = self.imaginary_node(CONCAT)
+                for c in adjacent:
+                    concat.addChild(c)
+                items[i] = concat
+        if len(items) == 1:
+            return items[0]
+        n = self.imaginary_node(LIST)
+        for c in items:
+            n.addChild(c)
+        return n
+
+    def element_part(self):
+        p = self.p
+        t = self.types[p]
+        if t in _LITERAL_START:
+            return self.literal()
+        elif t == TRUE or t == FALSE:
+            self.p += 1
+            return self.node(BOOLVAL, self.tokens[p])
+        elif t == ANCHOR_KEYWORD:
+            self.p += 1
+            return self.node(PATH_ANCHOR, self.tokens[p])
+        elif t == DOLLAR:
+            # var_reference
+            t2 = self.types[p+1]
+            if t2 == LPAREN:
+                self.p += 2
+                self.following.append(_FOLLOW_RPAREN)
+                ident = self.identifier()
+                self.following.pop()
+                self.match(RPAREN, _FOLLOW_END)
+            elif t2 == TEXT:
+                self.p += 1
+                ident = self.identifier()
+            else:
+                self.no_viable_alt()
+            n = self.imaginary_node(VAR_REFERENCE, "VAR_REFERENCE")
+            n.addChild(ident)
+            return n
+        else:
+            self.no_viable_alt()
+
+    def literal(self):
+        p = self.p
+        t = self.types[p]
+        token = self.tokens[p]
+        if t == TEXT:
+            self.p += 1
+            return self.node(LITERAL, token)
+        elif t == SINGLE_QUOTED_TEXT:
+            self.p += 1
+            return self.node(LITERAL, token, self.unescape(token, token.text[1:-1]))
+        elif t == DOUBLE_QUOTED_TEXT:
+            self.p += 1
+            return self.parse_quoted_str(token)
+        else:
+            self.no_viable_alt()
+
+    def parse_quoted_str(self, token):
+        text = token.text[1:-1]
+        if not text:
+            return self.node(LITERAL, token, "")
+        if "$" not in text:
+            # no variable references, the string is a single literal
+            literal = _Token(LITERAL, text, token.line, token.charPositionInLine + 1,
+                             token.start + 1, token.stop - 1)
+            return self.node(LITERAL, literal, self.unescape(literal, text))
+        tokens = _tokenize_quoted(text, self.filename,
+                                  token.line, token.charPositionInLine + 1)
+        parser = _QuotedStringParser(tokens, self.filename)
+        return parser.quoted_string()
+
+
+def parse(code, filename=None):
+    """
+    Parses Bakefile code from string argument passed in and returns its AST.
+    The optional filename argument allows specifying input file name for the
+    purpose of errors reporting.
+    """
+    if code and code[-1] != "\n":
+        code += "\n"
+    tokens = _tokenize(unicode(code), filename)
+    return _BakefileParser(tokens, filename).program()
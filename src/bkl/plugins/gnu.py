@@ -34,7 +34,8 @@ import bkl.expr
 
 # FIXME: shouldn't be needed later
 from bkl.expr import ListExpr, LiteralExpr, BoolExpr, NonConstError
-from bkl.error import Error
+from bkl.error import Error, CannotDetermineError
+from bkl.utils import OrderedSet
 
 # GCC flags for supported architectures:
 OSX_ARCH_FLAGS = {
@@ -58,20 +59,24 @@ def _is_multiarch_target(target):
 # of multiple -arch options. Clang can handle it, but we must support GCC. So we run
 # GCC's preprocessor once more to generate the dependencies, but let's not do
 # it unless necessary, because it a) costs some time and b) may omit some deps.
-GCC_DEPS_FLAGS = "-MD -MP"
+#
+# The name of the .d file is given explicitly, instead of letting the compiler
+# derive it from the output file name, so that it's the same when using a
+# compiler launcher such as ccache or distcc.
+GCC_DEPS_FLAGS = "-MD -MP -MF $(basename $@).d"
 OSX_GCC_DEPS_RULES = """
 # Support for generating .d files with multiple -arch options:
 CC_is_clang := $(if $(shell $(CC) --version | grep clang),yes,no)
 CXX_is_clang := $(if $(shell $(CXX) --version | grep clang),yes,no)
 ifeq "$(CC_is_clang)" "yes"
-  CC_deps_flags = -MD -MP
+  CC_deps_flags = -MD -MP -MF $(basename $@).d
   CC_deps_cmd   =
 else
   CC_deps_flags =
   CC_deps_cmd   = $1 -M -MP -o $(patsubst %.o,%.d,$@) $2
 endif
 ifeq "$(CXX_is_clang)" "yes"
-  CXX_deps_flags = -MD -MP
+  CXX_deps_flags = -MD -MP -MF $(basename $@).d
   CXX_deps_cmd   =
 else
   CXX_deps_flags =
@@ -102,7 +107,11 @@ class GnuObjectFileType(FileType):
 class GnuFileCompiler(FileCompiler):
     """Base class for GNU compilers/linkers."""
     def is_supported(self, toolset):
-        return isinstance(toolset, GnuToolset)
+        # Not only GnuToolset, but any toolset using GNU object files can use
+        # these compilers; their commands use make syntax and the toolset
+        # must provide the same attributes (deps_flags, pic_flags, ...) as
+        # GnuToolset does.
+        return toolset.object_type is GnuObjectFileType.get()
 
     # TODO: a hack, not exactly clean
     def _arch_flags(self, toolset, target):
@@ -128,18 +137,13 @@ class GnuCCompiler(GnuFileCompiler):
     _compiler = "CC"
     _flags_var_name = "CFLAGS"
     _options_prop_name = "c-compiler-options"
+    _header_language = "c-header"
 
-    def commands(self, toolset, target, input, output):
-        needs_extra_deps_code = (isinstance(toolset, OSXGnuToolset) and
-                                 _is_multiarch_target(target)) # see GCC_DEPS_FLAGS
-        cmd = [LiteralExpr("$(%s) -c -o $@ $(CPPFLAGS) $(%s)" %
-                (self._compiler, self._flags_var_name))]
-        if needs_extra_deps_code:
-            cmd += [LiteralExpr("$(%s_deps_flags)" % self._compiler)]
-        else:
-            cmd += [LiteralExpr(toolset.deps_flags)]
+    precompiled_header_extension = "gch"
+
+    def _compiler_flags(self, toolset, target):
         # FIXME: evaluating the flags here every time is inefficient
-        cmd += self._arch_flags(toolset, target)
+        cmd = self._arch_flags(toolset, target)
         if toolset.pic_flags and target["pic"]:
             cmd.append(LiteralExpr(toolset.pic_flags))
         if target["multithreading"]:
@@ -153,6 +157,23 @@ class GnuCCompiler(GnuFileCompiler):
         #else: don't do anything special for "minimal" and "default"
         cmd += target["compiler-options"]
         cmd += target[self._options_prop_name]
+        return cmd
+
+    def commands(self, toolset, target, input, output, precompiled_header=None):
+        needs_extra_deps_code = (isinstance(toolset, OSXGnuToolset) and
+                                 _is_multiarch_target(target)) # see GCC_DEPS_FLAGS
+        cmd = [LiteralExpr("$(COMPILER_LAUNCHER) $(%s) -c -o $@ $(CPPFLAGS) $(%s)" %
+                (self._compiler, self._flags_var_name))]
+        if needs_extra_deps_code:
+            cmd += [LiteralExpr("$(%s_deps_flags)" % self._compiler)]
+        else:
+            cmd += [LiteralExpr(toolset.deps_flags)]
+        cmd += self._compiler_flags(toolset, target)
+        if precompiled_header is not None:
+            # GCC looks for the .gch file when the header is included and
+            # -Winvalid-pch explains why it couldn't use it, if it can't
+            cmd += [LiteralExpr("-include"), precompiled_header,
+                    LiteralExpr("-Winvalid-pch")]
         # FIXME: use a parser instead of constructing the expression manually
         #        in here
         cmd.append(input)
@@ -172,6 +193,20 @@ class GnuCCompiler(GnuFileCompiler):
 
         return retval
 
+    def precompiled_header_commands(self, toolset, target, header, output):
+        if not toolset.gcc_precompiled_headers:
+            # the compiler doesn't support GCC-style precompiled headers
+            return None
+        if isinstance(toolset, OSXGnuToolset) and _is_multiarch_target(target):
+            # GCC can't precompile headers for several architectures at once
+            return None
+        cmd = [LiteralExpr("$(COMPILER_LAUNCHER) $(%s) -x %s -c -o $@ $(CPPFLAGS) $(%s)" %
+                (self._compiler, self._header_language, self._flags_var_name)),
+               LiteralExpr(toolset.deps_flags)]
+        cmd += self._compiler_flags(toolset, target)
+        cmd.append(header)
+        return [ListExpr(cmd)]
+
 
 class GnuCXXompiler(GnuCCompiler):
     """
@@ -184,6 +219,7 @@ class GnuCXXompiler(GnuCCompiler):
     _compiler = "CXX"
     _flags_var_name = "CXXFLAGS"
     _options_prop_name = "cxx-compiler-options"
+    _header_language = "c++-header"
 
 
 class GnuLinker(GnuFileCompiler):
@@ -282,7 +318,7 @@ class GnuMakefileFormatter(MakefileFormatter):
     def submake_command(self, directory, filename, target):
         return "$(MAKE) -C %s -f %s %s" % (directory, filename, target)
 
-    def multifile_target(self, outputs, outfiles, deps, commands):
+    def multifile_target(self, outputs, outfiles, deps, commands, order_only_deps=None):
         # Use a helper intermediate target to handle multiple outputs of a rule,
         # because we can't easily use GNU Make's pattern rules matching. The
         # absence of an intermediate file is not a problem and does not cause
@@ -296,7 +332,7 @@ class GnuMakefileFormatter(MakefileFormatter):
         return "\n".join([
             "%s: %s" % (" ".join(outfiles), inter_name),
             ".INTERMEDIATE: %s" % inter_name,
-            self.target(inter_name, deps, commands)
+            self.target(inter_name, deps, commands, order_only_deps)
             ])
 
 
@@ -309,13 +345,13 @@ class GnuExprFormatter(MakefileExprFormatter):
         if e.anchor == bkl.expr.ANCHOR_BUILDDIR:
             # Notice that _builddir is either empty or contains the
             # trailing slash, so we must not add another one here.
-            self.toolset.uses_builddir = True
+            self.context.uses_builddir = True
             return "$(_builddir)" + "/".join(self.format(c) for c in e.components)
 
         super_self = super(GnuExprFormatter, self)
 
         if e.anchor == bkl.expr.ANCHOR_TOP_BUILDDIR:
-            self.toolset.uses_builddir = True
+            self.context.uses_builddir = True
 
             # To handle top build directory-relative paths correctly, just
             # interpret the path relatively to the top source directory.
@@ -327,7 +363,7 @@ class GnuExprFormatter(MakefileExprFormatter):
         return super_self.path(e)
 
     def bool_value(self, e):
-        self.toolset.uses_non_std_bool_macros = True
+        self.context.uses_non_std_bool_macros = True
         return "$(_true)" if e.value else "$(_false)"
 
     def bool(self, e):
@@ -339,13 +375,13 @@ class GnuExprFormatter(MakefileExprFormatter):
         if e.operator == BoolExpr.OR:
             return "$(or %s,%s)" % (l, r)
         if e.operator == BoolExpr.EQUAL:
-            self.toolset.uses_non_std_bool_macros = True
+            self.context.uses_non_std_bool_macros = True
             return "$(call _equal,%s,%s)" % (l, r)
         if e.operator == BoolExpr.NOT_EQUAL:
-            self.toolset.uses_non_std_bool_macros = True
+            self.context.uses_non_std_bool_macros = True
             return "$(call _not,$(call _equal,%s,%s))" % (l, r)
         if e.operator == BoolExpr.NOT:
-            self.toolset.uses_non_std_bool_macros = True
+            self.context.uses_non_std_bool_macros = True
             return "$(call _not,%s)" % l
         assert False, "invalid operator"
 
@@ -401,6 +437,8 @@ class GnuToolset(MakefileToolset):
     pthread_ld_flags = "-pthread"
     soname_flags = "-Wl,-soname,$(notdir $@)"
     extra_link_flags = None
+    # whether the compiler supports GCC's -x c-header precompiled headers
+    gcc_precompiled_headers = True
 
     def output_default_flags(self, file, configs):
         """
@@ -471,8 +509,10 @@ endif
 """)
 
 
-    def on_header(self, file, module):
-        super(GnuToolset, self).on_header(file, module)
+    def on_header(self, ctx):
+        super(GnuToolset, self).on_header(ctx)
+        file = ctx.file
+        module = ctx.module
 
         file.write("""
 # You may define standard make variables such as CFLAGS or
@@ -482,7 +522,8 @@ endif
 #
 # to build with debug information. The full list of variables
 # that can be used by this makefile is:
-# AR, CC, CFLAGS, CPPFLAGS, CXX, CXXFLAGS, LD, LDFLAGS, MAKE, RANLIB.
+# AR, CC, CFLAGS, COMPILER_LAUNCHER, CPPFLAGS, CXX, CXXFLAGS, LD, LDFLAGS,
+# MAKE, RANLIB.
 """)
 
         self.output_default_flags(file, module.project.configurations)
@@ -505,11 +546,13 @@ RANLIB ?= ranlib
 
 CC := %s
 CXX := %s
+
+# Use e.g. "make COMPILER_LAUNCHER=ccache" to compile using ccache.
 """ % (self.default_cc, self.default_cxx))
+        file.write(("COMPILER_LAUNCHER ?= %s" % self._get_compiler_launcher(module)).rstrip() + "\n")
         # This placeholder will be replaced either with the definition of the
         # macros, if they turn out to be really needed, or nothing otherwise.
         file.write(GMAKE_IFEXPR_MACROS_PLACEHOLDER)
-        self.uses_non_std_bool_macros = False
 
         # Similarly, this one will be replaced with the definition of the
         # build directory variable if we are building any files in this
@@ -517,8 +560,15 @@ CXX := %s
         # makefiles which just dispatch the work to other makefiles, no need
         # to clutter them).
         file.write(GMAKE_BUILDDIR_DEF_PLACEHOLDER)
+        ctx.output_dirs = OrderedSet()
 
 
+    def _get_compiler_launcher(self, module):
+        name = "%s.compiler-launcher" % self.name
+        if module.is_variable_null(name):
+            return ""
+        return module[name].as_py()
+
     def _get_builddir_fragment(self, module):
         # Build the value actually representing the build directory, it is
         # only used here (see GnuExprFormatter.path) and only to initialize
@@ -554,28 +604,69 @@ builddir = .
 
 ifneq ($(builddir),.)
 _builddir := %s/
-_builddir_error := $(shell mkdir -p $(_builddir) 2>&1)
-$(if $(_builddir_error),$(error Failed to create build directory: $(_builddir_error)))
 endif
 """ % builddir_path
 
 
-    def on_phony_targets(self, file, targets):
-        file.write(".PHONY: %s\n" % " ".join(targets))
-
-    def on_footer(self, file, module):
+    def _get_order_only_deps(self, ctx, expr_fmt, node):
+        # Make every file built in the build directory depend on its
+        # directory, which is created by the rules written in on_footer()
+        # when needed, rather than creating all of them unconditionally
+        # whenever the makefile is parsed. Notice that the build directory
+        # itself is referred to as "$(_builddir)." because $(_builddir) is
+        # either empty or ends with a slash, neither of which is usable as
+        # a target name.
+        dirs = []
+        for f in node.outputs:
+            if f.anchor in [bkl.expr.ANCHOR_BUILDDIR, bkl.expr.ANCHOR_TOP_BUILDDIR]:
+                d = bkl.expr.PathExpr(f.components[:-1] + [LiteralExpr(".")],
+                                      f.anchor, f.anchor_file, pos=f.pos)
+                d = expr_fmt.format(d)
+                if d not in dirs:
+                    dirs.append(d)
+                ctx.output_dirs.add(d)
+        return dirs
+
+    def _get_dependency_files(self, ctx, expr_fmt, graphs):
+        # The compiler writes dependencies of every object file (or
+        # precompiled header) into a .d file next to it, see deps_flags.
+        # Include exactly these files rather than using wildcards, so that
+        # they are found wherever the build directory is.
+        compiled_extensions = (self.object_type.extensions +
+                               [GnuCCompiler.precompiled_header_extension])
+        for g in graphs:
+            for node in g.all_nodes():
+                for f in node.outputs:
+                    try:
+                        if f.get_extension() in compiled_extensions:
+                            yield expr_fmt.format(f.change_extension("d"))
+                    except CannotDetermineError:
+                        pass
+
+    def on_phony_targets(self, ctx, targets):
+        ctx.file.write(".PHONY: %s\n" % " ".join(targets))
+
+    def on_footer(self, ctx):
+        file = ctx.file
         file.replace(GMAKE_IFEXPR_MACROS_PLACEHOLDER,
-                     GMAKE_IFEXPR_MACROS if self.uses_non_std_bool_macros
+                     GMAKE_IFEXPR_MACROS if ctx.uses_non_std_bool_macros
                                          else "")
 
         file.replace(GMAKE_BUILDDIR_DEF_PLACEHOLDER,
-                     self._get_builddir_fragment(module) if self.uses_builddir
-                                                         else "")
+                     self._get_builddir_fragment(ctx.module) if ctx.uses_builddir
+                                                             else "")
+
+        if ctx.output_dirs:
+            file.write("\n"
+                       "# Output directories:\n")
+            for d in ctx.output_dirs:
+                file.write("%s:\n\tmkdir -p $@\n" % d)
 
 
-        file.write("\n"
-                   "# Dependencies tracking:\n"
-                   "-include *.d\n")
+        if ctx.depfiles:
+            file.write("\n"
+                       "# Dependencies tracking:\n"
+                       "-include %s\n" % " \\\n\t".join(ctx.depfiles))
 
 
 class OSXGnuToolset(GnuToolset):
@@ -600,12 +691,12 @@ class OSXGnuToolset(GnuToolset):
     soname_flags = None
     pthread_ld_flags = None
 
-    def on_footer(self, file, module):
-        for t in module.targets.itervalues():
+    def on_footer(self, ctx):
+        for t in ctx.targets:
             if _is_multiarch_target(t):
-                file.write(OSX_GCC_DEPS_RULES)
+                ctx.file.write(OSX_GCC_DEPS_RULES)
                 break
-        super(OSXGnuToolset, self).on_footer(file, module)
+        super(OSXGnuToolset, self).on_footer(ctx)
 
 
 class SunCCGnuToolset(GnuToolset):
@@ -634,3 +725,4 @@ class SunCCGnuToolset(GnuToolset):
     soname_flags = "-h $(notdir $@)"
     # FIXME: Do this for C++ only
     extra_link_flags = "-lCstd -lCrun"
+    gcc_precompiled_headers = False
@@ -30,9 +30,40 @@ from bkl.api import TargetType, Property
 from bkl.model import ConfigurationProxy
 from bkl.vartypes import *
 from bkl.compilers import *
-from bkl.expr import concat, PathExpr, LiteralExpr, NullExpr, ANCHOR_BUILDDIR
+from bkl.expr import concat, comparison_key, Visitor, PathExpr, LiteralExpr, NullExpr, ANCHOR_BUILDDIR
 from bkl.error import NonConstError, error_context
-from bkl.utils import memoized
+from bkl.utils import OrderedSet, memoized
+
+
+class _ConfigDependencyChecker(Visitor):
+    """
+    Checks whether the expression (or any variable it references) contains
+    placeholders such as $(config) that ConfigurationProxy may substitute.
+    """
+    def __init__(self):
+        super(_ConfigDependencyChecker, self).__init__()
+        self.found = False
+
+    literal = Visitor.noop
+    bool_value = Visitor.noop
+    null = Visitor.noop
+    concat = Visitor.visit_children
+    list = Visitor.visit_children
+    path = Visitor.visit_children
+    bool = Visitor.visit_children
+    if_ = Visitor.visit_children
+
+    def placeholder(self, e):
+        self.found = True
+
+    def reference(self, e):
+        self.visit(e.get_value())
+
+def _depends_on_config(e):
+    checker = _ConfigDependencyChecker()
+    checker.visit(e)
+    return checker.found
+
 
 class NativeCompiledType(TargetType):
     """Base class for natively-compiled targets."""
@@ -47,6 +78,58 @@ class NativeCompiledType(TargetType):
                  default=[],
                  inheritable=False,
                  doc="Header files."),
+            Property("precompiled-header",
+                 type=PathType(),
+                 default=NullExpr(),
+                 inheritable=False,
+                 doc="""
+                     Header file to precompile and use when compiling the
+                     target's sources.
+
+                     The header should be included by all the sources, before
+                     anything else. With GCC, it is precompiled in the build
+                     directory and implicitly included into every source
+                     written in the same language as the target (C++ if it
+                     has any C++ sources, C otherwise). The header is not
+                     precompiled by the gnu-suncc toolset.
+                     """),
+            Property("precompiled-header-source",
+                 type=PathType(),
+                 default=NullExpr(),
+                 inheritable=False,
+                 doc="""
+                     Source file used to create the precompiled header.
+
+                     This must be one of the target's sources and it typically
+                     doesn't contain anything but the inclusion of
+                     `precompiled-header`. It is required by Visual Studio,
+                     which doesn't use precompiled headers without it, and
+                     not needed for the other toolsets.
+                     """),
+            Property("unity-build",
+                 type=BoolType(),
+                 default=False,
+                 inheritable=True,
+                 doc="""
+                     Compile the target's C and C++ sources as a few bigger
+                     translation units including several of them.
+
+                     The including sources are generated in the source
+                     directory of the module as ``<target>_unityN.cpp`` (or
+                     ``.c``). Sources with any per-file settings, conditional
+                     ones and the one creating `precompiled-header` are still
+                     compiled separately.
+                     """),
+            Property("unity-build-batch-size",
+                 type=IntType(),
+                 default="0",
+                 inheritable=True,
+                 doc="""
+                     Maximal number of sources included in a single unity
+                     build source. The default value 0 means that all the
+                     sources written in the same language are included in
+                     one of them.
+                     """),
             Property("defines",
                  type=ListType(StringType()),
                  default=[],
@@ -291,29 +374,46 @@ class NativeLinkedType(NativeCompiledType):
         return self._get_link_property(target, "link-options")
 
     def _get_link_property(self, target, propname):
+        if isinstance(target, ConfigurationProxy):
+            # The values are typically the same in all configurations, in
+            # which case there's no need to merge them again for each of them:
+            shared = self._get_config_independent_link_property(target, propname)
+            if shared is not None:
+                return list(shared)
+        return self._merge_link_property(target, propname)
+
+    def _get_link_property_sources(self, target):
         deps = self.get_linkable_deps(target)
         # flags used to link shared libraries should be skipped:
-        deps = [x for x in deps if isinstance(x.type, LibraryType)]
-        out = []
-        out_bookkeeping = set()
-        for t in [target] + deps:
+        return [target] + [x for x in deps if isinstance(x.type, LibraryType)]
+
+    def _merge_link_property(self, target, propname):
+        out = OrderedSet(key=comparison_key)
+        for t in self._get_link_property_sources(target):
             values = t[propname]
             if isinstance(target, ConfigurationProxy):
                 values = target.apply_subst(values)
-            for x in values:
-                # TODO: use some ordered-set type and just merge them; this
-                #       type would deal with duplicates identification with
-                #       are_equal or as_symbolic as well
-                x_sym = x.as_symbolic()
-                try:
-                    if x_sym not in out_bookkeeping and x not in out:
-                        out.append(x)
-                        out_bookkeeping.add(x_sym)
-                except NonConstError:
-                    # can't meaningfully check for duplicates -> just insert
-                    out.append(x)
-                    out_bookkeeping.add(x_sym)
-        return out
+            out.update(values)
+        return list(out)
+
+    def _get_config_independent_link_property(self, cfg, propname):
+        # Link properties that are the same for all configurations of a
+        # target are cached, keyed by (target, property name), with None if
+        # they vary between them. The cache is stored in the project, so that
+        # it goes away together with the (toolset-specific) model.
+        cache = cfg.model.project._config_independent_link_props
+        key = (cfg.model, propname)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        value = None
+        if not _depends_on_config(cfg.model["deps"]):
+            sources = self._get_link_property_sources(cfg)
+            if not any(_depends_on_config(t[propname]) for t in sources):
+                value = self._merge_link_property(cfg, propname)
+        cache[key] = value
+        return value
 
 
     @memoized
@@ -0,0 +1,471 @@
+#
+#  This file is part of Bakefile (http://bakefile.org)
+#
+#  Copyright (C) 2008-2013 Vaclav Slavik
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+
+
+"""
+Ninja build files toolset.
+"""
+
+import os.path
+import posixpath
+import re
+
+from bkl.api import Toolset, Property
+from bkl.vartypes import PathType, StringType
+from bkl.makefile import ModulesDependencyGraph
+from bkl.model import ConfigurationProxy, ProxyIfResolver
+from bkl.plugins.gnu import GnuToolset, GnuCCompiler
+from bkl.compilers import get_unity_output_files
+from bkl.error import Error, NonConstError, CannotDetermineError, error_context
+import bkl.expr
+import bkl.io
+
+
+# Make syntax used by the commands of GNU compilers: "$$", "$@", "$<",
+# "$(notdir $@)" and "$(VAR)"; anything else after "$" is unsupported.
+_MAKE_SYNTAX_RE = re.compile(r"\$(\$|@|<|\(notdir \$@\)|\(([A-Za-z_][A-Za-z0-9_]*)\))?")
+
+_RULES = """
+rule cc
+  command = $cmd
+  description = CC $out
+  depfile = $out.d
+  deps = gcc
+
+rule link
+  command = $cmd
+  description = LINK $out
+  rspfile = $out.rsp
+  rspfile_content = $in
+
+rule generate
+  command = $cmd
+  description = GEN $out
+  restat = 1
+
+rule run
+  command = $cmd
+  description = RUN $out
+
+"""
+
+
+# "$$" and "${VAR}", which are produced by the formatter, or any other "$"
+_DOLLAR_RE = re.compile(r"\$(\$|\{[A-Za-z_][A-Za-z0-9_]*\})?")
+
+def _escape_dollars(s):
+    # File names (e.g. found by wildcards) may contain "$", which must be
+    # escaped as "$$" everywhere in the build file.
+    return _DOLLAR_RE.sub(lambda m: m.group(0) if m.group(1) else "$$", s)
+
+def _escape_path(s):
+    # paths on "build" lines are separated by spaces and colons, which must
+    # be escaped too -- after "$", so that the escapes aren't escaped again
+    return _escape_dollars(s).replace(" ", "$ ").replace(":", "$:")
+
+
+class NinjaExprFormatter(bkl.expr.Formatter):
+    """
+    Formats expressions into Ninja syntax. Commands created for makefiles
+    (by :class:`bkl.plugins.gnu.GnuFileCompiler` or action targets) are
+    translated, with references to the input and output files replaced by
+    their names, because ``$in`` and ``$out`` are not available in the
+    variables of build statements.
+
+    .. attribute:: node_inputs
+
+       Formatted inputs of the node whose commands are being formatted.
+
+    .. attribute:: node_outputs
+
+       Formatted outputs of the node whose commands are being formatted.
+
+    .. attribute:: rspfile_inputs
+
+       If set, a list with exactly these (formatted) items is replaced with
+       a reference to the response file.
+
+    .. attribute:: uses_rspfile
+
+       Set to True when the response file was used by the last command.
+    """
+    def __init__(self, paths_info, config):
+        super(NinjaExprFormatter, self).__init__(paths_info)
+        self.config = config
+        self.node_inputs = []
+        self.node_outputs = []
+        self.rspfile_inputs = None
+        self.uses_rspfile = False
+
+    def literal(self, e):
+        def _translate(m):
+            what = m.group(1)
+            if what is None:
+                raise Error("unsupported make syntax in \"%s\" (use \"$$\" for literal \"$\")" % e.value, pos=e.pos)
+            if what == "$":
+                return "$$"
+            if what == "<":
+                if not self.node_inputs:
+                    raise Error("input file reference (\"$<\") not allowed here", pos=e.pos)
+                return self.node_inputs[0]
+            if what == "@" or what == "(notdir $@)":
+                if len(self.node_outputs) != 1:
+                    raise Error("The use of $@ or %%(out) is only supported with exactly one output (in \"%s\")" % e.value, pos=e.pos)
+                out = self.node_outputs[0]
+                return out if what == "@" else posixpath.basename(out)
+            return "${%s}" % m.group(2)
+        # quote the quotes for the shell, as makefiles do
+        return _MAKE_SYNTAX_RE.sub(_translate, e.value.replace('"', '\\"'))
+
+    def list(self, e):
+        items = [self.format(x) for x in e.items]
+        if self.rspfile_inputs and items == self.rspfile_inputs:
+            self.uses_rspfile = True
+            return "@%s.rsp" % self.node_outputs[0]
+        return self.list_sep.join(items)
+
+    def path(self, e):
+        if e.anchor == bkl.expr.ANCHOR_TOP_BUILDDIR:
+            # The build directory is the directory of the build file.
+            return "/".join(self.format(c) for c in e.components) or "."
+        # Notice that nicely formatted paths use the file names as they are,
+        # without passing them through literal(), so they need escaping.
+        return _escape_dollars(super(NinjaExprFormatter, self).path(e))
+
+    def placeholder(self, e):
+        name = e.var
+        if name == "config":
+            return self.config.name
+        if name == "arch":
+            raise Error("multi-arch builds are not supported by ninja ($(arch) referenced)", pos=e.pos)
+        return "${%s}" % name
+
+    def bool_value(self, e):
+        raise Error("boolean expressions are not supported by ninja (\"%s\")" % e, pos=e.pos)
+
+    bool = bool_value
+
+    def if_(self, e):
+        try:
+            return super(NinjaExprFormatter, self).if_(e)
+        except NonConstError:
+            raise Error("conditional expressions depending on settings are not supported by ninja (\"%s\")" % e, pos=e.pos)
+
+
+class NinjaToolset(Toolset):
+    """
+    Ninja build system.
+
+    This toolset generates a single, non-recursive ``build.ninja`` file for
+    the whole project, which uses the GNU toolchain -- GCC compiler, GNU LD
+    linker etc. -- in the same way as :ref:`ref_toolset_gnu` does.
+
+    Object files and other intermediate files of targets defined in
+    submodules are put into the corresponding subdirectories of the build
+    directory, which is the directory of the build file.
+
+    Ninja doesn't allow changing variables from the command line, so the
+    build file is generated for a single configuration only, selected by the
+    ``ninja.config`` property of the top level module. Settings are
+    initialized to their default values and may be changed by editing the
+    generated file.
+    """
+    name = "ninja"
+
+    default_cc = GnuToolset.default_cc
+    default_cxx = GnuToolset.default_cxx
+
+    object_type = GnuToolset.object_type
+    uses_build_graphs = True
+
+    library_prefix = GnuToolset.library_prefix
+    library_extension = GnuToolset.library_extension
+    shared_library_prefix = GnuToolset.shared_library_prefix
+    shared_library_extension = GnuToolset.shared_library_extension
+    shared_library_link_flag = GnuToolset.shared_library_link_flag
+    loadable_module_prefix = GnuToolset.loadable_module_prefix
+    loadable_module_extension = GnuToolset.loadable_module_extension
+    loadable_module_link_flag = GnuToolset.loadable_module_link_flag
+
+    # ninja reads (and then removes) the dependencies file itself, so it
+    # must have a name known to it
+    deps_flags = "-MD -MF $@.d"
+    pic_flags = GnuToolset.pic_flags
+    pthread_cc_flags = GnuToolset.pthread_cc_flags
+    pthread_ld_flags = GnuToolset.pthread_ld_flags
+    soname_flags = GnuToolset.soname_flags
+    extra_link_flags = GnuToolset.extra_link_flags
+    gcc_precompiled_headers = GnuToolset.gcc_precompiled_headers
+
+    properties_module = [
+            Property("ninja.buildfile",
+                     type=PathType(),
+                     default="build.ninja",
+                     inheritable=False,
+                     doc="""
+                         Name of the output build file. Only used in the top
+                         level module, the build file includes all
+                         submodules.
+                         """),
+            Property("ninja.config",
+                     type=StringType(),
+                     default="Release",
+                     inheritable=False,
+                     doc="""
+                         Configuration to generate the build file for. Only
+                         used in the top level module.
+                         """),
+            Property("ninja.compiler-launcher",
+                     type=StringType(),
+                     default=bkl.expr.NullExpr(),
+                     inheritable=False,
+                     doc="""
+                         Command to run the compiler with, e.g. ``ccache``,
+                         prefixed to the commands compiling the sources but
+                         not to the link commands. Only used in the top
+                         level module.
+                         """),
+        ]
+
+    def get_builddir_for(self, target):
+        # Use the same layout as the makefiles: the build directory of each
+        # module corresponds to its source directory.
+        module = target.parent
+        top_srcdir = os.path.abspath(module.project.top_module.srcdir)
+        rel = os.path.relpath(os.path.abspath(module.srcdir), start=top_srcdir)
+        components = [] if rel == "." else rel.split(os.path.sep)
+        return bkl.expr.PathExpr([bkl.expr.LiteralExpr(c) for c in components],
+                                 bkl.expr.ANCHOR_TOP_BUILDDIR)
+
+    def generate(self, project):
+        top = project.top_module
+        if top in project.up_to_date_modules:
+            return
+
+        with error_context(top):
+            config_var = top["ninja.config"]
+            try:
+                config = project.configurations[config_var.as_py()]
+            except KeyError:
+                raise Error("configuration \"%s\" not defined" % config_var.as_py(), pos=config_var.pos)
+
+            output = top["ninja.buildfile"].as_native_path_for_output(top)
+            paths_info = bkl.expr.PathAnchorsInfo(
+                    dirsep="/",
+                    outfile=output,
+                    builddir=None,
+                    model=top)
+
+            f = bkl.io.OutputFile(output, bkl.io.EOL_UNIX, creator=self, create_for=top)
+            fmt = NinjaExprFormatter(paths_info, config)
+
+            self._gen_header(f, project, config, fmt)
+            build_graphs = self._get_build_graphs(project, config)
+            self._gen_builds(f, project, build_graphs, fmt)
+
+        f.commit()
+        for t in project.all_targets():
+            if t in build_graphs:
+                for uf in get_unity_output_files(self, t):
+                    uf.commit()
+
+    def _get_build_graphs(self, project, config):
+        from bkl.interpreter.passes import PathsNormalizer
+        norm = PathsNormalizer(project, self)
+        resolver = ProxyIfResolver(config.name)
+        build_graphs = {}
+        for t in project.all_targets():
+            with error_context(t):
+                if not ConfigurationProxy(t, config).should_build():
+                    continue
+                norm.set_context(t)
+                graph = t.type.get_build_subgraph(self, t)
+                for node in graph.all_nodes():
+                    node.inputs = [resolver.visit(norm.visit(e)) for e in node.inputs]
+                    node.outputs = [resolver.visit(norm.visit(e)) for e in node.outputs]
+                    node.commands = [resolver.visit(norm.visit(e)) for e in node.commands]
+                build_graphs[t] = graph
+        return build_graphs
+
+    def _gen_header(self, f, project, config, fmt):
+        f.write("""\
+# This file was automatically generated by bakefile.
+#
+# Any manual changes will be lost if it is regenerated,
+# modify the source .bkl file instead if possible.
+#
+# It was generated for the %s configuration, set ninja.config
+# in the bakefile to use another one.
+
+ninja_required_version = 1.3
+
+""" % config.name)
+
+        # Use the same default flags as the makefiles of GnuToolset.
+        debug, release = project.configurations["Debug"], project.configurations["Release"]
+        if config is debug or config.derived_from(debug):
+            cppflags, cflags, ldflags = "-DDEBUG", "-g -O0", "-g"
+        elif config is release or config.derived_from(release):
+            cppflags, cflags, ldflags = "-DNDEBUG", "-O2", ""
+        else:
+            cppflags, cflags, ldflags = "", "", ""
+        top = project.top_module
+        if top.is_variable_null("ninja.compiler-launcher"):
+            launcher = ""
+        else:
+            launcher = top["ninja.compiler-launcher"].as_py()
+        variables = [("CC", self.default_cc),
+                     ("CXX", self.default_cxx),
+                     ("COMPILER_LAUNCHER", launcher),
+                     ("AR", "ar"),
+                     ("RANLIB", "ranlib"),
+                     ("CPPFLAGS", cppflags),
+                     ("CFLAGS", cflags),
+                     ("CXXFLAGS", cflags),
+                     ("LDFLAGS", ldflags)]
+        for name, value in variables:
+            f.write(("%s = %s" % (name, value)).rstrip() + "\n")
+
+        if project.settings:
+            f.write("\n# Configurable settings:\n")
+            for setting in project.settings.itervalues():
+                if setting["help"]:
+                    f.write("\n".join("# %s" % s for s in fmt.format(setting["help"]).split("\n")))
+                    f.write("\n")
+                f.write("%s = %s\n" % (setting.name, fmt.format(setting["default"])))
+
+        f.write(_RULES)
+
+    def _gen_builds(self, f, project, build_graphs, fmt):
+        deps_graph = ModulesDependencyGraph(project)
+
+        def _main_outputs(t):
+            g = build_graphs[t].main
+            return [fmt.format(x) for x in g.outputs] if g.outputs else [fmt.format(g.name)]
+
+        all_outputs = []
+        aliases = []
+        for t in project.all_targets():
+            if t not in build_graphs:
+                continue
+            with error_context(t):
+                # Targets without outputs, i.e. actions, are always run, so
+                # depending on them directly would make the dependent targets
+                # always out of date too; only order them before it instead.
+                implicit = []
+                order_only = []
+                for tdep in deps_graph.target_deps[t]:
+                    if tdep in build_graphs:
+                        if build_graphs[tdep].main.outputs:
+                            implicit += _main_outputs(tdep)
+                        else:
+                            order_only += _main_outputs(tdep)
+
+                # Generated files, e.g. headers, must exist before compiling
+                # any of the target's sources, as they may be included from
+                # them. The real dependencies are known after the compilation.
+                graph = build_graphs[t]
+                generated = []
+                for node in graph.secondary:
+                    if not self._is_compilation(node):
+                        generated += [fmt.format(x) for x in node.outputs]
+
+                for node in graph.all_nodes():
+                    with error_context(node):
+                        if node is graph.main:
+                            text = self._format_build(node, True, implicit, order_only, fmt)
+                        elif self._is_compilation(node):
+                            text = self._format_build(node, False, [], generated, fmt)
+                        else:
+                            text = self._format_build(node, False, [], [], fmt)
+                        f.write(text)
+
+                outputs = _main_outputs(t)
+                all_outputs += outputs
+                if outputs != [t.name]:
+                    aliases.append((t.name, outputs))
+
+        if aliases:
+            f.write("# Targets names:\n")
+            for name, outputs in aliases:
+                f.write("build %s: phony %s\n" % (_escape_path(name), " ".join(_escape_path(x) for x in outputs)))
+            f.write("\n")
+
+        f.write("build all: phony %s\n" % " ".join(_escape_path(x) for x in all_outputs))
+        f.write("\ndefault all\n")
+
+    def _format_build(self, node, is_main, implicit, order_only, fmt):
+        outputs = [fmt.format(x) for x in node.outputs] if node.outputs else [fmt.format(node.name)]
+        inputs = [fmt.format(x) for x in node.inputs]
+
+        fmt.node_inputs = inputs
+        fmt.node_outputs = outputs
+        fmt.rspfile_inputs = inputs if is_main else None
+        fmt.uses_rspfile = False
+        commands = []
+        for c in node.commands:
+            c = fmt.format(c)
+            # actions' commands are prefixed with "@" to make them silent
+            # in makefiles, which is ninja's default behaviour:
+            if c.startswith("@"):
+                c = c[1:]
+            commands.append(c)
+
+        if not commands:
+            rule = "phony"
+        elif fmt.uses_rspfile:
+            rule = "link"
+        elif is_main:
+            rule = "run"
+        elif self._is_compilation(node):
+            rule = "cc"
+        else:
+            # Generated sources are often rewritten with the same content,
+            # restat avoids rebuilding everything depending on them then.
+            rule = "generate"
+
+        text = "build %s: %s" % (" ".join(_escape_path(x) for x in outputs), rule)
+        if inputs:
+            text += " " + " ".join(_escape_path(x) for x in inputs)
+        if implicit:
+            text += " | " + " ".join(_escape_path(x) for x in implicit)
+        order_only = [x for x in order_only if x not in inputs]
+        if order_only:
+            text += " || " + " ".join(_escape_path(x) for x in order_only)
+        if commands:
+            text += "\n  cmd = %s" % " && ".join(commands)
+        text += "\n\n"
+        return text
+
+    def _is_compilation(self, node):
+        # i.e. whether the node is compiled with the C/C++ compiler, which
+        # is the case for both object files and precompiled headers
+        if len(node.outputs) != 1:
+            return False
+        try:
+            ext = node.outputs[0].get_extension()
+        except CannotDetermineError:
+            return False
+        return (ext in self.object_type.extensions or
+                ext == GnuCCompiler.precompiled_header_extension)
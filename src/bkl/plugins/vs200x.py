@@ -115,21 +115,19 @@ class VS200xXmlFormatter(XmlFormatter):
                                "Filter",
                                "ToolFiles"])
 
-    def format_node(self, name, attrs, text, children_markup, indent):
+    def _format_node_attrs(self, s, attrs, indent):
+        for key, value in attrs:
+            s.append("\n%s\t%s=%s" % (indent, key, value))
+
+    def format_node(self, name, attrs, text, indent):
         """
-        Formats given Node instance, indented with *indent* text.
-        Content is either *text* or *children_markup*; the other is None.
+        Formats given Node instance without children, indented with *indent*
+        text. Content is either *text* or None.
         """
         s = ["%s<%s" % (indent, name)]
-        if attrs:
-            for key, value in attrs:
-                s.append("\n%s\t%s=%s" % (indent, key, value))
+        self._format_node_attrs(s, attrs, indent)
         if text:
             s.append(">%s</%s>\n" % (text, name))
-        elif children_markup:
-            if attrs:
-                s.append("\n%s\t" % indent)
-            s.append(">\n%s%s</%s>\n" % (children_markup, indent, name))
         else:
             if name in self.elems_not_collapsed:
                 if attrs:
@@ -139,6 +137,14 @@ class VS200xXmlFormatter(XmlFormatter):
                 s.append("\n%s/>\n" % indent)
         return "".join(s)
 
+    def format_node_start(self, name, attrs, indent):
+        s = ["%s<%s" % (indent, name)]
+        self._format_node_attrs(s, attrs, indent)
+        if attrs:
+            s.append("\n%s\t" % indent)
+        s.append(">\n")
+        return "".join(s)
+
 
 # TODO: Put more content into these classes, use them properly
 class VS200xProject(VSProjectBase):
@@ -188,6 +194,8 @@ class VS200xToolsetBase(VSToolsetBase):
     has_parallel_compilation = False
     #: Whether Detect64BitPortabilityProblems is supported
     detect_64bit_problems = True
+    #: Value of UsePrecompiledHeader for using the precompiled header
+    pch_use = pchUseUsingSpecificic_VC89
 
     def gen_for_target(self, target, project):
         root = Node("VisualStudioProject")
@@ -253,8 +261,8 @@ class VS200xToolsetBase(VSToolsetBase):
 
         f = OutputFile(filename, EOL_WINDOWS, charset=VCPROJ_CHARSET,
                        creator=self, create_for=target)
-        f.write(self.XmlFormatter(target.project.settings, paths_info).format(root))
-        f.commit()
+        self.XmlFormatter(target.project.settings, paths_info).write(f, root)
+        return [f]
 
 
     def _add_ToolFiles(self, root):
@@ -305,7 +313,12 @@ class VS200xToolsetBase(VSToolsetBase):
 
         if not cfg.is_debug:
             n["EnableFunctionLevelLinking"] = True
-        n["UsePrecompiledHeader"] = pchNone
+        pch_header = self.get_precompiled_header(target)
+        if pch_header:
+            n["UsePrecompiledHeader"] = self.pch_use
+            n["PrecompiledHeaderThrough"] = pch_header
+        else:
+            n["UsePrecompiledHeader"] = pchNone
         n["WarningLevel"] = self.get_vs_warning_level(cfg)
         if self.detect_64bit_problems:
             n["Detect64BitPortabilityProblems"] = True
@@ -447,10 +460,17 @@ class VS200xToolsetBase(VSToolsetBase):
                 idl_files.append(sfile)
             else:
                 cl_files.append(sfile)
+        # Sources included into the unity build sources are still shown in
+        # the project, but not compiled on their own:
+        unity_sources = bkl.compilers.get_unity_sources(target)
+        in_unity_source = set()
+        for unity in unity_sources:
+            in_unity_source.update(unity.sources)
+            cl_files.append(unity.source)
         cl_files_map = disambiguate_intermediate_file_names(cl_files)
         rc_files_map = disambiguate_intermediate_file_names(rc_files)
 
-        for sfile in target.sources:
+        for sfile in list(target.sources) + [u.source for u in unity_sources]:
             if sfile["compile-commands"]:
                 self._add_custom_build_file(sources, sfile)
             else:
@@ -491,11 +511,14 @@ class VS200xToolsetBase(VSToolsetBase):
                     if ext == 'idl':
                         self._add_per_file_options(sfile, n_file, "VCMIDLTool", None)
                     else:
-                        extras = None
+                        extras = []
                         if sfile in cl_files_map:
                             objfile = concat("$(IntDir)\\", cl_files_map[sfile], ".obj")
-                            extras = [("ObjectFile", objfile)]
-                        self._add_per_file_options(sfile, n_file, "VCCLCompilerTool", extras)
+                            extras.append(("ObjectFile", objfile))
+                        if self.is_precompiled_header_source(target, sfile):
+                            extras.append(("UsePrecompiledHeader", pchCreateUsingSpecific))
+                        self._add_per_file_options(sfile, n_file, "VCCLCompilerTool", extras,
+                                                   excluded=sfile in in_unity_source)
                     sources.add(n_file)
 
         for sfile in target.headers:
@@ -545,18 +568,21 @@ class VS200xToolsetBase(VSToolsetBase):
             node[key] = value
 
 
-    def _add_per_file_options(self, srcfile, node, tool, additional_options):
-        """Add options that are set on per-file basis."""
+    def _add_per_file_options(self, srcfile, node, tool, additional_options, excluded=False):
+        """
+        Add options that are set on per-file basis. If *excluded* is true,
+        the file is excluded from build in all configurations.
+        """
         # TODO: add regular options such as 'defines' here too, not just
         #       the vsXXXX.option.* overrides
         for cfg in self.configs_and_platforms(srcfile):
-            excluded = not cfg.should_build()
+            cfg_excluded = excluded or not cfg.should_build()
             extras = list(self.collect_extra_options_for_node(srcfile, tool, inherit=False))
             if additional_options:
                 extras = additional_options + extras
-            if extras or excluded:
+            if extras or cfg_excluded:
                 n_cfg = Node("FileConfiguration", Name="%s" % cfg.vs_name)
-                if excluded:
+                if cfg_excluded:
                     n_cfg["ExcludedFromBuild"] = True
                 n_tool = Node("Tool", Name=tool)
                 for key, value in extras:
@@ -651,21 +677,23 @@ class VS2003ExprFormatter(VS200xExprFormatter):
 class VS2003XmlFormatter(VS200xXmlFormatter):
     ExprFormatter = VS2003ExprFormatter
     # VS2003 formats > after attributes list differently:
-    def format_node(self, name, attrs, text, children_markup, indent):
-        s = "%s<%s" % (indent, name)
-        if attrs:
-            for key, value in attrs:
-                s += "\n%s\t%s=%s" % (indent, key, value)
+    def format_node(self, name, attrs, text, indent):
+        s = ["%s<%s" % (indent, name)]
+        self._format_node_attrs(s, attrs, indent)
         if text:
-            s += ">%s</%s>\n" % (text, name)
-        elif children_markup:
-            s += ">\n%s%s</%s>\n" % (children_markup, indent, name)
+            s.append(">%s</%s>\n" % (text, name))
         else:
             if name in self.elems_not_collapsed:
-                s += ">\n%s</%s>\n" % (indent, name)
+                s.append(">\n%s</%s>\n" % (indent, name))
             else:
-                s += "/>\n"
-        return s
+                s.append("/>\n")
+        return "".join(s)
+
+    def format_node_start(self, name, attrs, indent):
+        s = ["%s<%s" % (indent, name)]
+        self._format_node_attrs(s, attrs, indent)
+        s.append(">\n")
+        return "".join(s)
 
 
 class VS2003Toolset(VS200xToolsetBase):
@@ -687,6 +715,7 @@ class VS2003Toolset(VS200xToolsetBase):
     XmlFormatter = VS2003XmlFormatter
     has_parallel_compilation = False
     detect_64bit_problems = True
+    pch_use = pchUseUsingSpecificic_VC7
 
     tool_functions = [
         "VCCLCompilerTool",
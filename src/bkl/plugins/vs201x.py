@@ -75,6 +75,13 @@ class VS201xToolsetBase(VSToolsetBase):
                 idl_files.append(sfile)
             else:
                 cl_files.append(sfile)
+        # Sources included into the unity build sources are still shown in
+        # the project, but not compiled on their own:
+        unity_sources = bkl.compilers.get_unity_sources(target)
+        in_unity_source = set()
+        for unity in unity_sources:
+            in_unity_source.update(unity.sources)
+            cl_files.append(unity.source)
 
         root = Node("Project")
         root["DefaultTargets"] = "Build"
@@ -184,6 +191,11 @@ class VS201xToolsetBase(VSToolsetBase):
                 crt += "DLL"
             n_cl.add("RuntimeLibrary", crt)
 
+            pch_header = self.get_precompiled_header(target)
+            if pch_header:
+                n_cl.add("PrecompiledHeader", "Use")
+                n_cl.add("PrecompiledHeaderFile", pch_header)
+
             # Currently we don't make any distinction between preprocessor, C
             # and C++ flags as they're basically all the same at MSVS level
             # too and all go into the same place in the IDE and same
@@ -295,7 +307,12 @@ class VS201xToolsetBase(VSToolsetBase):
                 if sfile in cl_files_map:
                     n_cl_compile.add("ObjectFileName",
                                      concat("$(IntDir)\\", cl_files_map[sfile], ".obj"))
-                self._add_per_file_options(sfile, n_cl_compile)
+                if self.is_precompiled_header_source(target, sfile):
+                    for cfg in self.configs_and_platforms(target):
+                        cond = "'$(Configuration)|$(Platform)'=='%s'" % cfg.vs_name
+                        n_cl_compile.add(Node("PrecompiledHeader", "Create", Condition=cond))
+                self._add_per_file_options(sfile, n_cl_compile,
+                                           excluded=sfile in in_unity_source)
                 items.add(n_cl_compile)
 
         # Headers files:
@@ -352,10 +369,10 @@ class VS201xToolsetBase(VSToolsetBase):
         f = OutputFile(filename, EOL_WINDOWS,
                        creator=self, create_for=target)
         f.write(codecs.BOM_UTF8)
-        f.write(formatter.format(root))
-        f.commit()
-        self._write_filters_file_for(filename, formatter,
-                                     target.headers, cl_files, idl_files, rc_files)
+        formatter.write(f, root)
+        f_filters = self._write_filters_file_for(target, filename, formatter,
+                                                 target.headers, cl_files, idl_files, rc_files)
+        return [f, f_filters]
 
 
     def _add_custom_build_file(self, node, srcfile):
@@ -406,19 +423,22 @@ class VS201xToolsetBase(VSToolsetBase):
             node.add_or_replace(key, value)
 
 
-    def _add_per_file_options(self, srcfile, node):
-        """Add options that are set on per-file basis."""
+    def _add_per_file_options(self, srcfile, node, excluded=False):
+        """
+        Add options that are set on per-file basis. If *excluded* is true,
+        the file is excluded from build in all configurations.
+        """
         # TODO: add regular options such as 'defines' here too, not just
         #       the vsXXXX.option.* overrides
         for cfg in self.configs_and_platforms(srcfile):
             cond = "'$(Configuration)|$(Platform)'=='%s'" % cfg.vs_name
-            if not cfg.should_build():
+            if excluded or not cfg.should_build():
                 node.add(Node("ExcludedFromBuild", True, Condition=cond))
             for key, value in self.collect_extra_options_for_node(srcfile, node.name, inherit=False):
                 node.add(Node(key, value, Condition=cond))
 
 
-    def _write_filters_file_for(self, filename, formatter,
+    def _write_filters_file_for(self, target, filename, formatter,
                                 hdr_files, cl_files, idl_files, rc_files):
         root = Node("Project")
         root["ToolsVersion"] = "4.0" # even if tools_version is different (VS2013)
@@ -467,10 +487,10 @@ class VS201xToolsetBase(VSToolsetBase):
                 n.add("Filter", "Resource Files")
 
         f = OutputFile(filename + ".filters", EOL_WINDOWS,
-                       creator=self, create_for=filename)
+                       creator=self, create_for=target)
         f.write(codecs.BOM_UTF8)
-        f.write(formatter.format(root))
-        f.commit()
+        formatter.write(f, root)
+        return f
 
 
     def _order_configs_and_archs(self, configs_iter, archs_list):
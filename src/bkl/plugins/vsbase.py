@@ -31,17 +31,19 @@ import types
 from xml.sax.saxutils import escape, quoteattr
 from functools import partial, update_wrapper
 from collections import defaultdict
+from itertools import izip
 
 import logging
 logger = logging.getLogger("bkl.vsbase")
 
 import bkl.expr
-from bkl.utils import OrderedDict, OrderedSet, memoized
+from bkl.utils import OrderedDict, OrderedSet, LRUCache, memoized, map_in_workers
 from bkl.error import error_context, warning, Error, CannotDetermineError
 from bkl.api import Toolset, Property
 from bkl.model import ConfigurationProxy
 from bkl.vartypes import PathType, StringType, BoolType
 from bkl.io import OutputFile, EOL_WINDOWS
+from bkl.compilers import get_unity_output_files
 
 
 # Namespace constants for the GUID function
@@ -230,50 +232,83 @@ class XmlFormatter(object):
     #: Class for expressions formatting
     ExprFormatter = VSExprFormatter
 
+    #: Maximal number of formatted values to keep cached
+    value_cache_size = 1024
+
     def __init__(self, settings, paths_info, charset="utf-8"):
         self.charset = charset
         self.expr_formatter = self.ExprFormatter(settings, paths_info)
+        self._value_cache = LRUCache(self.value_cache_size)
 
     def format(self, node):
         """
         Formats given node as an XML document and returns the document as a
         string.
+
+        .. seealso:: :meth:`write()`
+        """
+        out = []
+        self._do_write(out.append, node)
+        return "".join(out)
+
+    def write(self, file, node):
+        """
+        Formats given node as an XML document and writes it to *file*
+        (typically :class:`bkl.io.OutputFile`) as it goes, without building
+        the entire document in memory first.
         """
-        return XML_HEADER % dict(charset=self.charset) + self._do_format_node(node, "")
+        self._do_write(file.write, node)
+
+    def _do_write(self, write, node):
+        write(XML_HEADER % dict(charset=self.charset))
+        self._do_write_node(write, node, "")
 
-    def _do_format_node(self, n, indent):
+    def _do_write_node(self, write, n, indent):
         attrs = self._get_quoted_nonempty_attrs(n)
         if n.children:
-            children_markup = []
             assert not n.text, "nodes with both text and children not implemented"
-            subindent = indent + self.indent_step
-            for key, value in n.children:
-                if isinstance(value, Node):
-                    assert key == value.name
-                    children_markup.append(self._do_format_node(value, subindent))
-                else:
-                    try:
-                        v = escape(self.format_value(value))
+            if self._has_children_markup(n):
+                write(self.format_node_start(n.name, attrs, indent))
+                subindent = indent + self.indent_step
+                for key, value in n.children:
+                    if isinstance(value, Node):
+                        assert key == value.name
+                        self._do_write_node(write, value, subindent)
+                    else:
+                        v = self._format_child_value(key, value)
                         if v:
-                            children_markup.append("%s<%s>%s</%s>\n" % (subindent, key, v, key))
+                            write("%s<%s>%s</%s>\n" % (subindent, key, v, key))
                         # else: empty value, don't write that
-                    except CannotDetermineError as e:
-                        with error_context(value):
-                            raise Error("cannot set property \"%s\" to non-constant expression \"%s\" (%s)" %
-                                        (key, value, e.msg))
-            children_markup = "".join(children_markup)
-        else:
-            children_markup = None
+                write(self.format_node_end(n.name, attrs, indent))
+                return
         text = self.format_value(n.text) if n.text else None
-        return self.format_node(n.name, attrs, text, children_markup, indent)
+        write(self.format_node(n.name, attrs, text, indent))
+
+    def _has_children_markup(self, n):
+        # Nodes whose children are all empty values are written in the same
+        # way as nodes without any children at all, so we need to know if
+        # this is the case before writing anything.
+        for key, value in n.children:
+            if isinstance(value, Node) or self._format_child_value(key, value):
+                return True
+        return False
+
+    def _format_child_value(self, key, value):
+        try:
+            return escape(self.format_value(value))
+        except CannotDetermineError as e:
+            with error_context(value):
+                raise Error("cannot set property \"%s\" to non-constant expression \"%s\" (%s)" %
+                            (key, value, e.msg))
 
-    def format_node(self, name, attrs, text, children_markup, indent):
+    def format_node(self, name, attrs, text, indent):
         """
-        Formats given Node instance, indented with *indent* text.
+        Formats given Node instance without any children, indented with
+        *indent* text.
 
-        Content is either *text* or *children_markup*; the other is None. All
-        arguments already use properly escaped markup; values in *attrs* are
-        quoted and escaped.
+        Content is either *text* or None for empty nodes. All arguments
+        already use properly escaped markup; values in *attrs* are quoted and
+        escaped.
         """
         s = ["%s<%s" % (indent, name)]
         if attrs:
@@ -281,27 +316,51 @@ class XmlFormatter(object):
                 s.append(' %s=%s' % (key, value))
         if text:
             s.append(">%s</%s>\n" % (text, name))
-        elif children_markup:
-            s.append(">\n%s%s</%s>\n" % (children_markup, indent, name))
         else:
             s.append(" />\n")
         return "".join(s)
 
-    def format_value(self, val):
-        # This trick is necessary, because 'val' may be of many types -- in
-        # particular, it may be an integer or a boolean. Python's bool type is
-        # a specialization of int and dictionaries don't differentiate between
-        # them and so @memoized format_value() would incorrectly return the
-        # same value (e.g. "1") for both True and 1. The dummy 'valtype'
-        # argument disambiguates these cases, with no noticeable lost of
-        # performance.
-        return self._format_value(val, type(val))
+    def format_node_start(self, name, attrs, indent):
+        """
+        Formats the opening tag of a Node instance with children, indented
+        with *indent* text. Arguments are the same as for :meth:`format_node()`.
+        """
+        s = ["%s<%s" % (indent, name)]
+        if attrs:
+            for key, value in attrs:
+                s.append(' %s=%s' % (key, value))
+        s.append(">\n")
+        return "".join(s)
 
-    @memoized
-    def _format_value(self, val, valtype):
+    def format_node_end(self, name, attrs, indent):
+        """
+        Formats the closing tag of a Node instance with children, indented
+        with *indent* text. Arguments are the same as for :meth:`format_node()`.
+        """
+        return "%s</%s>\n" % (indent, name)
+
+    def format_value(self, val):
         """
         Formats given value (of any type) into XML text.
         """
+        # This trick is necessary, because 'val' may be of many types -- in
+        # particular, it may be an integer or a boolean. Python's bool type is
+        # a specialization of int and dictionaries don't differentiate between
+        # them and so the cache would incorrectly return the same value (e.g.
+        # "1") for both True and 1. The 'valtype' part of the key disambiguates
+        # these cases, with no noticeable lost of performance.
+        key = (val, type(val))
+        try:
+            formatted = self._value_cache.get(key)
+        except TypeError:
+            # uncachable -- for instance, passing a list as an argument.
+            return self._format_value(val)
+        if formatted is None:
+            formatted = self._format_value(val)
+            self._value_cache[key] = formatted
+        return formatted
+
+    def _format_value(self, val):
         if isinstance(val, bkl.expr.Expr):
             return self.expr_formatter.format(val)
         elif isinstance(val, types.BooleanType):
@@ -686,22 +745,61 @@ class VSToolsetBase(Toolset):
 
 
     def generate(self, project):
-        # generate vcxproj files and prepare solutions
+        # prepare solutions and project objects for all targets first, so that
+        # they are available when generating projects that depend on them
+        to_generate = []
         for m in project.modules:
             with error_context(m):
-                self.gen_for_module(m)
+                to_generate += self.gen_for_module(m)
+
+        # projects of up to date modules don't need to be written again, but
+        # their objects are still needed by solutions and dependent projects
+        to_generate = [(t, prj) for t, prj in to_generate
+                       if t.parent not in project.up_to_date_modules]
+
+        # Generate vcxproj files. This is independent for every target, so it
+        # can be done in worker processes; only the files content is passed
+        # back and the files are created again and committed here, in the
+        # original order.
+        def _gen(item):
+            target, prj = item
+            with error_context(target.parent):
+                with error_context(target):
+                    files = self.gen_for_target(target, prj)
+            for f in files:
+                f.discard()
+            return [(f.filename, f.eol, f.text) for f in files]
+
+        for (target, prj), files in izip(to_generate, map_in_workers(_gen, to_generate)):
+            for filename, eol, text in files:
+                f = OutputFile(filename, eol, creator=self, create_for=target)
+                f.text = text
+                f.commit()
+            # unity sources are shared with other toolsets, so they must be
+            # recorded in this process
+            for f in get_unity_output_files(self, target):
+                f.commit()
+
         # Commit solutions; this must be done after processing all modules
         # because of inter-module dependencies and references.
         for m in project.modules:
             for sub in m.submodules:
                 m.solution.add_subsolution(sub.solution)
         for m in project.modules:
-            m.solution.write()
+            if m not in project.up_to_date_modules:
+                m.solution.write()
 
 
     def gen_for_module(self, module):
+        """
+        Prepares solution and project objects for the module's targets.
+
+        Returns list of (target, project) tuples for natively supported
+        targets, to be passed to :meth:`gen_for_target()`.
+        """
         # attach VS2010-specific data to the model
         module.solution = self.Solution(self, module)
+        natives = []
 
         for t in module.targets.itervalues():
             with error_context(t):
@@ -724,9 +822,10 @@ class VSToolsetBase(Toolset):
                                 prj.projectfile, prj.version, self.version)
 
                 if self.is_natively_supported(t):
-                    self.gen_for_target(t, prj)
+                    natives.append((t, prj))
 
                 module.solution.add_project(prj)
+        return natives
 
 
     def is_natively_supported(self, target):
@@ -780,6 +879,10 @@ class VSToolsetBase(Toolset):
     def gen_for_target(self, target, project):
         """
         Generates output for natively supported target types.
+
+        Returns list of :class:`bkl.io.OutputFile` objects with the output;
+        they are committed by the caller. May be called in a worker process,
+        so any changes it does to the model are lost.
         """
         raise NotImplementedError
 
@@ -800,6 +903,24 @@ class VSToolsetBase(Toolset):
             defs.append("%s_EXPORTS" % target.name.upper())
         return defs
 
+    def get_precompiled_header(self, target):
+        """
+        Returns the name of the precompiled header as included by *target*'s
+        sources or None if they don't use it. Visual Studio can only use
+        precompiled headers if the source creating them is set too.
+        """
+        if (target.is_variable_null("precompiled-header") or
+                target.is_variable_null("precompiled-header-source")):
+            return None
+        return target["precompiled-header"].components[-1]
+
+    def is_precompiled_header_source(self, target, srcfile):
+        """
+        Returns True if *srcfile* creates the precompiled header for *target*.
+        """
+        return (self.get_precompiled_header(target) is not None and
+                srcfile.filename == target["precompiled-header-source"])
+
     def collect_extra_options_for_node(self, target, prefix, inherit=True):
         """
         Collects extra options from target variables. Extra options are those not supported
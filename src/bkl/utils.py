@@ -26,9 +26,24 @@
 Misc. helpers for other Bakefile code.
 """
 
+import os
 import copy
 import functools
 import collections
+import cPickle as pickle
+
+import logging
+
+
+#: Number of worker processes to use for work that can be done concurrently
+#: (e.g. parsing independent input files or generating output files for
+#: different modules). The default value of 1 means that everything is done
+#: serially in the calling process.
+jobs = 1
+
+#: How long to wait for a result of :func:`map_in_workers` from a worker
+#: process, in seconds, before giving up and doing the rest serially.
+WORKER_TIMEOUT = 60
 
 
 class OrderedDict(dict):
@@ -38,6 +53,8 @@ class OrderedDict(dict):
     """
     # TODO-PY26: replace this class with collections.OrderedDict() from Python 2.7/3.1
 
+    __slots__ = ("order",)
+
     # These must be overriden in derived class:
     def __init__(self, data=None):
         dict.__init__(self)
@@ -97,21 +114,29 @@ class OrderedDict(dict):
 
     def __reduce__(self):
         "Return state information for pickling"
-        return self.__class__, (self.items(),), {"order": self.order}
+        return self.__class__, (self.items(),)
 
 
 class OrderedSet(collections.MutableSet):
     """
     Set class that preserves insertion order during iteration.
+
+    If *key* function is given, items are considered to be the same if they
+    have equal keys and only the first one added is kept. This is useful
+    for items that are not hashable themselves, such as expressions.
     """
-    def __init__(self, data=None):
+    def __init__(self, data=None, key=None):
         self._list = list()
         self._set = set()
+        self._key = key
         if data:
             self.update(data)
 
+    def _keyof(self, x):
+        return self._key(x) if self._key else x
+
     def __contains__(self, x):
-        return x in self._set
+        return self._keyof(x) in self._set
 
     def __len__(self):
         return len(self._list)
@@ -120,19 +145,88 @@ class OrderedSet(collections.MutableSet):
         return iter(self._list)
 
     def add(self, x):
-        if x not in self._set:
-            self._set.add(x)
+        k = self._keyof(x)
+        if k not in self._set:
+            self._set.add(k)
             self._list.append(x)
 
     def discard(self, x):
-        self._set.remove(x)
-        self._list.remove(x)
+        k = self._keyof(x)
+        self._set.remove(k)
+        self._list = [i for i in self._list if self._keyof(i) != k]
 
     def update(self, other):
         for i in other:
             self.add(i)
 
 
+class LRUCache(object):
+    """
+    Dictionary-like cache holding at most *maxsize* items. When full, the
+    least recently used item is discarded to make room for the new one.
+
+    Only the operations needed by :class:`memoized`-like code are supported:
+    lookup with :meth:`get` and insertion with ``cache[key] = value``.
+    """
+    # Items are kept in a circular doubly linked list of [prev, next, key,
+    # value] lists, ordered from the least to the most recently used one.
+    def __init__(self, maxsize):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, key, default=None):
+        """
+        Returns value for *key* and marks it as the most recently used one,
+        or *default* if it is not in the cache.
+        """
+        try:
+            link = self._map[key]
+        except KeyError:
+            return default
+        # move the item to the end of the list:
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return link[3]
+
+    def __setitem__(self, key, value):
+        if key in self._map:
+            self.get(key)
+            self._map[key][3] = value
+            return
+        root = self._root
+        if len(self._map) >= self.maxsize:
+            # reuse the least recently used node for the new item:
+            link = root[1]
+            del self._map[link[2]]
+            root[1] = link[1]
+            link[1][0] = root
+            link[2] = key
+            link[3] = value
+        else:
+            link = [None, None, key, value]
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = self._map[key] = link
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
+
+
 def filter_duplicates(it):
     """
     Yields items from 'it', removing any duplicates.
@@ -144,6 +238,101 @@ def filter_duplicates(it):
             yield x
 
 
+class _RecordsCollector(logging.Handler):
+    """
+    Logging handler collecting the records logged in a worker process, so
+    that they can be passed to the calling process.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # make the record picklable, its arguments may be arbitrary objects
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+# (func, items) tuple of the map_in_workers() call in progress; the worker
+# processes inherit it when they are forked
+_worker_task = None
+
+def _run_in_worker(index):
+    func, items = _worker_task
+    collector = _RecordsCollector()
+    root = logging.getLogger()
+    handlers = root.handlers
+    root.handlers = [collector]
+    try:
+        # The result is pickled explicitly so that nothing can fail once the
+        # function returns. Any errors are ignored here, the item is then
+        # processed again in the calling process and they are reported there.
+        return pickle.dumps((func(items[index]), collector.records),
+                            pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    finally:
+        root.handlers = handlers
+
+
+def map_in_workers(func, items):
+    """
+    Applies *func* to every item of *items*, possibly concurrently, using up
+    to :data:`jobs` worker processes, and yields the results in the same
+    order as *items*.
+
+    The workers are forked from the calling process, so *func* may be any
+    callable, e.g. a closure, and it sees all the current state. But only its
+    return value, which must be picklable, is passed back to the caller; any
+    other changes done by *func* are lost. Messages logged by *func* are
+    logged again in the calling process, in the order of *items*. If *func*
+    fails in a worker, it's called again for that item in the calling
+    process, so that errors are reported in the same way and in the same
+    order as if everything was done serially.
+
+    Everything is done serially in the calling process if :data:`jobs` is 1
+    or if forking is not supported by the platform.
+    """
+    global _worker_task
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1 or not hasattr(os, "fork"):
+        for x in items:
+            yield func(x)
+        return
+
+    import multiprocessing
+    assert _worker_task is None, "map_in_workers() calls can't be nested"
+    _worker_task = (func, items)
+    pool = multiprocessing.Pool(min(jobs, len(items)))
+    try:
+        pending = [pool.apply_async(_run_in_worker, (i,))
+                   for i in xrange(len(items))]
+        for i, x in enumerate(items):
+            data = None
+            if pending:
+                try:
+                    data = pending[i].get(WORKER_TIMEOUT)
+                except multiprocessing.TimeoutError:
+                    logging.getLogger("bkl.utils").debug(
+                        "worker process timed out, doing the rest serially")
+                    pending = None
+            if data is None:
+                yield func(x)
+                continue
+            result, records = pickle.loads(data)
+            for r in records:
+                logging.getLogger(r.name).handle(r)
+            yield result
+    finally:
+        _worker_task = None
+        pool.terminate()
+        pool.join()
+
+
 class memoized(object):
     """
     Decorator that caches a function's return value each time it is called.  If
@@ -184,11 +373,24 @@ class memoized_property(object):
     Use as the `@property` decorator. The method will only be called once,
     though. Subsequent uses of the property will use the previously returned
     value.
+
+    Classes using `__slots__` must have a slot called "_memoized_" followed by
+    the name of the property to store the value in.
     """
     def __init__(self, func):
         self.func = func
+        self.slot = "_memoized_" + func.__name__
 
     def __get__(self, obj, ownerClass=None):
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            pass
         x = self.func(obj)
-        setattr(obj, self.func.__name__, x)
+        try:
+            # this hides the property for the objects with __dict__, so that
+            # it isn't called at all the next time
+            setattr(obj, self.func.__name__, x)
+        except AttributeError:
+            setattr(obj, self.slot, x)
         return x
@@ -130,6 +130,10 @@ class AnyType(Type):
     def validate(self, e):
         pass # anything is valid
 
+    def __reduce__(self):
+        # preserve the singleton when pickling
+        return "TheAnyType"
+
 #: For efficiency, singleton instance of AnyType
 TheAnyType = AnyType()
 
@@ -173,6 +177,17 @@ class StringType(Type):
             raise TypeError(self, e)
 
 
+class IntType(Type):
+    """
+    Non-negative integer number.
+    """
+    name = "integer"
+
+    def _validate_impl(self, e):
+        if not isinstance(e, expr.LiteralExpr) or not e.value.isdigit():
+            raise TypeError(self, e)
+
+
 class IdType(Type):
     """
     Type for target IDs.
@@ -24,6 +24,7 @@
 #
 
 import sys
+import os.path
 import logging
 from optparse import OptionParser, OptionGroup
 from time import time
@@ -93,10 +94,37 @@ parser.add_option(
         "", "--diff-only",
         action="store_true", dest="diff_only", default=False,
         help="only output diffs instead of modiyfing the files, implies --dry-run")
+parser.add_option(
+        "", "--check",
+        action="store_true", dest="check", default=False,
+        help="only check if the output files are up to date and fail at the first one that isn't, implies --dry-run")
+parser.add_option(
+        "", "--check-all",
+        action="store_true", dest="check_all", default=False,
+        help="like --check, but list all output files that are not up to date")
 parser.add_option(
         "", "--force",
         action="store_true", dest="force", default=False,
         help="touch output files even if they're unchanged")
+parser.add_option(
+        "-j", "--jobs",
+        action="store", type="int", dest="jobs", default=1,
+        metavar="N",
+        help="use up to N parallel processes for parsing the input and generating the output")
+parser.add_option(
+        "", "--fast-parser",
+        action="store_true", dest="fast_parser", default=False,
+        help="use faster hand-written parser instead of the ANTLR-generated one")
+parser.add_option(
+        "", "--cache-dir",
+        action="store", dest="cache_dir", default=None,
+        metavar="DIR",
+        help="cache data used to speed up subsequent runs (e.g. the processed model) in DIR")
+parser.add_option(
+        "", "--export-model",
+        action="store", dest="export_model", default=None,
+        metavar="FILE",
+        help="write toolset-specific models to FILE (\"-\" for stdout) in JSON lines format instead of generating output")
 parser.add_option(
         "-t", "--toolset",
         action="append", dest="toolsets",
@@ -137,29 +165,63 @@ if options.diff_only and options.force:
     sys.stderr.write("--diff-only and --force option can't be used together\n")
     sys.exit(3)
 
+options.check = options.check or options.check_all
+if options.check and (options.diff_only or options.force):
+    sys.stderr.write("--check can't be used together with --diff-only or --force\n")
+    sys.exit(3)
+
 # note: we intentionally import bakefile this late so that the logging
 # module is already initialized
 import bkl.error
 from bkl.interpreter import Interpreter
 import bkl.dumper
 import bkl.io
+import bkl.parser
+import bkl.utils
+import bkl.interpreter.globbing
 
 try:
     start_time = time()
     bkl.io.dry_run = options.dry_run
     bkl.io.diff_only = options.diff_only
     bkl.io.force_output = options.force
+    bkl.io.check_only = options.check
+    bkl.io.check_all = options.check_all
+    bkl.utils.jobs = options.jobs
+    bkl.parser.use_fast_parser = options.fast_parser
     if options.dump:
         intr = bkl.dumper.DumpingInterpreter()
     elif options.dump_toolset:
         intr = bkl.dumper.DumpingInterpreter(options.dump_toolset)
+    elif options.export_model:
+        if options.export_model == "-":
+            export_file = sys.stdout
+        else:
+            export_file = open(options.export_model, "w")
+        intr = bkl.dumper.ExportingInterpreter(export_file)
     else:
         intr = Interpreter()
     if options.toolsets:
         intr.limit_toolsets(options.toolsets)
+    intr.cache_dir = options.cache_dir
+    if options.cache_dir:
+        dircache_file = os.path.join(options.cache_dir, "dirscan.cache")
+        bkl.interpreter.globbing.cache.load(dircache_file)
     intr.process_file(args[0])
-    logger.info("created files: %d, updated files: %d (time: %.1fs)",
-                bkl.io.num_created, bkl.io.num_modified, time() - start_time)
+    if options.export_model and options.export_model != "-":
+        export_file.close()
+    if options.cache_dir and not (options.dry_run or options.check):
+        bkl.interpreter.globbing.cache.save(dircache_file)
+    if options.check:
+        for f in bkl.io.outdated_files:
+            print os.path.relpath(f)
+        logger.info("files not up to date: %d (time: %.1fs)",
+                    len(bkl.io.outdated_files), time() - start_time)
+        if bkl.io.outdated_files:
+            sys.exit(1)
+    else:
+        logger.info("created files: %d, updated files: %d (time: %.1fs)",
+                    bkl.io.num_created, bkl.io.num_modified, time() - start_time)
 
 except KeyboardInterrupt:
     if options.debug:
@@ -0,0 +1,10 @@
+#include <stdio.h>
+#include "version.h"
+
+extern "C" const char *util_name(void);
+
+int main()
+{
+    printf("%s from %s %s\n", GREETING, util_name(), VERSION);
+    return 0;
+}
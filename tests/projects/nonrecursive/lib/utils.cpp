@@ -0,0 +1,4 @@
+int utils()
+{
+    return 0;
+}
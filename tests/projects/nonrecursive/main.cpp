@@ -0,0 +1,6 @@
+int utils();
+
+int main()
+{
+    return utils();
+}
@@ -0,0 +1,9 @@
+#include "pch.h"
+
+std::string world();
+
+int main()
+{
+    std::cout << "hello, " << world() << std::endl;
+    return 0;
+}
@@ -0,0 +1 @@
+#include "pch.h"
@@ -0,0 +1,10 @@
+#include "pch.h"
+
+std::string world();
+
+int main()
+{
+    std::vector<std::string> v(1, world());
+    std::cout << v[0] << std::endl;
+    return 0;
+}
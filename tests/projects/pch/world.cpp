@@ -0,0 +1,6 @@
+#include "pch.h"
+
+std::string world()
+{
+    return "world";
+}
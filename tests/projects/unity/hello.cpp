@@ -0,0 +1,4 @@
+const char *hello()
+{
+    return "hello";
+}
@@ -0,0 +1,14 @@
+#include <iostream>
+
+const char *hello();
+const char *world();
+char punctuation();
+extern "C" const char *greeting();
+const char *special();
+
+int main()
+{
+    std::cout << greeting() << ": " << hello() << ", " << world()
+              << punctuation() << " " << special() << std::endl;
+    return 0;
+}
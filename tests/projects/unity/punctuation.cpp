@@ -0,0 +1,4 @@
+char punctuation()
+{
+    return '!';
+}
@@ -0,0 +1,4 @@
+const char *special()
+{
+    return "(special)";
+}
@@ -0,0 +1,4 @@
+const char *world()
+{
+    return "world";
+}
@@ -23,6 +23,7 @@
 #
 
 import os, os.path
+import logging
 import pytest
 from glob import glob
 
@@ -38,10 +39,25 @@ def test_parser():
     import test_parsing
     d = os.path.dirname(test_parsing.__file__)
     for f in glob("%s/*/*.ast" % d):
-        yield _test_parser_on_file, d, str(f)
+        for fast in (False, True):
+            yield _test_parser_on_file, d, str(f), fast
 
 
-def _test_parser_on_file(testdir, ast_file):
+def _parse_file(filename, fast):
+    """
+    Parses given file with either the ANTLR-generated parser or the fast
+    hand-written one. Doesn't use (memoized) bkl.parser.parse_file().
+    """
+    old = bkl.parser.use_fast_parser
+    bkl.parser.use_fast_parser = fast
+    try:
+        with file(filename, "rt") as f:
+            return bkl.parser.parse(f.read(), filename)
+    finally:
+        bkl.parser.use_fast_parser = old
+
+
+def _test_parser_on_file(testdir, ast_file, fast):
     assert ast_file.startswith(testdir)
 
     input = os.path.splitext(ast_file)[0] + '.bkl'
@@ -50,16 +66,16 @@ def _test_parser_on_file(testdir, ast_file):
     cwd = os.getcwd()
     os.chdir(testdir)
     try:
-        _do_test_parser_on_file(f, ast_file)
+        _do_test_parser_on_file(f, ast_file, fast)
     finally:
         os.chdir(cwd)
 
 
-def _do_test_parser_on_file(input, ast_file):
-    print 'parsing %s' % input
+def _do_test_parser_on_file(input, ast_file, fast):
+    print 'parsing %s (fast parser: %s)' % (input, fast)
 
     try:
-        t = bkl.parser.parse_file(input)
+        t = _parse_file(input, fast)
         as_text = t.toStringTree()
     except bkl.error.Error, e:
         as_text = "ERROR:\n%s" % str(e).replace("\\", "/")
@@ -81,20 +97,144 @@ expected tree:
     assert as_text == expected
 
 
-def test_parsing_bakefile_0_2_xml():
+@pytest.mark.parametrize("fast", [False, True])
+def test_parsing_bakefile_0_2_xml(fast):
     import test_parsing
     d = os.path.dirname(test_parsing.__file__)
     with pytest.raises(bkl.error.ParserError):
-        bkl.parser.parse_file(os.path.join(d, "bakefile_0_2.bkl"))
+        _parse_file(os.path.join(d, "bakefile_0_2.bkl"), fast)
 
-def test_parsing_old_version():
+@pytest.mark.parametrize("fast", [False, True])
+def test_parsing_old_version(fast):
     import test_parsing
     d = os.path.dirname(test_parsing.__file__)
     with pytest.raises(bkl.error.VersionError):
-        bkl.parser.parse_file(os.path.join(d, "version_old.bkl"))
+        _parse_file(os.path.join(d, "version_old.bkl"), fast)
 
-def test_parsing_very_old_version():
+@pytest.mark.parametrize("fast", [False, True])
+def test_parsing_very_old_version(fast):
     import test_parsing
     d = os.path.dirname(test_parsing.__file__)
     with pytest.raises(bkl.error.VersionError):
-        bkl.parser.parse_file(os.path.join(d, "version_very_old.bkl"))
+        _parse_file(os.path.join(d, "version_very_old.bkl"), fast)
+
+
+# Snippets of (mostly invalid) code on which the fast parser is compared with
+# the ANTLR-generated one.
+PARSER_ERRORS_INPUTS = [
+    'x = foo',
+    'x = foo\ny = bar;',
+    'x = foo bar\n',
+    'x foo;',
+    'program foo {',
+    'program foo { program bar {} }',
+    'sources { a.c }',
+    '}',
+    'if x y = 1;',
+    'if = 1;',
+    'if (x == ) y = 1;',
+    'if (a || b && !c) y = 1;',
+    'program foo { if (a) { sources { a.c } } }',
+    'program foo { headers { } }',
+    'program foo { configuration x; }',
+    'x:: = 1;',
+    '::x::y = 1;',
+    'x = $(foo;',
+    'x = a $(b c;',
+    'x = $foo bar$(baz)"zap"\'x\';',
+    'template t : a, { }',
+    'import "foo.bkl" x;',
+    'configuration Foo : { x = 1; }',
+    'setting FOO',
+    'srcdir foo; x = 1; srcdir bar;',
+    'requires foo;',
+    'x = "a$(b";',
+    'x = "a$b";',
+    'x = "x$(a$(b))";',
+    'x = "$()";',
+    'x = "$(a b)";',
+    'x = "a\n$b";',
+    'x = "unterminated',
+    '/* unterminated',
+    '//x\ry',
+    'a & b',
+    'x = @A',
+    'x = a/*b;',
+    'x = \t#',
+]
+
+def test_fast_parser():
+    """
+    Checks that the fast parser produces the same ASTs, including source
+    positions, and the same errors as the ANTLR-generated parser. Does this
+    for all .bkl files under tests directory and for the inputs above.
+    """
+    testsdir = os.path.dirname(__file__)
+    for dirpath, dirnames, filenames in os.walk(testsdir):
+        for f in sorted(filenames):
+            if f.endswith(".bkl"):
+                with file(os.path.join(dirpath, f), "rt") as f:
+                    code = f.read()
+                yield _test_fast_parser_on_code, code
+    for code in PARSER_ERRORS_INPUTS:
+        yield _test_fast_parser_on_code, code
+
+
+def _dump_tree_with_positions(node, indent=""):
+    out = "%s%s @%s\n" % (indent, node, node.pos)
+    for c in node.children:
+        out += _dump_tree_with_positions(c, indent + "    ")
+    return out
+
+
+def _parse_to_text(code, fast):
+    old = bkl.parser.use_fast_parser
+    bkl.parser.use_fast_parser = fast
+    try:
+        return _dump_tree_with_positions(bkl.parser.parse(code, "test.bkl"))
+    except bkl.error.Error as e:
+        return "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        bkl.parser.use_fast_parser = old
+
+
+def _test_fast_parser_on_code(code):
+    assert _parse_to_text(code, fast=True) == _parse_to_text(code, fast=False)
+
+
+class _WarningsCollector(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.warnings = []
+    def emit(self, record):
+        self.warnings.append("%s: %s" % (record.pos, record.getMessage()))
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_quoted_string_escapes(fast):
+    """
+    Checks unescaping of quoted strings and positions of warnings about
+    unnecessary escapes, both in plain strings and with variable references.
+    """
+    code = r'''
+x = "a\"b\qc" 'd\qe' "$(y)\q";
+'''
+    collector = _WarningsCollector()
+    logger = logging.getLogger("bkl.error")
+    logger.addHandler(collector)
+    old = bkl.parser.use_fast_parser
+    bkl.parser.use_fast_parser = fast
+    try:
+        t = bkl.parser.parse(code, "test.bkl")
+    finally:
+        bkl.parser.use_fast_parser = old
+        logger.removeHandler(collector)
+
+    values = t.children[0].children[1].children
+    assert [str(v) for v in values[:2]] == ['LiteralNode "a"bqc"',
+                                            'LiteralNode "dqe"']
+    assert str(values[0].pos) == "test.bkl:2:5"
+    assert collector.warnings == [
+        "test.bkl:2:10: unnecessary escape sequence '\\q' (did you mean '\\\\q'?)",
+        "test.bkl:2:16: unnecessary escape sequence '\\q' (did you mean '\\\\q'?)",
+        "test.bkl:2:27: unnecessary escape sequence '\\q' (did you mean '\\\\q'?)",
+        ]
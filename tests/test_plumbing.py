@@ -27,10 +27,18 @@ Misc tests of Bakefile's internals' correctness.
 """
 
 import os.path
+import logging
+import pytest
 
 import bkl.interpreter
+import bkl.interpreter.globbing
 import bkl.dumper
+import bkl.expr
+import bkl.model
 import bkl.io
+import bkl.error
+import bkl.parser
+import bkl.utils
 
 from bkl.expr import BoolValueExpr, ListExpr, LiteralExpr, ConcatExpr, NullExpr
 
@@ -51,6 +59,476 @@ def test_model_cloning():
     assert model_txt == model_copy_txt
 
 
+def test_model_cloning_without_disabled_parts(tmpdir):
+    from bkl.interpreter.passes import find_disabled_model_parts
+    tmpdir.join("disabled_parts.bkl").write("""
+        toolsets = gnu vs2010;
+        if ($(toolset) == vs2010) {
+            library win { sources { win.cpp } }
+        }
+        program prog {
+            sources { main.cpp }
+            if ($(toolset) == gnu) {
+                sources { unix.cpp }
+            }
+        }
+        """)
+    oldcwd = tmpdir.chdir()
+    try:
+        i = InterpreterForTestSuite()
+        i.process_file("disabled_parts.bkl")
+        for toolset, expected in [("gnu", ['target "win"']),
+                                  ("vs2010", ["file @top_srcdir/unix.cpp"])]:
+            disabled = find_disabled_model_parts(i.model, toolset)
+            assert sorted(str(x) for x in disabled) == expected
+            pruned = i.make_toolset_specific_model(toolset)
+            i.finalize_for_toolset(pruned, toolset)
+            full = i.model.clone()
+            full.add_variable(bkl.model.Variable.from_property(
+                                    full.get_prop("toolset"),
+                                    bkl.expr.LiteralExpr(toolset)))
+            i.finalize_for_toolset(full, toolset)
+            assert bkl.dumper.dump_project(pruned) == bkl.dumper.dump_project(full)
+    finally:
+        oldcwd.chdir()
+
+
+def test_import_shared_fragments(tmpdir):
+    tmpdir.join("common.bkl").write("""
+        setting SHARED_SETTING { default = foo; }
+        configuration Profile : Release {}
+        template common_defines { defines = COMMON; }
+        """)
+    tmpdir.join("local.bkl").write("""
+        import common.bkl;
+        local_var = bar;
+        """)
+    for sub in ("one", "two"):
+        tmpdir.join("%s.bkl" % sub).write("""
+            import local.bkl;
+            import common.bkl;
+            program %s : common_defines {}
+            """ % sub)
+    tmpdir.join("main.bkl").write("""
+        toolsets = gnu;
+        submodule one.bkl;
+        submodule two.bkl;
+        """)
+    oldcwd = tmpdir.chdir()
+    try:
+        i = InterpreterForTestSuite()
+        i.process_file("main.bkl")
+    finally:
+        oldcwd.chdir()
+    model = i.model
+    # common.bkl is evaluated only once, local.bkl must be re-evaluated for
+    # every module because it modifies it:
+    assert model._global_imports == set(["common.bkl"])
+    for sub in ("one", "two"):
+        module = [m for m in model.modules if m.name == sub][0]
+        assert module.imports == set(["local.bkl", "common.bkl"])
+        assert module["local_var"].as_py() == "bar"
+        t = module.targets[sub]
+        assert "COMMON" in [x.as_py() for x in t["defines"]]
+
+
+def test_wildcards_in_sources(tmpdir):
+    for f in ["a.cpp", "b.cpp", "c.h", ".hidden.cpp", "sub/d.cpp", "sub/deep/e.cpp", ".git/f.cpp"]:
+        tmpdir.join(f).ensure()
+    tmpdir.join("wildcards.bkl").write("""
+        toolsets = gnu;
+        program p {
+            sources { "*.cpp" "sub/**/*.cpp" }
+            headers { @srcdir/"?.h" }
+        }
+        """)
+    oldcwd = tmpdir.chdir()
+    try:
+        i = InterpreterForTestSuite()
+        i.process_file("wildcards.bkl")
+    finally:
+        oldcwd.chdir()
+    t = i.model.top_module.targets["p"]
+    assert [str(x.filename) for x in t.sources] == [
+            "@top_srcdir/a.cpp", "@top_srcdir/b.cpp",
+            "@top_srcdir/sub/d.cpp", "@top_srcdir/sub/deep/e.cpp"]
+    assert [str(x.filename) for x in t.headers] == ["@top_srcdir/c.h"]
+
+
+def test_directory_scan_cache(tmpdir):
+    tmpdir.join("x/a.c").ensure()
+    tmpdir.join("x/.hidden.c").ensure()
+    os.utime(str(tmpdir.join("x")), (1000000, 1000000))
+    cache = bkl.interpreter.globbing.DirectoryScanCache()
+    assert cache.glob(str(tmpdir), ["x", "*.c"]) == [["x", "a.c"]]
+    assert cache.glob(str(tmpdir), ["x", ".*.c"]) == [["x", ".hidden.c"]]
+    assert cache.glob(str(tmpdir), ["*", "a.c"]) == [["x", "a.c"]]
+    assert cache.glob(str(tmpdir), ["nonexistent", "*.c"]) == []
+
+    cache.save(str(tmpdir.join("cache")))
+
+    # a directory with unchanged mtime is not scanned again...
+    tmpdir.join("x/b.c").ensure()
+    os.utime(str(tmpdir.join("x")), (1000000, 1000000))
+    cache2 = bkl.interpreter.globbing.DirectoryScanCache()
+    cache2.load(str(tmpdir.join("cache")))
+    assert cache2.glob(str(tmpdir), ["x", "*.c"]) == [["x", "a.c"]]
+
+    # ...but a modified one is:
+    os.utime(str(tmpdir.join("x")), (2000000, 2000000))
+    cache3 = bkl.interpreter.globbing.DirectoryScanCache()
+    cache3.load(str(tmpdir.join("cache")))
+    assert cache3.glob(str(tmpdir), ["x", "*.c"]) == [["x", "a.c"], ["x", "b.c"]]
+
+
+def test_glob_recursive(tmpdir):
+    tmpdir.join("a.c").ensure()
+    tmpdir.join("sub/b.c").ensure()
+    tmpdir.join("sub/deep/c.h").ensure()
+    tmpdir.join("sub/.hidden/d.c").ensure()
+    cache = bkl.interpreter.globbing.DirectoryScanCache()
+    assert cache.glob(str(tmpdir), ["**", "*.c"]) == [["a.c"], ["sub", "b.c"]]
+    # trailing "**" matches all files in all subdirectories:
+    assert cache.glob(str(tmpdir), ["sub", "**"]) == [["sub", "b.c"], ["sub", "deep", "c.h"]]
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="requires symlinks")
+def test_glob_symlink_loop(tmpdir):
+    tmpdir.join("sub/a.cpp").ensure()
+    tmpdir.join("sub/loop").mksymlinkto("..")
+    cache = bkl.interpreter.globbing.DirectoryScanCache()
+    assert cache.glob(str(tmpdir), ["**", "*.cpp"]) == [["sub", "a.cpp"]]
+    assert cache.glob(str(tmpdir), ["**"]) == [["sub", "a.cpp"]]
+    # explicitly given symlinks are still followed:
+    assert cache.glob(str(tmpdir), ["sub", "loop", "sub", "*.cpp"]) == [["sub", "loop", "sub", "a.cpp"]]
+
+
+def _parse_with_jobs(monkeypatch):
+    monkeypatch.setattr(bkl.utils, "jobs", 2)
+    monkeypatch.chdir(os.path.join(projects_dir, "submodules"))
+    bkl.parser.parse_file.cache.clear()
+    i = bkl.interpreter.Interpreter()
+    i._parse_referenced_files(bkl.parser.parse_file("main.bkl"))
+    return bkl.parser.parse_file.cache
+
+def _parse_file_ahead_raising(filename):
+    raise RuntimeError("worker failed")
+
+def _parse_file_ahead_dying(filename):
+    os._exit(1)
+
+def test_parse_ahead(monkeypatch):
+    cache = _parse_with_jobs(monkeypatch)
+    assert (os.path.join("lib", "libcommon.bkl"),) in cache
+    assert (os.path.join("child", "child.bkl"),) in cache
+
+def test_parse_ahead_worker_exception(monkeypatch):
+    monkeypatch.setattr(bkl.interpreter, "_parse_file_ahead", _parse_file_ahead_raising)
+    with pytest.raises(RuntimeError):
+        _parse_with_jobs(monkeypatch)
+
+def test_parse_ahead_worker_killed(monkeypatch):
+    monkeypatch.setattr(bkl.interpreter, "_parse_file_ahead", _parse_file_ahead_dying)
+    monkeypatch.setattr(bkl.interpreter, "PARSE_AHEAD_TIMEOUT", 1)
+    # must not hang, the files are parsed serially later instead
+    cache = _parse_with_jobs(monkeypatch)
+    assert (os.path.join("lib", "libcommon.bkl"),) not in cache
+
+
+def test_model_cache(tmpdir):
+    from bkl.interpreter.modelcache import ModelCache
+    main_bkl = os.path.join(projects_dir, 'submodules', 'main.bkl')
+    i = InterpreterForTestSuite()
+    i.cache_dir = str(tmpdir)
+    i.process_file(main_bkl)
+    model_txt = bkl.dumper.dump_project(i.model)
+
+    cached = ModelCache(str(tmpdir), main_bkl).load()
+    assert cached is not None
+    assert bkl.dumper.dump_project(cached) == model_txt
+    # references must point into the loaded model:
+    parts = set([cached] + cached.modules + cached.settings.values())
+    for m in cached.modules:
+        for t in m.targets.itervalues():
+            parts.add(t)
+            parts.update(t.sources)
+            parts.update(t.headers)
+    class CheckReferences(bkl.expr.RewritingVisitor):
+        def reference(self, e):
+            assert e.context in parts
+            return e
+    for v in cached.all_variables():
+        CheckReferences().visit(v.value)
+
+    i2 = InterpreterForTestSuite()
+    i2.cache_dir = str(tmpdir)
+    i2.process_file(main_bkl)
+    assert bkl.dumper.dump_project(i2.model) == model_txt
+
+
+def test_model_export():
+    import json
+    from StringIO import StringIO
+    out = StringIO()
+    i = bkl.dumper.ExportingInterpreter(out)
+    i.limit_toolsets(["gnu"])
+    i.process_file(os.path.join(projects_dir, 'submodules', 'main.bkl'))
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert all(r["toolset"] == "gnu" for r in records)
+    assert records[0]["kind"] == "project"
+    assert records[0]["configurations"] == ["Debug", "Release"]
+    modules = [r for r in records if r["kind"] == "module"]
+    assert modules[0]["parent"] is None
+    assert len(modules[0]["submodules"]) == 2
+    main = [r for r in records if r["kind"] == "target" and r["name"] == "main"][0]
+    assert main["module"] == modules[0]["file"]
+    assert main["variables"]["deps"] == ["common"]
+    assert [s["file"] for s in main["sources"]] == ["@top_srcdir/main.cpp"]
+    assert main["build_nodes"][0]["outputs"] == ["@top_builddir/main"]
+    assert main["build_nodes"][1]["inputs"] == ["@top_srcdir/main.cpp"]
+
+def test_model_export_ninja():
+    import json
+    from StringIO import StringIO
+    out = StringIO()
+    i = bkl.dumper.ExportingInterpreter(out)
+    i.limit_toolsets(["ninja"])
+    i.process_file(os.path.join(projects_dir, 'ninja', 'ninja.bkl'))
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert all(r["toolset"] == "ninja" for r in records)
+    targets = dict((r["name"], r) for r in records if r["kind"] == "target")
+    hello = targets["hello"]["build_nodes"]
+    assert hello[0]["outputs"] == ["@top_builddir/hello"]
+    assert "@top_builddir/version.h" in [o for n in hello for o in n["outputs"]]
+    assert targets["print-cwd"]["build_nodes"][0]["name"] == "print-cwd"
+
+
+def test_incremental_generation(tmpdir, monkeypatch):
+    import bkl.makefile
+    import bkl.parser
+    tmpdir.join("incremental.bkl").write("""
+        toolsets = gnu;
+        submodule inc_one/inc_one.bkl;
+        submodule inc_two/inc_two.bkl;
+        """)
+    tmpdir.join("inc_one", "inc_one.bkl").write("library one {}", ensure=True)
+    tmpdir.join("inc_two", "inc_two.bkl").write("program two { deps = one; }", ensure=True)
+
+    generated = []
+    orig_gen_makefile = bkl.makefile.MakefileToolset._gen_makefile
+    def gen_makefile(self, build_graphs, deps_graph, module):
+        generated.append(module.source_file)
+        return orig_gen_makefile(self, build_graphs, deps_graph, module)
+    monkeypatch.setattr(bkl.makefile.MakefileToolset, "_gen_makefile", gen_makefile)
+
+    def run():
+        del generated[:]
+        bkl.io._all_written_files.clear()
+        bkl.parser.parse_file.cache.clear()
+        i = bkl.interpreter.Interpreter()
+        i.cache_dir = ".cache"
+        i.process_file("incremental.bkl")
+        return sorted(generated)
+
+    main = "incremental.bkl"
+    one = os.path.join("inc_one", "inc_one.bkl")
+    two = os.path.join("inc_two", "inc_two.bkl")
+    oldcwd = tmpdir.chdir()
+    try:
+        assert run() == sorted([main, one, two])
+        assert run() == []
+        # the changed module and its parent, which includes it, are affected:
+        tmpdir.join("inc_two", "inc_two.bkl").write("program two { deps = one; defines = FOO; }")
+        assert run() == sorted([main, two])
+        # ...and so are modules depending on it:
+        tmpdir.join("inc_one", "inc_one.bkl").write("library one { outputdir = @top_builddir/lib; }")
+        assert run() == sorted([main, one, two])
+        # modified outputs are generated again:
+        tmpdir.join("inc_one", "GNUmakefile").write("modified")
+        assert run() == [one]
+        assert "modified" not in tmpdir.join("inc_one", "GNUmakefile").read()
+    finally:
+        oldcwd.chdir()
+        bkl.io._all_written_files.clear()
+
+
+def _generate_project(tmpdir, name, *toolsets, **kwargs):
+    """
+    Generates output of the test project *name* for *toolsets* in a copy of
+    the project in *tmpdir* and returns the directory with the copy. The
+    project file is *name*.bkl unless given in *bklfile* keyword argument.
+    """
+    import shutil
+    srcdir = tmpdir.join("-".join(toolsets), name)
+    shutil.copytree(os.path.join(projects_dir, name), str(srcdir),
+                    ignore=shutil.ignore_patterns("GNUmakefile", "build.ninja",
+                                                  "*.vcproj", "*.vcxproj*", "*.sln",
+                                                  "*_unity[0-9]*.c*"))
+    bkl.io._all_written_files.clear()
+    bkl.parser.parse_file.cache.clear()
+    oldcwd = srcdir.chdir()
+    try:
+        i = bkl.interpreter.Interpreter()
+        i.limit_toolsets(toolsets)
+        i.process_file(kwargs.get("bklfile", "%s.bkl" % name))
+    finally:
+        oldcwd.chdir()
+        bkl.io._all_written_files.clear()
+        bkl.parser.parse_file.cache.clear()
+    srcdir.model = i.model
+    return srcdir
+
+
+def test_ninja_output(tmpdir):
+    ninja = _generate_project(tmpdir, "ninja", "ninja").join("build.ninja").read()
+    # header dependencies are tracked using compiler-generated depfiles:
+    assert "rule cc\n  command = $cmd\n  description = CC $out\n  depfile = $out.d\n  deps = gcc\n" in ninja
+    # generated headers must exist before compiling, but don't cause rebuilds:
+    assert "build hello_hello.o: cc hello.cpp || version.h\n" in ninja
+    assert "build version.h: generate version.h.in\n" in ninja
+    # objects are passed to the linker in a response file:
+    assert "build hello: link hello_hello.o | lib/libutil.a || print-cwd\n" \
+           "  cmd = ${CXX} -o hello ${LDFLAGS} @hello.rsp lib/libutil.a -pthread\n" in ninja
+    assert "build print-cwd: run\n  cmd = echo cwd is: && pwd\n" in ninja
+    assert "build util: phony lib/libutil.a\n" in ninja
+    assert "default all\n" in ninja
+
+
+def test_nonrecursive_makefile(tmpdir):
+    srcdir = _generate_project(tmpdir, "nonrecursive", "gnu")
+    assert not srcdir.join("lib", "GNUmakefile").check()
+    assert not srcdir.join("tools", "GNUmakefile").check()
+    mk = srcdir.join("GNUmakefile").read()
+    assert "$(MAKE)" not in mk
+    assert "all: $(_builddir)main $(_builddir)lib/libutils.a $(_builddir)tools/tool\n" in mk
+    # targets from submodules are built in their subdirectories:
+    assert "$(_builddir)lib/utils_utils.o: lib/utils.cpp " in mk
+    assert "$(_builddir)tools/tool: $(_builddir)tools/tool_tool.o $(_builddir)lib/libutils.a " in mk
+
+
+def test_precompiled_headers(tmpdir):
+    mk = _generate_project(tmpdir, "pch", "gnu").join("GNUmakefile").read()
+    assert "$(_builddir)hello_pch.h.gch: pch.h " in mk
+    assert "$(COMPILER_LAUNCHER) $(CXX) -x c++-header -c -o $@ " in mk
+    assert "$(_builddir)hello_world.o: world.cpp $(_builddir)hello_pch.h.gch " in mk
+    assert "-include $(_builddir)hello_pch.h -Winvalid-pch world.cpp\n" in mk
+
+    # Sun CC doesn't support GCC precompiled headers, they are just not used:
+    mk = _generate_project(tmpdir, "pch", "gnu-suncc").join("Makefile.suncc").read()
+    assert ".gch" not in mk
+    assert "$(_builddir)hello_world.o: world.cpp | $(_builddir).\n" in mk
+
+    ninja = _generate_project(tmpdir, "pch", "ninja").join("build.ninja").read()
+    assert "build hello_pch.h.gch: cc pch.h\n" in ninja
+    assert "build hello_world.o: cc world.cpp hello_pch.h.gch\n" in ninja
+
+    vs2010 = _generate_project(tmpdir, "pch", "vs2010")
+    prj = vs2010.join("hello.vcxproj").read()
+    assert "<PrecompiledHeader>Use</PrecompiledHeader>" in prj
+    assert "<PrecompiledHeaderFile>pch.h</PrecompiledHeaderFile>" in prj
+    assert "Release|Win32'\">Create</PrecompiledHeader>" in prj
+    # the header isn't used without the source creating it:
+    assert "PrecompiledHeader" not in vs2010.join("pchonly.vcxproj").read()
+
+    prj = _generate_project(tmpdir, "pch", "vs2008").join("hello.vcproj").read()
+    assert 'UsePrecompiledHeader="2"' in prj
+    assert 'PrecompiledHeaderThrough="pch.h"' in prj
+    assert 'UsePrecompiledHeader="1"' in prj
+
+
+def test_unity_build(tmpdir):
+    srcdir = _generate_project(tmpdir, "unity", "gnu")
+    assert srcdir.join("hello_unity1.cpp").read().endswith(
+            '#include "main.cpp"\n#include "hello.cpp"\n')
+    assert srcdir.join("hello_unity2.cpp").read().endswith(
+            '#include "world.cpp"\n#include "punctuation.cpp"\n')
+    # there is no unity source for just one C file:
+    assert not srcdir.join("hello_unity3.c").check()
+
+    mk = srcdir.join("GNUmakefile").read()
+    assert "$(_builddir)hello: $(_builddir)hello_greeting.o $(_builddir)hello_special.o " \
+           "$(_builddir)hello_hello_unity1.o $(_builddir)hello_hello_unity2.o " in mk
+    assert "$(_builddir)hello_hello_unity1.o: hello_unity1.cpp " in mk
+    assert "main.cpp" not in mk
+
+    prj = _generate_project(tmpdir, "unity", "vs2010").join("hello.vcxproj").read()
+    assert '<ClCompile Include="main.cpp">\r\n      <ExcludedFromBuild' in prj
+    assert '<ClCompile Include="special.cpp">\r\n      <ExceptionHandling' in prj
+    assert '<ClCompile Include="hello_unity1.cpp" />' in prj
+
+
+def test_unity_sources_shared_by_toolsets(tmpdir):
+    srcdir = _generate_project(tmpdir, "unity", "gnu", "ninja")
+    shared = srcdir.model.shared_outputs
+    assert sorted(os.path.basename(f) for f in shared) == ["hello_unity1.cpp", "hello_unity2.cpp"]
+    assert set(toolset for toolset, text in shared.values()) < set(["gnu", "ninja"])
+    # the state is kept with the model, so another run writes them again:
+    srcdir = _generate_project(tmpdir, "unity", "ninja")
+    assert srcdir.join("hello_unity1.cpp").check()
+
+
+def test_compiler_launcher(tmpdir):
+    mk = _generate_project(tmpdir, "launcher", "gnu").join("GNUmakefile").read()
+    assert "\nCOMPILER_LAUNCHER ?= env\n" in mk
+    assert "\t$(COMPILER_LAUNCHER) $(CC) -c -o $@ " in mk
+    assert "\t$(CXX) -o $@ " in mk
+
+    ninja = _generate_project(tmpdir, "launcher", "ninja").join("build.ninja").read()
+    assert "\nCOMPILER_LAUNCHER = env\n" in ninja
+    assert "  cmd = ${COMPILER_LAUNCHER} ${CC} -c -o hello_hello.o " in ninja
+    assert "  cmd = ${CXX} -o hello " in ninja
+
+
+def _generate_in_workers(tmpdir, monkeypatch, *toolsets):
+    """
+    Generates the submodules test project for *toolsets* both serially and
+    using worker processes and returns contents of all files in both copies.
+    """
+    def _read_files(d):
+        return dict((p.relto(d), p.read()) for p in d.visit() if p.check(file=1))
+    serial = _generate_project(tmpdir.mkdir("serial"), "submodules", *toolsets,
+                               bklfile="main.bkl")
+    monkeypatch.setattr(bkl.utils, "jobs", 3)
+    parallel = _generate_project(tmpdir.mkdir("parallel"), "submodules", *toolsets,
+                                 bklfile="main.bkl")
+    return _read_files(serial), _read_files(parallel)
+
+def test_makefiles_generated_in_workers(tmpdir, monkeypatch):
+    serial, parallel = _generate_in_workers(tmpdir, monkeypatch, "gnu")
+    assert os.path.join("child", "GNUmakefile") in parallel
+    assert parallel == serial
+
+def test_vs_projects_generated_in_workers(tmpdir, monkeypatch):
+    serial, parallel = _generate_in_workers(tmpdir, monkeypatch, "vs2008", "vs2010")
+    assert os.path.join("child", "child.vcxproj") in parallel
+    assert os.path.join("lib", "common.vcproj") in parallel
+    assert parallel == serial
+
+
+def test_ninja_escaping(tmpdir):
+    from bkl.plugins.ninja import _escape_path
+    assert _escape_path("a b:c$d") == "a$ b$:c$$d"
+    # escapes produced by the formatter are kept:
+    assert _escape_path("${builddir}/a$$b") == "${builddir}/a$$b"
+
+    tmpdir.join("sub$dir", "x.c").ensure()
+    tmpdir.join("dollar.bkl").write("""
+        toolsets = ninja;
+        program p { sources { "**/*.c" } }
+        """)
+    bkl.io._all_written_files.clear()
+    oldcwd = tmpdir.chdir()
+    try:
+        i = bkl.interpreter.Interpreter()
+        i.process_file("dollar.bkl")
+    finally:
+        oldcwd.chdir()
+        bkl.io._all_written_files.clear()
+    ninja = tmpdir.join("build.ninja").read()
+    assert "build p_x.o: cc sub$$dir/x.c\n" in ninja
+    assert "-pthread sub$$dir/x.c\n" in ninja
+
+
 def test_file_io_unix(tmpdir):
     p = tmpdir.join("textfile")
     f = bkl.io.OutputFile(str(p), bkl.io.EOL_UNIX)
@@ -68,6 +546,27 @@ def test_file_io_win(tmpdir):
     assert text_read == "one\r\ntwo\r\n"
 
 
+def test_file_io_check(tmpdir):
+    p = tmpdir.join("textfile")
+    p.write("one\n")
+    def check(filename, text):
+        f = bkl.io.OutputFile(str(tmpdir.join(filename)), bkl.io.EOL_UNIX)
+        f.write(text)
+        f.commit()
+    bkl.io.check_only = True
+    try:
+        check("textfile", "one\n")
+        with pytest.raises(bkl.error.OutdatedOutputError):
+            check("textfile2", "one\n")
+        bkl.io.check_all = True
+        check("textfile3", "one\n")
+        assert bkl.io.outdated_files == [str(tmpdir.join("textfile3"))]
+    finally:
+        bkl.io.check_only = bkl.io.check_all = False
+        del bkl.io.outdated_files[:]
+    assert tmpdir.listdir() == [p]
+
+
 def test_expr_as_bool():
     bool_yes = BoolValueExpr(True)
     bool_no = BoolValueExpr(False)
@@ -101,3 +600,122 @@ def test_list_expr_iterator():
     null = NullExpr()
     assert not null
     assert len(null) == 0
+
+
+def test_list_expr_appended():
+    a, b, c, d = [LiteralExpr(x) for x in "abcd"]
+    base = ListExpr([a])
+    ab = base.appended([b])
+    abc = ab.appended([c])
+    abd = ab.appended([d])
+    assert abc.as_py() == ["a", "b", "c"]
+    assert abd.as_py() == ["a", "b", "d"]
+    assert ab.as_py() == ["a", "b"]
+    assert base.as_py() == ["a"]
+    assert len(abc.appended([])) == 3
+    empty = ListExpr([]).appended([])
+    assert not empty
+
+
+def test_position():
+    import cPickle as pickle
+    from bkl.parser.ast import Position
+    a = Position("foo.bkl", 3, 7)
+    b = Position("foo.bkl", 3, 7)
+    assert a == b
+    assert not (a != b)
+    assert a != Position("bar.bkl", 3, 7)
+    assert a != None
+    assert len(set([a, b, Position("foo.bkl", 3)])) == 2
+    assert str(a) == "foo.bkl:3:7"
+    assert str(Position("foo.bkl")) == "foo.bkl"
+    assert str(Position()) == ""
+    assert pickle.loads(pickle.dumps(a, pickle.HIGHEST_PROTOCOL)) == a
+
+
+def test_lru_cache():
+    from bkl.utils import LRUCache
+    c = LRUCache(2)
+    c["a"] = 1
+    c["b"] = 2
+    assert c.get("a") == 1
+    c["c"] = 3 # evicts "b", "a" was used more recently
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert len(c) == 2
+    c["d"] = 4 # evicts "a", its node is reused for "d"
+    c["e"] = 5 # evicts "c"
+    assert c.get("a") is None
+    assert c.get("c") is None
+    assert c.get("d") == 4
+    assert c.get("e") == 5
+    assert len(c) == 2
+
+
+class _RecordsList(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+_main_pid = os.getpid()
+
+def _square_in_worker(x):
+    in_worker = os.getpid() != _main_pid
+    logging.getLogger("bkl.test").warning("square of %d", x)
+    if x == 3 and in_worker:
+        raise RuntimeError("worker failed")
+    return (x * x, in_worker)
+
+def test_map_in_workers(monkeypatch):
+    monkeypatch.setattr(bkl.utils, "jobs", 2)
+    log = _RecordsList()
+    logger = logging.getLogger("bkl.test")
+    logger.addHandler(log)
+    try:
+        results = list(bkl.utils.map_in_workers(_square_in_worker, range(5)))
+    finally:
+        logger.removeHandler(log)
+    assert [r for r, _ in results] == [0, 1, 4, 9, 16]
+    # failed call was repeated in this process:
+    assert [in_worker for _, in_worker in results] == [True, True, True, False, True]
+    # messages from the workers are logged here, in the usual order:
+    assert log.messages[:3] == ["square of 0", "square of 1", "square of 2"]
+    assert log.messages[-2:] == ["square of 3", "square of 4"]
+
+
+def test_memoized_property_with_slots():
+    from bkl.utils import memoized_property
+    calls = []
+    class WithDict(object):
+        @memoized_property
+        def value(self):
+            calls.append(self)
+            return 42
+    class WithSlots(object):
+        __slots__ = ("_memoized_value",)
+        @memoized_property
+        def value(self):
+            calls.append(self)
+            return 42
+    for cls in (WithDict, WithSlots):
+        del calls[:]
+        obj = cls()
+        assert obj.value == 42
+        assert obj.value == 42
+        assert calls == [obj]
+
+
+def test_ordered_set_of_exprs():
+    from bkl.utils import OrderedSet
+    from bkl.expr import comparison_key, PlaceholderExpr
+    foo = LiteralExpr("foo")
+    foo_concat = ConcatExpr([LiteralExpr("f"), LiteralExpr("oo")])
+    cfg = PlaceholderExpr("config")
+    s = OrderedSet([foo, cfg, LiteralExpr("bar"), foo_concat, PlaceholderExpr("config")],
+                   key=comparison_key)
+    assert len(s) == 3
+    assert [str(x) for x in s] == ["foo", "${config}", "bar"]
+    assert list(s)[0] is foo